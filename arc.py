@@ -1,4 +1,3 @@
-from google import genai
 import json
 import os
 import time
@@ -7,14 +6,54 @@ import traceback
 from Graph_Classes.Structure import Node, Graph
 import re
 from clean_and_parse_json import clean_and_parse_json
+from json_stream import JsonFieldStream, JsonRepairParser, JsonRepairError
+from story_schema import STRING, object_schema, array_schema, validate, generate_structured, request_structured, reject_reply, prompt_contents
+from story_context import StoryContext, compact_outline, summarize
+from story_features import story_features
+from story_seed import stable_hash, story_seed
+from story_enrichment import enrich_node, enrich_nodes, ending_outcome, intermediate_outcome
+from story_abilities import ABILITY_CATALOG, ability_tier
+from generation_engine import expand_tree, PipelineStage, DEFAULT_MAX_IN_FLIGHT, DEFAULT_DIALOGUE_WORKERS
+from llm_backend import create_backend
+from llm_cache import CachedClient, create_response_cache
+from rate_limiter import create_rate_limited_client
+from story_journal import StoryJournal
+from lazy_story import LazyStoryTree
+from tracing import Tracer, tracer, traced, trace_export_enabled, export_trace
+from story_writer import write_story_file
 from dotenv import load_dotenv
 # Load environment variables from keys.env
 load_dotenv('keys.env')
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY not found in keys.env")
 
-client = genai.Client(api_key=GOOGLE_API_KEY)
+# Gemini by default; set LLM_BACKEND=fake in keys.env to run offline (see llm_backend.py)
+backend = create_backend()
+
+# Calls are throttled to the API quota and retried when rate limited (see rate_limiter.py)
+rate_limiter = create_rate_limited_client(backend)
+
+# Identical (model, prompt) requests are answered from the on-disk response cache
+response_cache = create_response_cache()
+client = CachedClient(rate_limiter, response_cache)
+
+# Story library version; bump it when prompts or the tree format change so
+# stories generated by older code are not reused
+ARC_VERSION = "3"
+
+# Nodes per LLM request while expanding a tree (STORY_BATCH_SIZE in keys.env),
+# 1 = one request per node
+DEFAULT_BATCH_SIZE = int(os.getenv("STORY_BATCH_SIZE", "1"))
+
+CHOICE_SCHEMA = object_schema({"text": STRING, "consequences": STRING})
+ENDING_SCHEMA = object_schema({"text": STRING})
+
+def expansion_schema(key, choices_per_node):
+    """Schema for the children of a node: {"choices": [...]} or {"endings": [...]} with exactly choices_per_node items"""
+    items = CHOICE_SCHEMA if key == "choices" else ENDING_SCHEMA
+    return object_schema({key: array_schema(items, choices_per_node, choices_per_node)})
+
+def root_schema(choices_per_node):
+    """Schema for the introduction scene and its choices"""
+    return object_schema({"story": STRING, "choices": array_schema(CHOICE_SCHEMA, choices_per_node, choices_per_node)})
 
 class StoryState:
     def __init__(self):
@@ -43,8 +82,12 @@ class StoryState:
         state.theme = data.get("theme", "")  
         return state
 
-def generate_story_arc(theme):
-    """Generate a high-level story arc for the given theme"""
+def generate_story_arc(theme, fallback=True):
+    """Generate a high-level story arc for the given theme
+
+    If generation fails this returns fallback_story_arc(theme), or None
+    with fallback=False.
+    """
     prompt = f"""
     Generate a rich story arc for an interactive narrative based on the {theme} theme.
     Be sure to keep the characters/names the same as in the original theme.
@@ -77,7 +120,12 @@ def generate_story_arc(theme):
         return response.text
     except Exception as e:
         print(f"\nError generating story arc: {e}")
-        return f"Basic adventure with a {theme} setting featuring a hero who must overcome challenges and make critical choices."
+        return fallback_story_arc(theme) if fallback else None
+
+def fallback_story_arc(theme):
+    """Placeholder arc used when none could be generated"""
+    tracer.increment("fallbacks")
+    return f"Basic adventure with a {theme} setting featuring a hero who must overcome challenges and make critical choices."
 
 def generate_story_tree(theme, story_arc, depth=3, choices_per_node=4):
     """Generate a story tree with the specified depth and number of choices per node"""
@@ -382,13 +430,14 @@ def generate_story_tree(theme, story_arc, depth=3, choices_per_node=4):
             story_graph["nodes"][current_id]["is_end"] = True
             
             # Add potential ending outcome
-            if hash(current_id) % 3 == 0:
+            ending_hash = stable_hash(story_seed(theme), current_id, "ending")
+            if ending_hash % 3 == 0:
                 story_graph["nodes"][current_id]["outcome"] = {
                     "health_change": -20,  # Bad ending: lose health
                     "experience_change": 10,
                     "inventory_changes": []
                 }
-            elif hash(current_id) % 3 == 1:
+            elif ending_hash % 3 == 1:
                 story_graph["nodes"][current_id]["outcome"] = {
                     "health_change": 20,  # Good ending: gain health and a special item
                     "experience_change": 30,
@@ -424,11 +473,31 @@ def generate_story_tree(theme, story_arc, depth=3, choices_per_node=4):
     
     return story_graph
 
-def generate_story_node(prompt, is_root=False):
-    """Generate a story node with rich content based on current context"""
+def parse_story_node(response_text):
+    """Parse the story node JSON in a model response, repairing common faults, or None"""
+    with tracer.span("json_repair"):
+        if '{' not in response_text:
+            print(f"JSON boundaries not found in: {response_text.strip()[:100]}...")
+            return None
+        # Code fences, bare keys, quotes, trailing commas and truncation are handled here
+        return clean_and_parse_json(response_text)
+
+def generate_story_node(prompt, is_root=False, schema=None):
+    """Generate a story node with rich content based on current context
+
+    With a schema, the reply is requested as structured output and
+    validated; broken fields are asked for again (see story_schema.py)
+    and None is returned if the node is still invalid.
+    """
     try:
+        if schema is not None:
+            node = generate_structured(client, prompt, schema)
+            if node is not None:
+                print("Node generated successfully")
+            return node
+
         response = client.models.generate_content(
-            contents=[prompt],
+            contents=prompt_contents(prompt),
             model="gemini-2.0-flash",
         )
         
@@ -436,30 +505,10 @@ def generate_story_node(prompt, is_root=False):
             print("Error: Empty response from API")
             return None
             
-        raw_text = response.text.strip()
-        
-        if raw_text.startswith("```"):
-            lines = raw_text.split('\n')
-            if lines[0].startswith("```") and lines[-1].startswith("```"):
-                raw_text = '\n'.join(lines[1:-1])
-            elif lines[0].startswith("```"):
-                raw_text = '\n'.join(lines[1:])
-        
-        raw_text = raw_text.replace("```json", "").replace("```", "").strip()
-        
-        # Try to extract the JSON portion
-        start_idx = raw_text.find('{')
-        end_idx = raw_text.rfind('}') + 1
-        if start_idx < 0 or end_idx <= 0:
-            print(f"JSON boundaries not found in: {raw_text[:100]}...")
-            return None
-            
-        json_text = raw_text[start_idx:end_idx]
-        
-        # Try to clean and parse the JSON to ensure it's valid
-        cleaned_json = clean_and_parse_json(json_text)
+        cleaned_json = parse_story_node(response.text)
         if cleaned_json is None:
             print("Failed to parse node JSON")
+            client.models.evict(contents=prompt_contents(prompt), model="gemini-2.0-flash")
             return None
             
         print("Node generated successfully")
@@ -469,32 +518,404 @@ def generate_story_node(prompt, is_root=False):
         print(traceback.format_exc())
         return None
 
-def return_story_arc(theme):
+def stream_story_node(prompt, on_text, field="story"):
+    """Like generate_story_node, but streams the response and passes the text of field to on_text as it arrives
+
+    The rest of the node is parsed once the response is complete; returns
+    the node, or None if the response could not be parsed.
+    """
+    try:
+        chunks = client.models.generate_content_stream(
+            contents=[prompt],
+            model="gemini-2.0-flash",
+        )
+        # Parsed as it arrives, so nothing is left to do once the last chunk is in
+        parser = JsonRepairParser()
+        field_stream = JsonFieldStream(field)
+        for chunk in chunks:
+            text = chunk.text or ""
+            with tracer.span("json_repair"):
+                parser.feed(text)
+            new_text = field_stream.feed(text)
+            if new_text:
+                on_text(new_text)
+        
+        try:
+            node = parser.finish()
+        except JsonRepairError as e:
+            node = None
+            print(f"Failed to parse node JSON: {e}")
+        if not isinstance(node, dict):
+            if node is not None:
+                print("Failed to parse node JSON")
+            client.models.evict(contents=[prompt], model="gemini-2.0-flash")
+            return None
+        return node
+    except Exception as e:
+        print(f"Error streaming story node: {e}")
+        print(traceback.format_exc())
+        return None
+
+def return_story_arc(theme, fallback=True):
     """Wrapper function to get story arc"""
-    return generate_story_arc(theme)
+    return generate_story_arc(theme, fallback)
 
-def return_story_tree(theme, depth=3, choices_per_node=4):
-    """Generate a full story tree based on the given theme, with proper graph structure"""
-    
-    # Generate the story arc
-    story_arc = return_story_arc(theme)
+def get_narrative_stage(current_depth, depth):
+    """Determine narrative stage based on depth"""
+    stage_threshold_1 = depth / 3
+    stage_threshold_2 = 2 * depth / 3
+    if current_depth < stage_threshold_1:
+        return "Introduction"
+    elif current_depth < stage_threshold_2:
+        return "Middle"
+    else: # current_depth >= stage_threshold_2
+        return "Conclusion"
+
+def build_story_context(theme, story_arc):
+    """The prompt prefix shared by every node of one story: theme, arc and the rules for choices
+
+    Uncached, the arc is sent as a compact outline of at most
+    CONTEXT_ARC_TOKENS (default 400) instead of the full text.
+    """
+    def prefix(arc_text):
+        return f"""
+    You are writing a {theme} interactive story, a few scenes at a time. Be sure to keep the characters/names the same as in the original theme.
+    Overall Story Arc Guidance:
+    {arc_text}
+
+    The story moves through three stages: 'Introduction', 'Middle' and 'Conclusion'.
+    In the 'Conclusion' stage, choices should lead towards the ending pretty quickly.
+    Every choice must start with a verb and describe what the player DOES.
+    Each request below gives a point in the story and the JSON it needs.
+    """
+    arc_tokens = int(os.getenv("CONTEXT_ARC_TOKENS", "400"))
+    return StoryContext(client, prefix(compact_outline(story_arc, arc_tokens)), full_prefix=prefix(story_arc))
+
+def node_path_context(story_graph, node_id, recent_choices=3):
+    """How the story reached node_id, compactly: the opening scene summarized and the last few choices"""
+    parts = node_id.split('_')
+    # node_0, node_0_2, node_0_2_1, ... up to node_id itself
+    path = ["_".join(parts[:i]) for i in range(2, len(parts) + 1)]
+    lines = [f"Story opening: {summarize(story_graph['nodes'][path[0]]['story'])}"]
+    earlier_choices = [story_graph["nodes"][ancestor]["story"] for ancestor in path[1:-1]][-recent_choices:]
+    if earlier_choices:
+        lines.append("Recent choices: " + " -> ".join(summarize(choice, 120) for choice in earlier_choices))
+    return "\n        ".join(lines)
+
+def fetch_node_expansion(story_graph, node_id, current_depth, depth, theme, context, choices_per_node):
+    """Make the LLM call that generates the children (or endings) of a node.
+
+    The prompt is the story's shared context prefix plus a short delta for
+    this node. Only reads from story_graph, so it is safe to run for many
+    nodes at once.
+    """
+    build_start = time.perf_counter()
+    current_node = story_graph["nodes"][node_id]
+    narrative_stage = get_narrative_stage(current_depth, depth)
+    path_context = node_path_context(story_graph, node_id)
+
+    # Check if this node's children will be the final endings
+    is_final_choice_layer = (current_depth == depth - 1)
+
+    if not is_final_choice_layer:
+        # --- Generate Normal Child Nodes with Choices ---
+        child_prompt = f"""
+        This is the '{narrative_stage}' phase of the story (depth {current_depth} of {depth}).
+        {path_context}
+        Current situation: {current_node['story']}
+
+        Generate {choices_per_node} distinct, action-oriented choices for the player, appropriate for the '{narrative_stage}' stage.
+        If the {narrative_stage} is the 'Conclusion' stage, make sure the choices lead towards the ending pretty quickly.
+        Each choice must start with a verb and describe what the player DOES.
+
+        Return a valid JSON object:
+        {{
+            "choices": [
+                {{
+                    "text": "Player action 1 (verb first, fits '{narrative_stage}')",
+                    "consequences": "Immediate result (fits '{narrative_stage}')"
+                }},
+                ... {choices_per_node - 1} more choices ...
+            ]
+        }}
+        """
+        contents = context.contents(child_prompt, node_id)
+        tracer.record("prompt_build", time.perf_counter() - build_start, node_id=node_id)
+        return generate_story_node(contents, schema=expansion_schema("choices", choices_per_node))
+
+    # --- Generate Ending Nodes ---
+    ending_prompt = f"""
+    This branch of the story ({narrative_stage} stage) is reaching its conclusion.
+    {path_context}
+    Current situation leading to the end: {current_node['story']}
+
+    Generate {choices_per_node} distinct narrative endings for this path. Each ending should be a short concluding paragraph (2-4 sentences).
+
+    Return a valid JSON object:
+    {{
+        "endings": [
+            {{"text": "Narrative conclusion for ending 1."}},
+            {{"text": "Narrative conclusion for ending 2."}},
+            ... up to {choices_per_node} endings ...
+        ]
+    }}
+    """
+    contents = context.contents(ending_prompt, node_id)
+    tracer.record("prompt_build", time.perf_counter() - build_start, node_id=node_id)
+    return generate_story_node(contents, schema=expansion_schema("endings", choices_per_node))
+
+def is_valid_expansion(entry, key, choices_per_node):
+    """True if a batched reply item has exactly choices_per_node valid items under key"""
+    return not validate(entry, expansion_schema(key, choices_per_node))
+
+def fetch_node_expansions(story_graph, items, depth, theme, context, choices_per_node):
+    """Generate the children (or endings) of several nodes of the same depth in one LLM call.
+
+    Returns one result per (node_id, depth) item, in the same format as
+    fetch_node_expansion. Each item of the combined reply is validated on
+    its own; items that are missing or malformed are generated separately.
+    """
+    if len(items) == 1:
+        node_id, current_depth = items[0]
+        return [fetch_node_expansion(story_graph, node_id, current_depth, depth, theme, context, choices_per_node)]
+
+    build_start = time.perf_counter()
+    current_depth = items[0][1]
+    narrative_stage = get_narrative_stage(current_depth, depth)
+    is_final_choice_layer = (current_depth == depth - 1)
+    situations = json.dumps(
+        [{"id": node_id, "situation": story_graph["nodes"][node_id]["story"]} for node_id, _ in items],
+        indent=2
+    )
+
+    if not is_final_choice_layer:
+        key = "choices"
+        batch_prompt = f"""
+        This is the '{narrative_stage}' phase of the story.
+
+        Below are {len(items)} separate situations from different branches of the story, each with an id:
+        {situations}
+
+        For EACH situation, generate {choices_per_node} distinct, action-oriented choices for the player, appropriate for the '{narrative_stage}' stage.
+        If the {narrative_stage} is the 'Conclusion' stage, make sure the choices lead towards the ending pretty quickly.
+        Each choice must start with a verb and describe what the player DOES.
+
+        Return a valid JSON object with one entry per situation, using the same ids:
+        {{
+            "nodes": [
+                {{
+                    "id": "<situation id>",
+                    "choices": [
+                        {{
+                            "text": "Player action 1 (verb first, fits '{narrative_stage}')",
+                            "consequences": "Immediate result (fits '{narrative_stage}')"
+                        }},
+                        ... {choices_per_node - 1} more choices ...
+                    ]
+                }},
+                ... one entry for every situation ...
+            ]
+        }}
+        """
+    else:
+        key = "endings"
+        batch_prompt = f"""
+        These branches of the story ({narrative_stage} stage) are reaching their conclusion.
+
+        Below are {len(items)} separate situations leading to the end, each with an id:
+        {situations}
+
+        For EACH situation, generate {choices_per_node} distinct narrative endings for that path. Each ending should be a short concluding paragraph (2-4 sentences).
+
+        Return a valid JSON object with one entry per situation, using the same ids:
+        {{
+            "nodes": [
+                {{
+                    "id": "<situation id>",
+                    "endings": [
+                        {{"text": "Narrative conclusion for ending 1."}},
+                        ... up to {choices_per_node} endings ...
+                    ]
+                }},
+                ... one entry for every situation ...
+            ]
+        }}
+        """
+
+    contents = context.contents(batch_prompt, ",".join(node_id for node_id, _ in items))
+    tracer.record("prompt_build", time.perf_counter() - build_start, batch=len(items))
+    item_schema = expansion_schema(key, choices_per_node)
+    batch_schema = object_schema({"nodes": array_schema(
+        object_schema({"id": STRING, **item_schema["properties"]}), len(items), len(items)
+    )})
+    # Entries are validated one by one below; broken ones are generated (and re-asked) separately
+    try:
+        batch_data = request_structured(client, contents, batch_schema)
+    except Exception as e:
+        print(f"Error generating story node batch: {e}")
+        batch_data = None
+    entries = batch_data.get("nodes", []) if isinstance(batch_data, dict) else []
+    by_id = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if is_valid_expansion(entry, key, choices_per_node):
+            by_id[entry.get("id")] = {key: entry[key]}
+    if batch_data is not None and not by_id:
+        # Nothing in the reply was usable; do not serve it again
+        reject_reply(client, contents, batch_schema)
+
+    results = []
+    for node_id, node_depth in items:
+        if node_id in by_id:
+            results.append(by_id[node_id])
+        else:
+            print(f"Batched reply had no valid {key} for {node_id}, generating it separately")
+            results.append(fetch_node_expansion(story_graph, node_id, node_depth, depth, theme, context, choices_per_node))
+    print(f"Batch of {len(items)} nodes: {len(by_id)} from one request, {len(items) - len(by_id)} generated separately")
+    return results
+
+def apply_node_expansion(story_graph, node_id, current_depth, depth, theme, choices_per_node, generated_data):
+    """Add the children generated for a node to the graph.
+
+    Returns the (node_id, depth) pairs that still need to be expanded.
+    """
+    narrative_stage = get_narrative_stage(current_depth, depth)
+    print(f"Processing node {node_id} (Depth {current_depth}/{depth}, Stage: {narrative_stage})")
+    next_nodes = []
+
+    # Check if this node's children will be the final endings
+    is_final_choice_layer = (current_depth == depth - 1)
+
+    if not is_final_choice_layer:
+        child_data = generated_data
+
+        # Placeholders only if generation and the re-ask both failed; they are flagged, never silent
+        is_fallback = not is_valid_expansion(child_data, "choices", choices_per_node)
+        if is_fallback:
+            print(f"Warning: no valid choices generated for {node_id}, using placeholder choices")
+            tracer.increment("fallbacks")
+            child_data = {
+                "choices": [
+                    {"text": f"Action {i+1}: Explore the {narrative_stage.lower()} stage options.", "consequences": f"You proceed during the {narrative_stage.lower()} phase."}
+                    for i in range(choices_per_node)
+                ]
+            }
+        choices = child_data["choices"]
+
+        # Create child nodes and add them to the graph/queue
+        for i, choice in enumerate(choices):
+            child_id = f"{node_id}_{i+1}"
+            child_story = choice.get("text", f"Continue ({narrative_stage})")
+            child_consequence = choice.get("consequences", "")
+
+            # Add edge
+            story_graph["edges"].append({
+                "from": node_id,
+                "to": child_id,
+                "action": child_story
+            })
+
+            # Create child node
+            story_graph["nodes"][child_id] = {
+                "story": child_story, # Story here is the ACTION taken
+                "is_end": False,      # Will be marked True later if it's the final depth
+                "dialogue": child_consequence
+            }
+            if is_fallback:
+                story_graph["nodes"][child_id]["is_fallback"] = True
+
+            # Scene state and outcome are added once the tree is built (enrich_story_nodes)
+            child_node_data = story_graph["nodes"][child_id]
+            child_node_data["is_end"] = current_depth + 1 >= depth
+
+            # Add to queue if not exceeding depth
+            if not child_node_data["is_end"]:
+                next_nodes.append((child_id, current_depth + 1))
+
+    else: # current_depth == depth - 1: Generate Endings, not Choices
+        ending_data = generated_data
+
+        # Placeholder endings only if generation and the re-ask both failed
+        is_fallback = not is_valid_expansion(ending_data, "endings", choices_per_node)
+        if is_fallback:
+            print(f"Warning: no valid endings generated for {node_id}, using placeholder endings")
+            tracer.increment("fallbacks")
+            ending_data = {"endings": [{"text": f"Conclusion {i+1}: The journey ends here, shaped by your choices during the {narrative_stage}."} for i in range(choices_per_node)]}
+        endings = ending_data["endings"]
+
+        # Create child nodes which ARE the endings
+        for i, ending in enumerate(endings):
+            child_id = f"{node_id}_{i+1}"
+            # The story IS the ending text
+            child_story = ending.get("text", "The adventure concludes.")
+
+            # Add edge representing the choice leading TO this specific end
+            story_graph["edges"].append({
+                "from": node_id,
+                "to": child_id,
+                "action": f"Pursue Ending Path {i+1}" # The action is choosing this ending branch
+            })
+
+            # Create the final ending node
+            story_graph["nodes"][child_id] = {
+                "story": child_story, # Story is the conclusion text
+                "is_end": True,       # This node IS an end
+                "dialogue": ""        # Endings don't usually have consequence dialogue
+            }
+            if is_fallback:
+                story_graph["nodes"][child_id]["is_fallback"] = True
+
+    return next_nodes
+
+def finalize_story_node(node_data, node_id, depth, theme):
+    """Fill in anything a node is still missing: ending flag at max depth, scene state, outcome
+
+    enrich_story_nodes does the same for many nodes at once.
+    """
+    node_depth = len(node_id.split('_')) - 1 # Recalculate depth from ID
+    # The outcome follows the ending flag the node was built with
+    was_end = node_data.get("is_end", False)
+
+    # Make sure nodes at max depth are marked as end nodes (this acts as a safeguard)
+    if node_depth >= depth and not node_data.get("is_end", False):
+        print(f"Safeguard: Marking node {node_id} at depth {node_depth} as ending.")
+        node_data["is_end"] = True
+
+    # Generate scene state if missing
+    if "scene_state" not in node_data:
+        enrich_story_node(node_data, node_id, theme)
+
+    # Ensure outcome exists for all nodes (intermediate or ending)
+    if "outcome" not in node_data or not node_data["outcome"]:
+        if was_end:
+            node_data["outcome"] = generate_ending_outcome(node_id, theme)
+        else:
+            node_data["outcome"] = generate_intermediate_outcome(node_id, theme, node_data["story"])
+
+def build_story_start(theme, depth, choices_per_node, journal=None):
+    """Generate the story arc, the root scene and the root's choices.
+
+    Returns (story_arc, story_graph, queue) where queue holds the
+    (node_id, depth) pairs of the root's children, still to be expanded.
+    """
+    # Generate the story arc (journaled so resumed nodes share the arc earlier ones were built from).
+    # A placeholder arc is not journaled, so a resumed run asks for a real one again
+    if journal:
+        story_arc = journal.cached("arc", lambda: return_story_arc(theme, fallback=False)) or fallback_story_arc(theme)
+    else:
+        story_arc = return_story_arc(theme)
     
     # Generate the story tree
     story_graph = {"nodes": {}, "edges": []}
     
-    # Define a StoryState to track global game state
-    story_state = StoryState()
-    story_state.theme = theme
-    
     # Process the root node (introduction)
-    root_data = generate_story_node(f"""
+    root_prompt = f"""
     Create an introduction for an interactive narrative game set in the world of {theme}.Be sure to keep the characters/names the same as in the original theme.
     You should be sticking to the story arc provided as much as possible, but feel free to deviate if you must:
     Here is the story arc:
     {story_arc}
     This should be the introduction to our story, establishing the setting, main character, and initial situation.
     
-    Just provide a single JSON object containing:
+    Just provide a single JSON object containing the story and exactly {choices_per_node} choices:
     {{
         "story": "rich descriptive text for the introduction scene",
         "choices": [
@@ -502,40 +923,33 @@ def return_story_tree(theme, depth=3, choices_per_node=4):
             {{"text": "action player takes 2", "consequences": "immediate result"}}
         ]
     }}
-    """, is_root=True)
-    
-    if not root_data:
+    """
+    schema = root_schema(choices_per_node)
+    root_data = journal.cached("root", lambda: generate_story_node(root_prompt, is_root=True, schema=schema)) if journal else generate_story_node(root_prompt, is_root=True, schema=schema)
+    
+    # Placeholder opening only if generation and the re-ask both failed; flagged, never silent
+    is_fallback = not root_data
+    if is_fallback:
+        print("Warning: no valid opening scene generated, using a placeholder")
+        tracer.increment("fallbacks")
+        default_choices = [
+            {"text": "Explore the immediate area carefully, looking for clues.", "consequences": "You discover signs of recent activity."},
+            {"text": "Move forward quickly, eager to begin your journey.", "consequences": "You press onward, leaving the safety of familiar surroundings."},
+            {"text": "Take a moment to gather your thoughts and plan your next move.", "consequences": "You consider your options carefully."},
+            {"text": "Look for any hidden paths or secret areas nearby.", "consequences": "You search for less obvious routes."}
+        ]
         root_data = {
             "story": f"You begin your adventure in the world of {theme}. The path ahead is uncertain, but destiny awaits.",
-            "choices": [
-                {"text": "Explore the immediate area carefully, looking for clues.", "consequences": "You discover signs of recent activity."},
-                {"text": "Move forward quickly, eager to begin your journey.", "consequences": "You press onward, leaving the safety of familiar surroundings."}
-            ]
+            "choices": [default_choices[i % len(default_choices)] for i in range(choices_per_node)]
         }
     
-    # Create story graph structure
+    # Nodes waiting to be expanded, as (node_id, depth)
     queue = []
-    visited = set()
     
     # Create root node
     root_id = "node_0"
-    root_story = root_data.get("story", f"You begin your {theme} adventure!")
-    root_choices = root_data.get("choices", [])
-    
-    # Make sure we have exactly choices_per_node choices for root
-    while len(root_choices) < choices_per_node:
-        # Add generic choices to fill up to requested number
-        idx = len(root_choices)
-        choices = [
-            {"text": "Explore the surrounding area carefully, searching for anything useful.", "consequences": "You find signs of recent activity."},
-            {"text": "Proceed cautiously, keeping alert for any danger.", "consequences": "You move forward with careful steps."},
-            {"text": "Take a moment to gather your thoughts and plan your next move.", "consequences": "You consider your options carefully."},
-            {"text": "Look for any hidden paths or secret areas nearby.", "consequences": "You search for less obvious routes."}
-        ]
-        root_choices.append(choices[idx % len(choices)])
-    
-    # Trim to exactly choices_per_node
-    root_choices = root_choices[:choices_per_node]
+    root_story = root_data["story"]
+    root_choices = root_data["choices"]
     
     # Add root node to story graph
     story_graph["nodes"][root_id] = {
@@ -543,9 +957,8 @@ def return_story_tree(theme, depth=3, choices_per_node=4):
         "is_end": False,
         "dialogue": ""
     }
-    
-    # Process root node - add scene state, characters, etc.
-    enrich_story_node(story_graph["nodes"][root_id], root_id, theme)
+    if is_fallback:
+        story_graph["nodes"][root_id]["is_fallback"] = True
     
     # Add root node's children to the queue
     for i, choice in enumerate(root_choices):
@@ -566,251 +979,203 @@ def return_story_tree(theme, depth=3, choices_per_node=4):
             "is_end": False,
             "dialogue": child_consequence
         }
+        if is_fallback:
+            story_graph["nodes"][child_id]["is_fallback"] = True
         
         # Add child to queue for further processing
         queue.append((child_id, 1))  # (node_id, depth)
     
-    # Track visited nodes
-    visited.add(root_id)
-    
-    # BFS to generate the rest of the tree
-    while queue and len(visited) < 4**12: # Increased safety limit slightly
-        node_id, current_depth = queue.pop(0)
+    return story_arc, story_graph, queue
 
-        # Skip if we've visited this node (check visited size for safety limit)
-        if node_id in visited:
-            continue
+def return_story_tree(theme, depth=3, choices_per_node=4, max_in_flight=DEFAULT_MAX_IN_FLIGHT, resume=True, filename=None,
+                      batch_size=DEFAULT_BATCH_SIZE, dialogue_workers=DEFAULT_DIALOGUE_WORKERS):
+    """Generate a full story tree based on the given theme, with proper graph structure
 
-        # Mark as visited
-        visited.add(node_id)
-
-        # Get current node data
-        current_node = story_graph["nodes"][node_id]
-
-        # Enrich the node if needed (e.g., add scene state, characters)
-        if "scene_state" not in current_node:
-            enrich_story_node(current_node, node_id, theme)
-
-        # Determine narrative stage based on depth
-        stage_threshold_1 = depth / 3
-        stage_threshold_2 = 2 * depth / 3
-        narrative_stage = ""
-        if current_depth < stage_threshold_1:
-            narrative_stage = "Introduction"
-        elif current_depth < stage_threshold_2:
-            narrative_stage = "Middle"
-        else: # current_depth >= stage_threshold_2
-            narrative_stage = "Conclusion"
-        print(f"Processing node {node_id} (Depth {current_depth}/{depth}, Stage: {narrative_stage})")
-
-        # Check if this node's children will be the final endings
-        is_final_choice_layer = (current_depth == depth - 1)
-
-        if not is_final_choice_layer:
-            # --- Generate Normal Child Nodes with Choices ---
-            child_prompt = f"""
-            This is the '{narrative_stage}' phase of a {theme} interactive story.
-            Overall Story Arc Guidance: {story_arc}
-            Current situation: {current_node['story']}
-
-            Generate {choices_per_node} distinct, action-oriented choices for the player, appropriate for the '{narrative_stage}' stage.
-            If the {narrative_stage} is the 'Conclusion' stage, make sure the choices lead towards the ending pretty quickly.
-            Each choice must start with a verb and describe what the player DOES.
-
-            Return a valid JSON object:
-            {{
-                "choices": [
-                    {{
-                        "text": "Player action 1 (verb first, fits '{narrative_stage}')",
-                        "consequences": "Immediate result (fits '{narrative_stage}')"
-                    }},
-                    ... {choices_per_node - 1} more choices ...
-                ]
-            }}
-            """
-            child_data = generate_story_node(child_prompt)
+    Each BFS level is expanded concurrently with at most max_in_flight LLM calls
+    in flight, so generation time grows with depth rather than node count.
+    With batch_size > 1, the children of batch_size nodes are requested in
+    a single call. Scene dialogue is generated on its own pool of
+    dialogue_workers threads as nodes are created, alongside the expansion.
 
-            # Default options if generation fails
-            if not child_data or "choices" not in child_data:
-                child_data = {
-                    "choices": [
-                        {"text": f"Action {i+1}: Explore the {narrative_stage.lower()} stage options.", "consequences": f"You proceed during the {narrative_stage.lower()} phase."}
-                        for i in range(choices_per_node)
-                    ]
-                }
+    The tree is saved to filename (default {theme}_story.json). Every LLM
+    result is checkpointed to a .journal.jsonl file next to it as it
+    arrives. If a run is interrupted, calling again with the same settings
+    resumes from the journal instead of regenerating finished nodes
+    (pass resume=False to start over). The journal is deleted once the
+    story file has been saved.
 
-            # Ensure correct number of choices
-            choices = child_data.get("choices", [])
-            while len(choices) < choices_per_node:
-                idx = len(choices)
-                default_choices = [
-                    {"text": f"Investigate further during the {narrative_stage}.", "consequences": "You delve deeper."},
-                    {"text": f"Confront the challenge of the {narrative_stage}.", "consequences": "You face the situation."},
-                    {"text": f"Seek allies during the {narrative_stage}.", "consequences": "You look for help."},
-                    {"text": f"Analyze the {narrative_stage} situation.", "consequences": "You assess your options."}
-                ]
-                choices.append(default_choices[idx % len(default_choices)])
-            choices = choices[:choices_per_node]
-
-            # Create child nodes and add them to the graph/queue
-            for i, choice in enumerate(choices):
-                child_id = f"{node_id}_{i+1}"
-                child_story = choice.get("text", f"Continue ({narrative_stage})")
-                child_consequence = choice.get("consequences", "")
-
-                # Add edge
-                story_graph["edges"].append({
-                    "from": node_id,
-                    "to": child_id,
-                    "action": child_story
-                })
+    The build records its spans and counters into a Tracer of its own;
+    with STORY_TRACE on it is exported next to the story file.
+    """
+    if filename is None:
+        filename = f"{theme.lower().replace(' ', '_')}_story.json"
+    build_trace = Tracer()
+    with tracer.collecting(build_trace):
+        _build_story_tree(theme, depth, choices_per_node, max_in_flight, resume, filename, batch_size, dialogue_workers)
+    if trace_export_enabled():
+        build_trace.print_summary()
+        export_trace(os.path.splitext(filename)[0], {"arc_version": ARC_VERSION}, build_trace)
+    return filename
 
-                # Create child node
-                story_graph["nodes"][child_id] = {
-                    "story": child_story, # Story here is the ACTION taken
-                    "is_end": False,      # Will be marked True later if it's the final depth
-                    "dialogue": child_consequence
-                }
-                enrich_story_node(story_graph["nodes"][child_id], child_id, theme) # Enrich new node
+def _build_story_tree(theme, depth, choices_per_node, max_in_flight, resume, filename, batch_size, dialogue_workers):
+    """Generate and save the story tree for return_story_tree"""
+    journal = StoryJournal(
+        f"{os.path.splitext(filename)[0]}.journal.jsonl",
+        {"theme": theme, "depth": depth, "choices_per_node": choices_per_node},
+        resume=resume
+    )
 
-                # Add outcome for the newly created child node
-                enriched_child_node_data = story_graph["nodes"][child_id]
-                if current_depth + 1 < depth:  # This is an intermediate node that will have children
-                    enriched_child_node_data["is_end"] = False # Explicitly set
-                    enriched_child_node_data["outcome"] = generate_intermediate_outcome(child_id, theme, enriched_child_node_data["story"])
-                else:  # This node is at max_depth, thus an ending node
-                    enriched_child_node_data["is_end"] = True
-                    enriched_child_node_data["outcome"] = generate_ending_outcome(child_id, theme)
+    with tracer.span("story_start"):
+        story_arc, story_graph, queue = build_story_start(theme, depth, choices_per_node, journal)
+    context = build_story_context(theme, story_arc)
 
+    # Define a StoryState to track global game state
+    story_state = StoryState()
+    story_state.theme = theme
 
-                # Add to queue if not exceeding depth
-                if not enriched_child_node_data["is_end"]: # if current_depth + 1 < depth:
-                    queue.append((child_id, current_depth + 1))
-                # else:
-                     # This child node IS the ending because it's at max depth
-                     # story_graph["nodes"][child_id]["is_end"] = True  <- Handled above
-                     # story_graph["nodes"][child_id]["outcome"] = generate_ending_outcome(child_id, theme) <- Handled above
+    dialogue_stage = PipelineStage("dialogue", dialogue_workers)
 
+    def journaled_dialogue(node_id, node_data):
+        # Template dialogue is not journaled, so a resumed run asks for real dialogue again
+        key = f"dialogue:{node_id}"
+        dialogue = journal.get(key)
+        if dialogue is None:
+            dialogue = generate_scene_dialogue(node_data, theme)
+            if not isinstance(dialogue, FallbackDialogue):
+                journal.record(key, dialogue)
+        return dialogue
 
-        else: # current_depth == depth - 1: Generate Endings, not Choices
-            # --- Generate Ending Nodes ---
-            ending_prompt = f"""
-            This branch of the {theme} story ({narrative_stage} stage) is reaching its conclusion.
-            Overall Story Arc Guidance: {story_arc}
-            Current situation leading to the end: {current_node['story']}
+    def queue_dialogue(node_ids):
+        """Start generating dialogue for the nodes that need it, without waiting for it"""
+        for node_id in node_ids:
+            node_data = story_graph["nodes"][node_id]
+            if node_data.get("dialogue"):
+                continue
+            # Dialogue is written from the scene state and characters, so complete the node first
+            finalize_story_node(node_data, node_id, depth, theme)
+            if not node_data.get("is_end", False):
+                dialogue_stage.submit(node_id, tracer.bind(
+                    lambda node_id=node_id, node_data=node_data: journaled_dialogue(node_id, node_data)))
 
-            Generate {choices_per_node} distinct narrative endings for this path. Each ending should be a short concluding paragraph (2-4 sentences).
+    queue_dialogue(list(story_graph["nodes"]))
 
-            Return a valid JSON object:
-            {{
-                "endings": [
-                    {{"text": "Narrative conclusion for ending 1."}},
-                    {{"text": "Narrative conclusion for ending 2."}},
-                    ... up to {choices_per_node} endings ...
-                ]
-            }}
-            """
-            ending_data = generate_story_node(ending_prompt)
-
-            # Default endings if generation fails
-            if not ending_data or "endings" not in ending_data:
-                ending_data = {"endings": [{"text": f"Conclusion {i+1}: The journey ends here, shaped by your choices during the {narrative_stage}."} for i in range(choices_per_node)]}
-
-            endings = ending_data.get("endings", [])
-            # Ensure correct number of endings
-            while len(endings) < choices_per_node:
-                 endings.append({"text": f"Conclusion {len(endings)+1}: An alternate end to the {theme} tale."})
-            endings = endings[:choices_per_node]
-
-            # Create child nodes which ARE the endings
-            for i, ending in enumerate(endings):
-                child_id = f"{node_id}_{i+1}"
-                # The story IS the ending text
-                child_story = ending.get("text", "The adventure concludes.")
-
-                # Add edge representing the choice leading TO this specific end
-                story_graph["edges"].append({
-                    "from": node_id,
-                    "to": child_id,
-                    "action": f"Pursue Ending Path {i+1}" # The action is choosing this ending branch
-                })
+    def fetch(item):
+        with tracer.span("fetch_node", node_id=item[0]):
+            return journal.cached(
+                f"expand:{item[0]}",
+                lambda: fetch_node_expansion(story_graph, item[0], item[1], depth, theme, context, choices_per_node)
+            )
 
-                # Create the final ending node
-                story_graph["nodes"][child_id] = {
-                    "story": child_story, # Story is the conclusion text
-                    "is_end": True,       # This node IS an end
-                    "dialogue": "",       # Endings don't usually have consequence dialogue
-                    "outcome": generate_ending_outcome(child_id, theme) # Add outcome stats
-                }
-                enrich_story_node(story_graph["nodes"][child_id], child_id, theme) # Add final scene state etc.
-                visited.add(child_id) # Mark ending node as visited, won't be processed further
+    def fetch_batch(items):
+        with tracer.span("fetch_batch", node_ids=[node_id for node_id, _ in items]):
+            # Only ask for nodes the journal does not have yet
+            missing = [item for item in items if journal.get(f"expand:{item[0]}") is None]
+            if missing:
+                batch_results = fetch_node_expansions(story_graph, missing, depth, theme, context, choices_per_node)
+                for (node_id, _), data in zip(missing, batch_results):
+                    if data is not None:
+                        journal.record(f"expand:{node_id}", data)
+            return [journal.get(f"expand:{node_id}") for node_id, _ in items]
 
-    # Final pass to ensure all nodes at max depth are marked as end nodes
-    # (This acts as a safeguard)
-    for node_id, node_data in story_graph["nodes"].items():
-        node_depth_check = len(node_id.split('_')) - 1 # Recalculate depth from ID
-        if node_depth_check >= depth:
-            if not node_data.get("is_end", False):
-                 print(f"Safeguard: Marking node {node_id} at depth {node_depth_check} as ending.")
-                 node_data["is_end"] = True
-                 if "outcome" not in node_data: # Add outcome if missing
-                      node_data["outcome"] = generate_ending_outcome(node_id, theme)
+    def apply(item, data):
+        with tracer.span("apply_node", node_id=item[0]):
+            children = apply_node_expansion(story_graph, item[0], item[1], depth, theme, choices_per_node, data)
+        queue_dialogue([child_id for child_id, _ in children])
+        return children
 
-    # Ensure all nodes have characters and scene state (might be redundant but safe)
-    for node_id, node_data in story_graph["nodes"].items():
-        # Generate scene state if missing
-        if "scene_state" not in node_data:
-            enrich_story_node(node_data, node_id, theme)
-        
-        # Ensure outcome exists for all nodes (intermediate or ending)
-        # This is a final safeguard pass for outcomes.
-        node_depth_final_pass = len(node_id.split('_')) - 1
-        if "outcome" not in node_data or not node_data["outcome"]:
-            if node_data.get("is_end", False) or node_depth_final_pass >= depth :
-                node_data["outcome"] = generate_ending_outcome(node_id, theme)
-                if not node_data.get("is_end", False): # ensure is_end is true if at depth
-                    node_data["is_end"] = True
-            else:
-                node_data["outcome"] = generate_intermediate_outcome(node_id, theme, node_data["story"])
-
-        # Generate dialogue if appropriate (avoid for endings?)
-        if not node_data.get("is_end", False) and not node_data.get("dialogue"):
-             dialogue = generate_scene_dialogue(node_data, theme)
-             if dialogue:
-                 node_data["dialogue"] = dialogue
-
-    # Create the full save data structure
-    save_data = {
-        "story_state": {
-            "characters": {
-                "player": {
-                    "health": 100,
-                    "experience": 10,
-                    "mood": "determined",
-                    "status_effects": [],
-                    "inventory": []
-                }
-            },
-            "current_scene": {},
-            "inventory": [],
-            "visited_nodes": ["node_0"],
-            "theme": theme,
-            "max_depth": depth
+    # Expand the rest of the tree level by level, fetching each level concurrently
+    expand_tree(
+        queue,
+        fetch=tracer.bind(fetch),
+        apply=apply,
+        max_in_flight=max_in_flight,
+        fetch_batch=tracer.bind(fetch_batch),
+        batch_size=batch_size
+    )
+
+    # Final pass: complete every node in one batch, then collect the dialogue generated alongside
+    enrich_story_nodes(story_graph["nodes"], depth, theme)
+    with tracer.span("dialogue_wait"):
+        for node_id, dialogue in dialogue_stage.results().items():
+            if dialogue:
+                story_graph["nodes"][node_id]["dialogue"] = dialogue
+
+    # Initial story state saved alongside the tree
+    story_state_data = {
+        "characters": {
+            "player": {
+                "health": 100,
+                "experience": 10,
+                "mood": "determined",
+                "status_effects": [],
+                "inventory": []
+            }
         },
-        "graph": story_graph
+        "current_scene": {},
+        "inventory": [],
+        "visited_nodes": ["node_0"],
+        "theme": theme,
+        "max_depth": depth
     }
     
-    # Save to a file
-    filename = f"{theme.lower().replace(' ', '_')}_story.json"
-    with open(filename, 'w') as f:
-        json.dump(save_data, f, indent=2)
+    # Stream the tree to the file node by node (compact JSON, replaced atomically)
+    with tracer.span("json_dump"):
+        bytes_written = write_story_file(filename, story_state_data, story_graph["nodes"].items(), story_graph["edges"])
+    tracer.increment("bytes_written", bytes_written)
         
     print(f"Story tree saved to {filename}")
-    return filename
+    context.report()
+    fallback_nodes = [node_id for node_id, node_data in story_graph["nodes"].items() if node_data.get("is_fallback")]
+    if fallback_nodes:
+        print(f"Warning: {len(fallback_nodes)} nodes use placeholder content (marked is_fallback): {', '.join(fallback_nodes[:10])}")
+    journal.discard()
+    if response_cache:
+        stats = response_cache.stats()
+        print(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+
+def start_lazy_story(theme, depth=3, choices_per_node=4, prefetch=True):
+    """Start a story that is generated as it is played instead of all up front
+
+    Only the arc, the root scene and its choices are generated here. The
+    returned LazyStoryTree generates a node's children when the player
+    reaches it (see LazyStoryTree.expand), so a session costs a few calls
+    per step of the path taken rather than the whole tree.
+
+    Its spans and counters, including those of later expansions, are
+    recorded into a Tracer of its own (lazy_story.trace).
+    """
+    story_trace = Tracer()
+    with tracer.collecting(story_trace):
+        story_arc, story_graph, queue = build_story_start(theme, depth, choices_per_node)
+        context = build_story_context(theme, story_arc)
+        enrich_story_nodes(story_graph["nodes"], depth, theme)
+
+    def apply(node_id, data):
+        current_depth = len(node_id.split('_')) - 1
+        apply_node_expansion(story_graph, node_id, current_depth, depth, theme, choices_per_node, data)
+        enrich_story_nodes({child_id: story_graph["nodes"][child_id] for child_id in lazy_story.children(node_id)}, depth, theme)
+
+    with tracer.collecting(story_trace):
+        lazy_story = LazyStoryTree(
+            story_graph,
+            fetch=tracer.bind(lambda node_id: fetch_node_expansion(
+                story_graph, node_id, len(node_id.split('_')) - 1, depth, theme, context, choices_per_node)),
+            apply=tracer.bind(apply),
+            prefetch=prefetch,
+            trace=story_trace
+        )
+    lazy_story.prefetch([node_id for node_id, _ in queue])
+    return lazy_story
 
+class FallbackDialogue(str):
+    """Template dialogue used when none could be generated; callers should not journal it"""
+
+@traced("dialogue")
 def generate_scene_dialogue(node_data, theme):
-    """Generate dialogue between player and characters in the scene that's highly specific to the current context"""
-    story_text = node_data["story"].lower()
+    """Generate dialogue between player and characters in the scene that's highly specific to the current context
+
+    If generation fails the template dialogue is returned as a FallbackDialogue.
+    """
     characters = node_data.get("characters", {})
     
     # Filter out any non-dictionary character entries
@@ -859,8 +1224,9 @@ def generate_scene_dialogue(node_data, theme):
                 f"This {location} feels particularly {weather} today. You try to focus on your objective, despite the {ambient} atmosphere.",
                 f"Surveying {location}, you can't shake the feeling of being watched. The {ambient} and {player_mood} state make it hard to concentrate."
             ]
-            import random
-            return f"[Player's Thoughts]: {random.choice(thoughts)}"
+            thought = thoughts[stable_hash(story_seed(theme), node_data["story"], "thought") % len(thoughts)]
+            tracer.increment("fallbacks")
+            return FallbackDialogue(f"[Player's Thoughts]: {thought}")
 
     # Extract key elements from the story text to make dialogue more relevant
     location = node_data.get("scene_state", {}).get("location", "this place")
@@ -868,46 +1234,14 @@ def generate_scene_dialogue(node_data, theme):
     weather = node_data.get("scene_state", {}).get("weather", "clear")
     ambient = node_data.get("scene_state", {}).get("ambient", "quiet")
     
-    # Extract key nouns and concepts from the story
-    nouns = []
-    important_objects = ["sword", "key", "door", "map", "artifact", "treasure", "weapon", "book", 
-                        "device", "machine", "creature", "monster", "ship", "vehicle", "potion", 
-                        "scroll", "computer", "terminal", "gold", "jewel", "crystal", "orb",
-                        "data", "file", "code", "program", "system", "network", "core", "power",
-                        "energy", "shield", "armor", "tool", "equipment", "supplies", "rations",
-                        "medicine", "herb", "plant", "animal", "beast", "spirit", "ghost", "undead"]
-    
-    for word in story_text.split():
-        # Remove punctuation
-        clean_word = word.strip(".,!?;:()'\"")
-        if clean_word in important_objects:
-            nouns.append(clean_word)
+    # Key objects and the primary activity, from one pass over the story (see story_features.py)
+    features = story_features(node_data["story"])
     
-    # Use only the most relevant single object
-    key_object = nouns[0] if nouns else None
-    
-    # Extract primary action/activity in the scene
-    actions = []
-    action_verbs = {
-        "searching": ["search", "look", "seek", "hunt", "explore", "scan", "survey", "probe"],
-        "fighting": ["fight", "battle", "combat", "attack", "defend", "struggle", "clash", "engage"],
-        "escaping": ["escape", "flee", "run", "evade", "avoid", "retreat", "withdraw", "bolt"],
-        "investigating": ["investigate", "examine", "inspect", "study", "analyze", "probe", "research"],
-        "meeting": ["meet", "encounter", "find", "discover", "greet", "approach", "confront"],
-        "travelling": ["travel", "journey", "trek", "voyage", "expedition", "move", "advance"],
-        "hiding": ["hide", "conceal", "stealth", "sneak", "lurk", "skulk", "creep"],
-        "negotiating": ["negotiate", "bargain", "deal", "trade", "barter", "haggle", "discuss"],
-        "hacking": ["hack", "crack", "breach", "infiltrate", "access", "override", "bypass"],
-        "healing": ["heal", "cure", "mend", "restore", "revive", "treat", "nurse"],
-        "crafting": ["craft", "create", "build", "forge", "construct", "assemble", "fashion"]
-    }
-    
-    for action_type, verbs in action_verbs.items():
-        if any(verb in story_text for verb in verbs):
-            actions.append(action_type)
+    # Use only the most relevant single object, the first one mentioned
+    key_object = next(iter(features.keywords("object")), None)
     
     # Get primary action
-    primary_action = actions[0] if actions else "exploring"
+    primary_action = features.first("action", "exploring")
     
     # Select just ONE character for dialogue - makes conversations more focused
     # Prioritize characters that match the primary action context
@@ -987,6 +1321,7 @@ def generate_scene_dialogue(node_data, theme):
             # Ensure we have exactly 3 lines
             if len(cleaned_lines) == 3:
                 return '\n'.join(cleaned_lines)
+            client.models.evict(contents=[prompt], model="gemini-2.0-flash")
     except Exception as e:
         print(f"Error generating dialogue: {e}")
     
@@ -1049,19 +1384,9 @@ def generate_scene_dialogue(node_data, theme):
         player_followup = "I can work with those terms. Let's proceed."
     
     else:  # Default/exploration dialogue
-        # Extract unique scene elements to make default dialogue more specific
-        unique_feature = ""
-        if "ancient" in story_text:
-            unique_feature = "ancient ruins"
-        elif "dark" in story_text:
-            unique_feature = "darkness"
-        elif "light" in story_text:
-            unique_feature = "strange light"
-        elif "sound" in story_text or "noise" in story_text:
-            unique_feature = "unusual sounds"
-        else:
-            # Use ambient or weather as fallback
-            unique_feature = node_data['scene_state'].get('ambient') or node_data['scene_state'].get('weather')
+        # Extract unique scene elements to make default dialogue more specific,
+        # using ambient or weather as fallback
+        unique_feature = features.first("feature") or node_data['scene_state'].get('ambient') or node_data['scene_state'].get('weather')
         
         player_opener = f"What can you tell me about the {unique_feature} in {location}? It seems unusual."
         
@@ -1079,438 +1404,60 @@ def generate_scene_dialogue(node_data, theme):
     dialogue_lines.append(f"[{char_name}]: {response}")
     dialogue_lines.append(f"[You]: {player_followup}")
     print('Manual Dialogue')
+    tracer.increment("fallbacks")
     # Format the final dialogue
-    return "\n".join(dialogue_lines)
+    return FallbackDialogue("\n".join(dialogue_lines))
 
-def generate_special_ability(theme, experience_level, existing_abilities=None):
-    """Generate a special ability for the player based on theme and progress"""
-    if existing_abilities is None:
-        existing_abilities = []
-    
-    # Define ability tiers based on experience level
-    tier = 1
-    if experience_level >= 100:
-        tier = 4  # Master abilities
-    elif experience_level >= 60:
-        tier = 3  # Advanced abilities
-    elif experience_level >= 30:
-        tier = 2  # Intermediate abilities
-    
-    # Define thematic abilities
-    theme_abilities = {
-        "star wars": {
-            1: [
-                {"name": "Force Sense", "description": "Detect hidden objects or dangers nearby", "effect": "detection"},
-                {"name": "Basic Blaster Training", "description": "Improved accuracy with ranged weapons", "effect": "combat"}
-            ],
-            2: [
-                {"name": "Force Push", "description": "Push enemies away or move objects", "effect": "manipulation"},
-                {"name": "Pilot Training", "description": "Better control in vehicle encounters", "effect": "skill"}
-            ],
-            3: [
-                {"name": "Jedi Mind Trick", "description": "Influence weak-minded characters", "effect": "persuasion"},
-                {"name": "Saber Deflection", "description": "Deflect blaster shots", "effect": "defense"}
-            ],
-            4: [
-                {"name": "Force Mastery", "description": "Powerful control over the Force", "effect": "special"},
-                {"name": "One with the Force", "description": "Connect deeply with the Force to reveal paths", "effect": "insight"}
-            ]
-        },
-        "fantasy": {
-            1: [
-                {"name": "Minor Healing", "description": "Heal small wounds", "effect": "healing"},
-                {"name": "Detect Magic", "description": "Sense magical auras and enchantments", "effect": "detection"}
-            ],
-            2: [
-                {"name": "Elemental Touch", "description": "Imbue attacks with elemental power", "effect": "combat"},
-                {"name": "Beast Speech", "description": "Communicate with animals", "effect": "communication"}
-            ],
-            3: [
-                {"name": "Arcane Shield", "description": "Create a magical barrier against harm", "effect": "defense"},
-                {"name": "Enchant Weapon", "description": "Temporarily enhance weapons or tools", "effect": "enhancement"}
-            ],
-            4: [
-                {"name": "Mystical Transformation", "description": "Briefly transform into a powerful creature", "effect": "transformation"},
-                {"name": "Ancient Words", "description": "Speak words of power with dramatic effects", "effect": "control"}
-            ]
-        },
-        "cyberpunk": {
-            1: [
-                {"name": "Neural Interface", "description": "Basic connection to electronic systems", "effect": "tech"},
-                {"name": "Reflex Booster", "description": "Slightly enhanced reaction time", "effect": "speed"}
-            ],
-            2: [
-                {"name": "Subdermal Armor", "description": "Damage resistance from implanted armor", "effect": "defense"},
-                {"name": "Enhanced Vision", "description": "See in darkness or analyze structures", "effect": "perception"}
-            ],
-            3: [
-                {"name": "System Infiltrator", "description": "Bypass security systems more easily", "effect": "hacking"},
-                {"name": "Nano-Healing", "description": "Nanobots repair damage to your body", "effect": "healing"}
-            ],
-            4: [
-                {"name": "Full Conversion", "description": "Major cybernetic enhancements to all systems", "effect": "enhancement"},
-                {"name": "Ghost Protocol", "description": "Temporarily become invisible to tech and cameras", "effect": "stealth"}
-            ]
-        },
-        "horror": {
-            1: [
-                {"name": "Sixth Sense", "description": "Brief warnings before danger", "effect": "warning"},
-                {"name": "Steady Nerves", "description": "Resist fear effects", "effect": "resistance"}
-            ],
-            2: [
-                {"name": "Dark Sight", "description": "See clearly in darkness", "effect": "perception"},
-                {"name": "Blood Memory", "description": "Extract memories from blood traces", "effect": "insight"}
-            ],
-            3: [
-                {"name": "Warding Sign", "description": "Create temporary protective barriers", "effect": "protection"},
-                {"name": "Voice of the Dead", "description": "Briefly communicate with the deceased", "effect": "communication"}
-            ],
-            4: [
-                {"name": "Eldritch Pact", "description": "Call upon otherworldly power at great cost", "effect": "power"},
-                {"name": "Reality Anchor", "description": "Stabilize reality against supernatural warping", "effect": "control"}
-            ]
-        },
-        "detective": {
-            1: [
-                {"name": "Keen Eye", "description": "Notice small details others miss", "effect": "observation"},
-                {"name": "Street Contacts", "description": "Access to information from the streets", "effect": "information"}
-            ],
-            2: [
-                {"name": "Deductive Reasoning", "description": "Connect clues more effectively", "effect": "deduction"},
-                {"name": "Disguise Artist", "description": "Blend in and assume different identities", "effect": "stealth"}
-            ],
-            3: [
-                {"name": "Interrogation Expert", "description": "Extract information more effectively", "effect": "persuasion"},
-                {"name": "Photographic Memory", "description": "Remember details with perfect clarity", "effect": "memory"}
-            ],
-            4: [
-                {"name": "Master Sleuth", "description": "Solve even the most complex mysteries", "effect": "insight"},
-                {"name": "Criminal Psychology", "description": "Predict actions of suspects with uncanny accuracy", "effect": "prediction"}
-            ]
-        },
-        "western": {
-            1: [
-                {"name": "Quick Draw", "description": "Fast reactions in combat situations", "effect": "speed"},
-                {"name": "Wilderness Survival", "description": "Navigate and survive harsh conditions", "effect": "survival"}
-            ],
-            2: [
-                {"name": "Dead Eye", "description": "Improved accuracy with firearms", "effect": "precision"},
-                {"name": "Horse Whisperer", "description": "Special bond with horses and other mounts", "effect": "animal"}
-            ],
-            3: [
-                {"name": "Lawbringer", "description": "Impose order and command respect", "effect": "authority"},
-                {"name": "Native Medicine", "description": "Healing techniques from indigenous knowledge", "effect": "healing"}
-            ],
-            4: [
-                {"name": "Legend of the West", "description": "Your reputation precedes you, opening many doors", "effect": "reputation"},
-                {"name": "True Grit", "description": "Continue fighting effectively even when badly wounded", "effect": "endurance"}
-            ]
-        }
-    }
-    
-    # Generic abilities that work with any theme
-    generic_abilities = {
-        1: [
-            {"name": "Quick Reflexes", "description": "React faster to sudden dangers", "effect": "speed"},
-            {"name": "Keen Senses", "description": "Notice details others might miss", "effect": "perception"}
-        ],
-        2: [
-            {"name": "Rapid Recovery", "description": "Heal faster from injuries", "effect": "healing"},
-            {"name": "Weapon Expertise", "description": "Greater skill with weapons", "effect": "combat"}
-        ],
-        3: [
-            {"name": "Iron Will", "description": "Resist mental influences and fear", "effect": "resistance"},
-            {"name": "Strategic Mind", "description": "Better planning and tactical awareness", "effect": "strategy"}
-        ],
-        4: [
-            {"name": "Hero's Resolve", "description": "Perform extraordinary feats when all seems lost", "effect": "special"},
-            {"name": "Legendary Skill", "description": "Master of your chosen path", "effect": "mastery"}
-        ]
-    }
-    
-    # Determine which ability lists to use
-    ability_lists = [generic_abilities]  # Always include generic abilities
-    
-    # Add theme-specific abilities if applicable
-    for theme_key, abilities in theme_abilities.items():
-        if theme_key in theme.lower():
-            ability_lists.append(abilities)
-            break
-    
-    # Collect all abilities at or below the current tier
-    available_abilities = []
-    for ability_list in ability_lists:
-        for t in range(1, tier + 1):
-            if t in ability_list:
-                available_abilities.extend(ability_list[t])
-    
-    # Filter out abilities the player already has
-    available_abilities = [ability for ability in available_abilities 
-                          if ability["name"] not in existing_abilities]
-    
-    # If no new abilities available, return None
-    if not available_abilities:
-        return None
-    
-    # Select a random ability
-    import random
-    new_ability = random.choice(available_abilities)
-    
-    return new_ability
+def generate_special_ability(theme, experience_level, existing_abilities=None, seed=None):
+    """Generate a special ability for the player based on theme and progress
 
-def enrich_story_node(node_data, node_id, theme):
-    """Add scene state and characters to a story node"""
-    # Extract information from the story text
-    story_text = node_data["story"].lower()
-    
-    # Generate a scene state with location, time of day, weather, and ambient mood
-    # Locations based on theme and story content
-    location = "unknown"
-    
-    # Determine location based on theme and content
-    if "castle" in story_text or "palace" in story_text or "fortress" in story_text:
-        location = "Castle"
-    elif "forest" in story_text or "woods" in story_text or "tree" in story_text:
-        location = "Forest"
-    elif "mountain" in story_text or "peak" in story_text or "cliff" in story_text:
-        location = "Mountains"
-    elif "ship" in story_text or "boat" in story_text or "sea" in story_text or "ocean" in story_text:
-        location = "Ship"
-    elif "cave" in story_text or "cavern" in story_text or "underground" in story_text:
-        location = "Cave"
-    elif "city" in story_text or "town" in story_text or "village" in story_text:
-        location = "Settlement"
-    elif "temple" in story_text or "shrine" in story_text or "altar" in story_text:
-        location = "Temple"
-    elif "desert" in story_text or "sand" in story_text or "dune" in story_text:
-        location = "Desert"
-    elif "jungle" in story_text or "tropical" in story_text:
-        location = "Jungle"
-    elif "lab" in story_text or "laboratory" in story_text or "facility" in story_text:
-        location = "Laboratory"
-    else:
-        # If no specific location in text, use theme-based locations
-        if "star wars" in theme.lower() or "sci-fi" in theme.lower() or "space" in theme.lower():
-            locations = ["Starship Bridge", "Alien Planet", "Space Station", "Imperial Base", "Cantina"]
-            location = locations[hash(node_id) % len(locations)]
-        elif "fantasy" in theme.lower() or "medieval" in theme.lower() or "magic" in theme.lower():
-            locations = ["Ancient Castle", "Enchanted Forest", "Wizard's Tower", "Dragon's Lair", "Dwarven Mines"]
-            location = locations[hash(node_id) % len(locations)]
-        elif "cyberpunk" in theme.lower() or "future" in theme.lower() or "tech" in theme.lower():
-            locations = ["Neon District", "Corporate Tower", "Hacker's Den", "Black Market", "Virtual Reality"]
-            location = locations[hash(node_id) % len(locations)]
-        elif "horror" in theme.lower() or "scary" in theme.lower():
-            locations = ["Abandoned Mansion", "Foggy Cemetery", "Dark Basement", "Cursed Village", "Forgotten Asylum"]
-            location = locations[hash(node_id) % len(locations)]
-        elif "western" in theme.lower() or "cowboy" in theme.lower():
-            locations = ["Dusty Saloon", "Sheriff's Office", "Desert Canyon", "Train Station", "Gold Mine"]
-            location = locations[hash(node_id) % len(locations)]
-        elif "detective" in theme.lower() or "mystery" in theme.lower() or "noir" in theme.lower():
-            locations = ["Crime Scene", "Detective's Office", "Shady Alley", "Upscale Club", "Abandoned Warehouse"]
-            location = locations[hash(node_id) % len(locations)]
-        elif "superhero" in theme.lower() or "avengers" in theme.lower() or "hero" in theme.lower():
-            locations = ["City Rooftop", "Secret Hideout", "Villain's Lair", "Downtown Battlefield", "Research Lab"]
-            location = locations[hash(node_id) % len(locations)]
-        else:
-            # Generic interesting locations if theme doesn't match any category
-            locations = ["Crystal Caves", "Ancient Ruins", "Hidden Valley", "Forgotten Sanctuary", "Misty Lake"]
-            location = locations[hash(node_id) % len(locations)]
-                
-    # Extract time of day and weather
-    time_of_day = "day"
-    weather = "clear"
-    if "night" in story_text:
-        time_of_day = "night"
-    if "rain" in story_text or "storm" in story_text:
-        weather = "rainy"
-    elif "snow" in story_text:
-        weather = "snowy"
-    elif "wind" in story_text or "breeze" in story_text:
-        weather = "windy"
-    
-    # Extract ambient mood
-    ambient = "calm"
-    if "dark" in story_text:
-        ambient = "dark"
-    elif "noisy" in story_text or "busy" in story_text:
-        ambient = "busy"
-    elif "quiet" in story_text:
-        ambient = "quiet"
-    
-    # Add scene state to node data
-    node_data["scene_state"] = {
-        "location": location,
-        "time_of_day": time_of_day,
-        "weather": weather,
-        "ambient": ambient
-    }
-    
-    # Ensure we have a valid characters dictionary
-    if "characters" not in node_data or not isinstance(node_data["characters"], dict):
-        node_data["characters"] = {}
-    
-    # Clean up any invalid character entries
-    characters = {name: data for name, data in node_data["characters"].items() 
-                 if isinstance(data, dict)}
-    
-    # If there are no characters or only the player, add theme-appropriate characters
-    if len(characters) <= 1 and (not characters or "player" in characters):
-        # Generate additional characters based on theme and scene
-        node_depth = len(node_id.split('_')) - 1
-        
-        # Check if the story mentions specific character types
-        has_enemy = any(word in story_text for word in ["enemy", "villain", "foe", "opponent", "adversary", "antagonist"])
-        has_ally = any(word in story_text for word in ["ally", "friend", "companion", "partner", "helper", "supporter"])
-        has_neutral = any(word in story_text for word in ["stranger", "merchant", "traveler", "native", "inhabitant", "civilian"])
-        
-        # Add theme-appropriate characters
-        if "star wars" in theme.lower() or "sci-fi" in theme.lower() or "space" in theme.lower():
-            if has_enemy or hash(node_id) % 3 == 0:
-                characters["Imperial Officer"] = {
-                    "type": "enemy",
-                    "mood": "hostile",
-                    "description": "A stern officer in a gray uniform",
-                    "health": 80
-                }
-            if has_ally or hash(node_id) % 3 == 1:
-                characters["Rebel Scout"] = {
-                    "type": "ally",
-                    "mood": "cautious",
-                    "description": "A dedicated fighter for the rebellion",
-                    "health": 70
-                }
-            if has_neutral or hash(node_id) % 3 == 2:
-                characters["Cantina Patron"] = {
-                    "type": "neutral",
-                    "mood": "indifferent",
-                    "description": "A mysterious individual nursing a drink",
-                    "health": 60
-                }
-        elif "fantasy" in theme.lower() or "medieval" in theme.lower() or "magic" in theme.lower():
-            if has_enemy or hash(node_id) % 3 == 0:
-                characters["Dark Sorcerer"] = {
-                    "type": "enemy",
-                    "mood": "menacing",
-                    "description": "A robed figure with glowing eyes",
-                    "health": 75
-                }
-            if has_ally or hash(node_id) % 3 == 1:
-                characters["Elven Scout"] = {
-                    "type": "ally",
-                    "mood": "friendly",
-                    "description": "A graceful elf with keen eyes",
-                    "health": 65
-                }
-            if has_neutral or hash(node_id) % 3 == 2:
-                characters["Village Elder"] = {
-                    "type": "neutral",
-                    "mood": "wise",
-                    "description": "An aged local with vast knowledge",
-                    "health": 40
-                }
-        elif "cyberpunk" in theme.lower():
-            if has_enemy or hash(node_id) % 3 == 0:
-                characters["Corporate Enforcer"] = {
-                    "type": "enemy",
-                    "mood": "threatening",
-                    "description": "A heavily augmented security operative",
-                    "health": 90
-                }
-            if has_ally or hash(node_id) % 3 == 1:
-                characters["Rogue Netrunner"] = {
-                    "type": "ally",
-                    "mood": "paranoid",
-                    "description": "A skilled hacker with chrome implants",
-                    "health": 60
-                }
-            if has_neutral or hash(node_id) % 3 == 2:
-                characters["Street Vendor"] = {
-                    "type": "neutral",
-                    "mood": "suspicious",
-                    "description": "A local selling various wares",
-                    "health": 50
-                }
-        # Add other theme-specific characters as needed
-        else:  # Default characters for unhandled themes
-            if has_enemy or hash(node_id) % 4 == 0: # Using % 4 to vary from other themes slightly
-                characters["Mysterious Adversary"] = {
-                    "type": "enemy",
-                    "mood": "hostile",
-                    "description": "A shadowy figure with unclear motives.",
-                    "health": 70
-                }
-            if has_ally or hash(node_id) % 4 == 1:
-                characters["Wandering Helper"] = {
-                    "type": "ally",
-                    "mood": "friendly",
-                    "description": "A kind stranger offering assistance.",
-                    "health": 60
-                }
-            if has_neutral or hash(node_id) % 4 == 2: # Could add a third type if hash % 4 == 2
-                characters["Local Inhabitant"] = {
-                    "type": "neutral",
-                    "mood": "cautious",
-                    "description": "A native of this area, wary of outsiders.",
-                    "health": 50
-                }
-            # If no specific hints and hash % 4 == 3, no generic character of these types is added, 
-            # ensuring not every scene for generic themes gets crowded unless hinted.
-            # However, to ensure at least one NPC for dialogue if no hints:
-            if not characters and not (has_enemy or has_ally or has_neutral): # If still empty and no hints
-                 # Add at least one neutral character if the list is still empty
-                if hash(node_id + "_fallback") % 2 == 0:
-                    characters["Quiet Observer"] = {
-                        "type": "neutral",
-                        "mood": "observant",
-                        "description": "Someone is watching from a distance.",
-                        "health": 55
-                    }
-                else:
-                    characters["Local Guide"] = {
-                        "type": "neutral",
-                        "mood": "knowledgeable",
-                        "description": "Someone who seems to know this area well.",
-                        "health": 55
-                    }
+    Abilities come from the catalog in abilities.json (see story_abilities.py).
+    existing_abilities are the names the player already has; pass seed (e.g.
+    story_seed(theme)) for a reproducible pick.
+    """
+    return ABILITY_CATALOG.select(theme, ability_tier(experience_level), existing_abilities or (), seed)
+
+# Outcomes of ending nodes, picked by hash of (story seed, node id); "{theme}" is filled in
+ENDING_OUTCOMES = [
+    {"health_change": -30, "experience_change": 50, "inventory_changes": []},  # Bad ending
+    {"health_change": 25, "experience_change": 400, "inventory_changes": [{"add": "Memento of the {theme} Conclusion"}]},  # Good ending
+    {"health_change": 0, "experience_change": 200, "inventory_changes": []},  # Neutral ending
+    {"health_change": -10, "experience_change": 250, "inventory_changes": [{"add": "Scrap of {theme} Lore"}]}  # Mixed ending
+]
+
+# (values, weights) of the small outcomes of intermediate nodes
+INTERMEDIATE_OUTCOMES = {
+    # Experience: Small amount for progressing
+    "experience": ([0, 10, 20, 30, 50], [0.2, 0.3, 0.2, 0.2, 0.1]),
+    # Health: Chance of small changes based on context
+    "danger": ([0, -1, -2, -3, -5, -7], [0.3, 0.2, 0.2, 0.1, 0.1, 0.1]),
+    "rest": ([0, 1, 2, 3], [0.5, 0.2, 0.2, 0.1]),
+    "neutral": ([-1, 0, 1], [0.15, 0.7, 0.15])
+}
 
+@traced("enrich")
+def enrich_story_node(node_data, node_id, theme):
+    """Add scene state and characters to a story node (see story_enrichment.py)"""
+    enrich_node(node_data, node_id, theme)
 
-    # Update the node's characters
-    node_data["characters"] = characters
+def enrich_story_nodes(nodes, depth, theme):
+    """finalize_story_node for every node of a tree at once (see story_enrichment.enrich_nodes)"""
+    with tracer.span("enrich_batch", nodes=len(nodes)):
+        enrich_nodes(nodes, depth, theme, ENDING_OUTCOMES, INTERMEDIATE_OUTCOMES)
 
+@traced("outcomes")
 def generate_ending_outcome(node_id, theme):
     """Generates a basic outcome dictionary for an ending node."""
-    outcome_hash = hash(node_id)
-    if outcome_hash % 4 == 0: # Bad ending
-        return {"health_change": -30, "experience_change": 50, "inventory_changes": []}
-    elif outcome_hash % 4 == 1: # Good ending
-         return {"health_change": 25, "experience_change": 400, "inventory_changes": [{"add": f"Memento of the {theme} Conclusion"}]}
-    elif outcome_hash % 4 == 2: # Neutral ending
-         return {"health_change": 0, "experience_change": 200, "inventory_changes": []}
-    else: # Mixed ending
-         return {"health_change": -10, "experience_change": 250, "inventory_changes": [{"add": f"Scrap of {theme} Lore"}]}
+    return ending_outcome(node_id, theme, ENDING_OUTCOMES)
 
+@traced("outcomes")
 def generate_intermediate_outcome(node_id, theme, story_text):
-    """Generates a small, randomized outcome for intermediate nodes."""
-    import random
-    outcome = {
-        "health_change": 0,
-        "experience_change": 0,
-        "inventory_changes": []
-    }
-    story_text_lower = story_text.lower()
+    """Generates a small, randomized outcome for intermediate nodes.
 
-    # Experience: Small amount for progressing
-    outcome["experience_change"] = random.choices([0, 10, 20, 30, 50], weights=[0.2, 0.3, 0.2, 0.2, 0.1], k=1)[0]
-
-    # Health: Chance of small changes based on context
-    if any(keyword in story_text_lower for keyword in ["danger", "fight", "trap", "struggle", "injury", "wound", "attack", "battle"]):
-        outcome["health_change"] = random.choices([0, -1, -2, -3, -5, -7], weights=[0.3, 0.2, 0.2, 0.1, 0.1, 0.1], k=1)[0]
-    elif any(keyword in story_text_lower for keyword in ["rest", "safe", "recover", "heal", "respite", "calm"]):
-        outcome["health_change"] = random.choices([0, 1, 2, 3], weights=[0.5, 0.2, 0.2, 0.1], k=1)[0]
-    else:  # Neutral or general exploration
-        outcome["health_change"] = random.choices([-1, 0, 1], weights=[0.15, 0.7, 0.15], k=1)[0]
-
-    return outcome
+    The draws are seeded from (story seed, node id), so a node gets the same
+    outcome in every run.
+    """
+    return intermediate_outcome(node_id, theme, story_text, INTERMEDIATE_OUTCOMES)
 
 if __name__ == "__main__":
     print("Welcome to the Predetermined Story Generator!")
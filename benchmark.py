@@ -0,0 +1,363 @@
+"""
+Offline benchmarks for story generation, using the fake LLM backend.
+
+No API key or network access is needed. Examples:
+
+    python benchmark.py tree --depth 5 --choices 4 --latency 0.5
+    python benchmark.py predetermined --depth 4 --profile
+    python benchmark.py tree --depth 4 --trace results/tree
+    python benchmark.py load --file visuals/star_wars_story.json
+    python benchmark.py web --sessions 8 --turns 3 --failure-rate 0.05
+    python benchmark.py json --samples 500
+    python benchmark.py keywords --samples 500
+    python benchmark.py enrich --samples 10000
+"""
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def configure_fake_backend(args):
+    """Point every generator at the fake backend; must run before arc/test_arc/webarc are imported"""
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY"] = str(args.latency)
+    os.environ["FAKE_LLM_LATENCY_JITTER"] = str(args.jitter)
+    os.environ["FAKE_LLM_FAILURE_RATE"] = str(args.failure_rate)
+    os.environ["FAKE_LLM_SEED"] = str(args.seed)
+    os.environ["LLM_RETRY_BASE_DELAY"] = str(args.retry_delay)
+    if not args.cache:
+        os.environ["LLM_CACHE"] = "off"
+
+def bench_tree(args):
+    """Time arc.return_story_tree"""
+    import arc
+    filename = arc.return_story_tree(args.theme, args.depth, args.choices, max_in_flight=args.in_flight,
+                                    batch_size=args.batch_size)
+    return {"file": filename, "llm_calls": arc.backend.calls, "llm_failures": arc.backend.failures,
+            **arc.rate_limiter.stats()}
+
+def bench_predetermined(args):
+    """Time test_arc.generate_predetermined_story"""
+    import test_arc
+    graph, _ = test_arc.generate_predetermined_story(args.theme, args.depth, batch_size=args.batch_size)
+    return {"nodes": len(graph.adjacency_list), "llm_calls": test_arc.backend.calls,
+            "llm_failures": test_arc.backend.failures, **test_arc.rate_limiter.stats()}
+
+def bench_web(args):
+    """Play concurrent sessions against the Flask app through its test client
+
+    A story that is not in the library yet is generated as a background
+    job: /start_game answers 202, the session polls /jobs/<id> until the
+    job is done (timed as story_job) and then starts the game again.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "web_ui"))
+    from app import app, story_jobs
+    import webarc
+
+    def play(session_idx):
+        client = app.test_client()
+        timings = []
+        game = {
+            "theme": f"{args.theme} {session_idx}",  # separate story files per session
+            "depth": args.depth,
+            "choices_per_node": args.choices,
+            "player_name": f"Player {session_idx}"
+        }
+        start = time.perf_counter()
+        response = client.post("/start_game", json=game)
+        timings.append(("start_game", time.perf_counter() - start, response.status_code))
+        if response.status_code == 202:
+            job_id = response.get_json()["job_id"]
+            start = time.perf_counter()
+            job = response.get_json()
+            while job.get("status") not in ("done", "failed"):
+                time.sleep(0.05)
+                job = client.get(f"/jobs/{job_id}").get_json()
+            timings.append(("story_job", time.perf_counter() - start, 200 if job["status"] == "done" else 500))
+            if job["status"] != "done":
+                return timings
+            start = time.perf_counter()
+            response = client.post("/start_game", json=game)
+            timings.append(("start_game", time.perf_counter() - start, response.status_code))
+        if response.status_code != 200:
+            return timings
+        for _ in range(args.turns):
+            start = time.perf_counter()
+            response = client.post("/make_choice", json={"choice_index": 0})
+            timings.append(("make_choice", time.perf_counter() - start, response.status_code))
+            if response.status_code != 200 or response.get_json().get("is_end"):
+                break
+        return timings
+
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        results = list(pool.map(play, range(args.sessions)))
+    # Let background generation finish before the interpreter starts shutting down
+    story_jobs.shutdown(wait=True)
+
+    summary = {"sessions": args.sessions, "llm_calls": webarc.backend.calls, "llm_failures": webarc.backend.failures,
+               **webarc.rate_limiter.stats()}
+    for route in ("start_game", "story_job", "make_choice"):
+        latencies = sorted(t for timings in results for name, t, _ in timings if name == route)
+        # 202 is /start_game handing a new story to a background job, not an error
+        errors = sum(1 for timings in results for name, _, status in timings if name == route and status not in (200, 202))
+        if latencies:
+            summary[f"{route}_p50"] = round(latencies[len(latencies) // 2], 3)
+            summary[f"{route}_max"] = round(latencies[-1], 3)
+            summary[f"{route}_errors"] = errors
+    return summary
+
+def bench_load(args):
+    """Compare loading a story file as JSON with opening its binary .story copy"""
+    from story_format import convert_json_to_binary, load_story_file
+    start = time.perf_counter()
+    with open(args.file, 'r') as f:
+        story_data = json.load(f)
+    json_time = time.perf_counter() - start
+    graph = story_data["graph"]
+    nodes = graph["nodes"] if "nodes" in graph and "edges" in graph else graph
+    node_id = list(nodes)[-1]
+
+    binary_path = convert_json_to_binary(args.file)
+    start = time.perf_counter()
+    story = load_story_file(binary_path)
+    binary_nodes = story["graph"]["nodes"] if not story.flat_graph else story["graph"]
+    assert binary_nodes[node_id]["story"] == nodes[node_id]["story"]
+    binary_time = time.perf_counter() - start
+    story.close()
+    return {"nodes": len(nodes), "json_load_ms": round(json_time * 1000, 2),
+            "binary_open_and_lookup_ms": round(binary_time * 1000, 2),
+            "json_bytes": os.path.getsize(args.file), "binary_bytes": os.path.getsize(binary_path)}
+
+def legacy_clean_and_parse_json(raw_text):
+    """The regex clean-up clean_and_parse_json used before the repairing parser, without its fallback nodes"""
+    raw_text = raw_text.strip()
+    raw_text = re.sub(r"^```[a-zA-Z]*", "", raw_text)
+    raw_text = raw_text.replace("```", "")
+    start = raw_text.find("{")
+    end = raw_text.rfind("}")
+    if start == -1 or end == -1:
+        raise ValueError("JSON boundaries not found")
+    json_str = raw_text[start:end+1]
+    json_str = re.sub(r",\s*([}}\]])", r"\1", json_str)
+    json_str = re.sub(r'([{,]\s*)(\w+)(\s*:)', r'\1"\2"\3', json_str)
+    in_string = False
+    result = []
+    for i, char in enumerate(json_str):
+        if char == '"':
+            backslash_count = 0
+            j = i - 1
+            while j >= 0 and json_str[j] == '\\':
+                backslash_count += 1
+                j -= 1
+            if backslash_count % 2 == 1:
+                result.append(char)
+                continue
+            in_string = not in_string
+        elif char == "'" and not in_string:
+            result.append('"')
+            continue
+        result.append(char)
+    return json.loads(''.join(result))
+
+# Faults seen in real model replies, applied to clean JSON to build the corpus
+JSON_FAULTS = {
+    "fence": lambda text, rng: f"```json\n{text}\n```",
+    "prose": lambda text, rng: f"Here is the next scene:\n{text}\nLet me know if you need changes.",
+    "bare_keys": lambda text, rng: re.sub(r'"(\w+)":', r'\1:', text),
+    "single_quotes": lambda text, rng: re.sub(r'"((?:[^"\\\']|\\.)*)"', r"'\1'", text),
+    "trailing_comma": lambda text, rng: re.sub(r'([\]}"\d])(\s*[\]}])', r'\1,\2', text),
+    "truncated": lambda text, rng: text[:int(len(text) * rng.uniform(0.6, 0.95))],
+    "raw_newline": lambda text, rng: text.replace(". ", ".\n", 1),
+}
+
+def json_corpus(args):
+    """(fault, text, expected) triples: cached replies as they are, then fake replies with injected faults"""
+    corpus = []
+    cache_path = os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite")
+    if os.path.exists(cache_path):
+        conn = sqlite3.connect(cache_path)
+        try:
+            rows = conn.execute("SELECT response FROM responses WHERE response LIKE '%{%' LIMIT ?", (args.samples,)).fetchall()
+        except sqlite3.Error as e:
+            print(f"Could not read the response cache: {e}")
+            rows = []
+        conn.close()
+        for (text,) in rows:
+            corpus.append(("cached", text, None))
+
+    from llm_backend import FakeBackend
+    backend = FakeBackend(seed=args.seed)
+    rng = random.Random(args.seed)
+    prompts = ['"scene_state"', '"arc": [', '"choices"', '"nodes": [ "scene_state"', '"endings"']
+    faults = ["none"] + sorted(JSON_FAULTS)
+    for i in range(args.samples):
+        text = backend._respond(f"{prompts[i % len(prompts)]} {args.choices} choices #{i}", rng)
+        fault = faults[i % len(faults)]
+        expected = json.loads(text)
+        if fault != "none":
+            text = JSON_FAULTS[fault](text, rng)
+        if fault == "raw_newline":
+            # The newline is part of the text, only unescaped
+            expected = json.loads(text.replace("\n", "\\n"))
+        corpus.append((fault, text, expected))
+    return corpus
+
+def bench_json(args):
+    """Compare the repairing JSON parser with the old regex clean-up on good and broken replies"""
+    from json_stream import parse_json
+    corpus = json_corpus(args)
+    parsers = {"repair": parse_json, "legacy": legacy_clean_and_parse_json}
+    result = {"samples": len(corpus)}
+    for name, parse in parsers.items():
+        parsed = 0
+        exact = 0
+        by_fault = {}
+        start = time.perf_counter()
+        for fault, text, expected in corpus:
+            try:
+                value = parse(text)
+            except Exception:
+                value = None
+            ok = isinstance(value, (dict, list)) and len(value) > 0
+            parsed += ok
+            exact += ok and value == expected
+            hits = by_fault.setdefault(fault, [0, 0])
+            hits[0] += ok
+            hits[1] += 1
+        elapsed = time.perf_counter() - start
+        result[f"{name}_ms_per_reply"] = round(elapsed * 1000 / max(1, len(corpus)), 3)
+        result[f"{name}_parsed"] = f"{parsed}/{len(corpus)}"
+        result[f"{name}_exact"] = exact
+        result[f"{name}_by_fault"] = ", ".join(f"{fault} {ok}/{total}" for fault, (ok, total) in sorted(by_fault.items()))
+    return result
+
+def legacy_keyword_scan(text):
+    """The substring checks enrichment used before story_features: one scan of the text per keyword"""
+    from story_features import STORY_VOCABULARY
+    text = text.lower()
+    return {(group, tag) for group, tags in STORY_VOCABULARY.items()
+            for tag, keywords in tags.items() if any(keyword in text for keyword in keywords)}
+
+def bench_keywords(args):
+    """Time keyword classification of fake scenes against the old substring scans, at growing scene lengths"""
+    from llm_backend import FakeBackend
+    from story_features import STORY_FEATURES
+    backend = FakeBackend(seed=args.seed)
+    rng = random.Random(args.seed)
+    result = {"samples": args.samples}
+    for sentences in (3, 12, 48):
+        texts = [backend._scene(rng, sentences) for _ in range(args.samples)]
+        timings = {}
+        found = {}
+        for name, classify in (("classifier", lambda text: set(STORY_FEATURES.classify(text).found)),
+                               ("legacy", legacy_keyword_scan)):
+            start = time.perf_counter()
+            found[name] = [classify(text) for text in texts]
+            timings[name] = time.perf_counter() - start
+        chars = sum(len(text) for text in texts) // len(texts)
+        result[f"{chars}_chars_us_per_scene"] = ", ".join(
+            f"{name} {elapsed * 1e6 / len(texts):.0f}" for name, elapsed in timings.items())
+        # Legacy-only tags are substring hits inside other words ("sea" in "search", see
+        # test_story_features.py); classifier-only tags are forms the substrings missed ("studied")
+        pairs = list(zip(found["classifier"], found["legacy"]))
+        result[f"{chars}_chars_legacy_only_tags"] = sum(len(old - new) for new, old in pairs)
+        result[f"{chars}_chars_classifier_only_tags"] = sum(len(new - old) for new, old in pairs)
+    return result
+
+def bench_enrich(args):
+    """Time enriching a tree's worth of fake scenes node by node against enrich_story_nodes"""
+    import copy
+    import arc
+    import story_enrichment
+    from llm_backend import FakeBackend
+    backend = FakeBackend(seed=args.seed)
+    rng = random.Random(args.seed)
+    nodes = {}
+    for i in range(args.samples):
+        node_id = f"node_0_{i + 1}"
+        nodes[node_id] = {"story": backend._scene(rng, 6), "is_end": rng.random() < 0.5, "dialogue": ""}
+    per_node = copy.deepcopy(nodes)
+    start = time.perf_counter()
+    for node_id, node_data in per_node.items():
+        arc.finalize_story_node(node_data, node_id, args.depth, args.theme)
+    per_node_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    arc.enrich_story_nodes(nodes, args.depth, args.theme)
+    batch_elapsed = time.perf_counter() - start
+    return {
+        "nodes": len(nodes),
+        "numpy": story_enrichment.np is not None,
+        "per_node_ms": round(per_node_elapsed * 1000, 1),
+        "batch_ms": round(batch_elapsed * 1000, 1),
+        "identical": per_node == nodes
+    }
+
+BENCHMARKS = {
+    "tree": bench_tree,
+    "predetermined": bench_predetermined,
+    "web": bench_web,
+    "load": bench_load,
+    "json": bench_json,
+    "keywords": bench_keywords,
+    "enrich": bench_enrich
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark story generation offline with the fake LLM backend")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--theme", default="Fantasy")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--choices", type=int, default=2)
+    parser.add_argument("--in-flight", type=int, default=8, help="max concurrent LLM calls per tree level")
+    parser.add_argument("--batch-size", type=int, default=1, help="sibling nodes generated per LLM call")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM latency per call in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency per call in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of fake calls that fail with a 429")
+    parser.add_argument("--retry-delay", type=float, default=0.05, help="base delay before retrying a failed call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache", action="store_true", help="keep the on-disk response cache enabled")
+    parser.add_argument("--file", help="story JSON file for the load benchmark")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent players for the web benchmark")
+    parser.add_argument("--turns", type=int, default=3, help="choices made per player for the web benchmark")
+    parser.add_argument("--samples", type=int, default=300, help="replies parsed by the json benchmark, scenes classified by keywords, nodes enriched by enrich")
+    parser.add_argument("--trace", metavar="PREFIX", help="write PREFIX.trace.json and PREFIX.prom with stage timings")
+    parser.add_argument("--profile", action="store_true", help="print the top functions by cumulative time")
+    args = parser.parse_args()
+
+    configure_fake_backend(args)
+
+    profiler = cProfile.Profile() if args.profile else None
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    result = BENCHMARKS[args.benchmark](args)
+    if profiler:
+        profiler.disable()
+    elapsed = time.perf_counter() - start
+    from tracing import tracer, export_trace
+
+    print("\n" + "=" * 20 + f" BENCHMARK: {args.benchmark} " + "=" * 20)
+    print(f"Wall time: {elapsed:.2f}s")
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+    tracer.print_summary()
+    if args.trace:
+        export_trace(args.trace, {"benchmark": args.benchmark})
+
+    if profiler:
+        # Note: cProfile only sees the main thread, so worker threads show up as waits
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(25)
+        print(output.getvalue())
+
+if __name__ == "__main__":
+    main()
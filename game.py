@@ -2,7 +2,17 @@ import time
 import json
 import os
 import textwrap
-from arc import return_story_tree, generate_scene_dialogue, generate_special_ability, generate_story_node
+import copy
+from collections.abc import MutableMapping
+from lazy_story import lazy_story_enabled
+from story_library import get_or_create_story, has_story
+from speculation import create_speculator
+from story_writer import StreamedObject
+from save_log import SaveLog, read_save
+from story_format import ensure_binary_story, load_story_file
+from story_seed import stable_hash
+from arc import ARC_VERSION, client as llm_client, return_story_tree, start_lazy_story, generate_scene_dialogue, generate_special_ability, generate_story_node, stream_story_node
+from json_stream import stream_text_enabled
 
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
@@ -158,6 +168,49 @@ def print_box(text, width=70, padding=1):
         print(empty)
     print(horizontal)
 
+def print_box_streamed(generate, width=70, padding=1):
+    """Print a box like print_box while generate(on_text) streams the text into it
+
+    Words are printed as soon as they are complete. Returns whatever
+    generate returns.
+    """
+    inner = int(width) - 2
+    horizontal = "+" + "-" * width + "+"
+    empty = "|" + " " * width + "|"
+    print(horizontal)
+    for _ in range(padding):
+        print(empty)
+    state = {"length": 0, "word": ""}
+
+    def write_word(word):
+        if state["length"] and state["length"] + 1 + len(word) > inner:
+            print(" " * (inner - state["length"]) + " |")
+            print("| ", end="")
+            state["length"] = 0
+        if state["length"]:
+            print(" ", end="")
+            state["length"] += 1
+        print(word, end="", flush=True)
+        state["length"] += len(word)
+
+    def on_text(text):
+        for char in text:
+            if not char.isspace():
+                state["word"] += char
+            elif state["word"]:
+                write_word(state["word"])
+                state["word"] = ""
+
+    print("| ", end="", flush=True)
+    result = generate(on_text)
+    if state["word"]:
+        write_word(state["word"])
+    print(" " * max(0, inner - state["length"]) + " |")
+    for _ in range(padding):
+        print(empty)
+    print(horizontal)
+    return result
+
 def print_dialogue_box(dialogue_text, width=70):
     """
     Print dialogue between characters in a styled box with proper formatting.
@@ -206,21 +259,26 @@ def print_dialogue_box(dialogue_text, width=70):
     
     print(horizontal)
 
-def enrich_node_with_dialogue(node, theme):
-    """Add dialogue to a node if it doesn't already have it or if existing text isn't formatted dialogue."""
-    # Check if existing dialogue is already properly formatted character/player dialogue
-    is_existing_dialogue_formatted = False
+def node_needs_dialogue(node):
+    """True unless the node already has properly formatted character/player dialogue"""
     if "dialogue" in node and node["dialogue"] and isinstance(node["dialogue"], str):
         # Simple check: does it contain markers of our dialogue format?
         if "[You]:" in node["dialogue"] or "]:" in node["dialogue"] or "[Player's Thoughts]:" in node["dialogue"]:
-            is_existing_dialogue_formatted = True
+            return False
+    return True
+
+def enrich_node_with_dialogue(node, theme, generated_dialogue=None):
+    """Add dialogue to a node if it doesn't already have it or if existing text isn't formatted dialogue.
 
-    if is_existing_dialogue_formatted:
+    generated_dialogue can be passed in when it was already generated ahead of time.
+    """
+    if not node_needs_dialogue(node):
         return # Already has good dialogue
 
     # If we are here, either no dialogue, or it's not well-formatted (e.g. just consequence text)
     # So, attempt to generate fresh dialogue.
-    generated_dialogue = generate_scene_dialogue(node, theme)
+    if generated_dialogue is None:
+        generated_dialogue = generate_scene_dialogue(node, theme)
     if generated_dialogue:
         node["dialogue"] = generated_dialogue
     # If generate_scene_dialogue returns empty (e.g. it couldn't determine good dialogue 
@@ -229,6 +287,98 @@ def enrich_node_with_dialogue(node, theme):
     # This is generally acceptable, as it avoids overwriting potentially useful 
     # (though not well-formatted) consequence text if new dialogue isn't generated.
 
+def saved_journey(saved, nodes, theme, max_depth):
+    """Node ids along the journey in a save, if it can be continued in this story, else None"""
+    try:
+        state = saved["story_state"]
+        choice_path = [str(step) for step in state["visited_nodes"]]
+        if state.get("theme") != theme or state.get("max_depth") != max_depth or len(choice_path) < 2:
+            return None
+        node_ids = ["node_0"]
+        for step in choice_path[1:]:
+            node_ids.append(node_ids[-1] + f"_{step}")
+        if any(node_id not in nodes for node_id in node_ids) or nodes[node_ids[-1]].get("is_end"):
+            return None
+        if len(choice_path) >= max_depth:
+            return None
+        return node_ids
+    except Exception as e:
+        print(f"Could not read the saved journey: {e}")
+        return None
+
+def get_path_nodes(nodes, choice_path):
+    """Nodes visited after the root, following choice_path (e.g. ["0", "2", "1"])"""
+    path_nodes = []
+    node_id = "node_0"
+    for idx in range(1, len(choice_path)):
+        node_id = node_id + f"_{choice_path[idx]}"
+        node = nodes.get(node_id)
+        if node:
+            path_nodes.append(node)
+    return path_nodes
+
+def build_climax_prompt(path_nodes, num_choices):
+    """Prompt for the climactic scene before the ending; returns (prompt, context_text)"""
+    # Gather context: path, choices, results
+    story_so_far = []
+    for idx, node in enumerate(path_nodes, 1):
+        story_so_far.append(f"Step {idx}: {node['story']}")
+        if node.get('consequence_dialogue'):
+            story_so_far.append(f"Result: {node['consequence_dialogue']}")
+    context_text = "\n".join(story_so_far)
+    prompt = f"""
+            The player has reached the climax of their interactive story. Here is the journey so far:
+            {context_text}
+            
+            Now, generate a climactic scene that feels like the penultimate moment before the story's true ending. The scene should be highly specific to the events and choices so far. Offer exactly {num_choices} action-oriented choices, each clearly leading to a final outcome. Make it rich but concise: 5 sentences maximum. Format as a JSON object:
+            {{
+                "story": "Rich, dramatic text for the climactic scene",
+                "choices": [
+                    {{"text": "Action the player takes (verb first)", "consequences": "Immediate result"}},
+                    ...
+                ]
+            }}
+            """
+    return prompt, context_text
+
+def build_conclusion_prompt(context_text, chosen_ending_choice):
+    """Prompt for the final conclusion after the player's last choice"""
+    final_context = context_text + f"\nFinal Choice: {chosen_ending_choice['text']}\nResult: {chosen_ending_choice.get('consequences','')}"
+    return f"""
+            The player has completed their interactive story. Here is the full journey:
+            {final_context}
+            
+            Write a powerful, natural conclusion to the story. The ending should reflect the player's choices and actions, and can be positive, negative, or mixed. Make the ending concise: keep it to 2-4 sentences maximum. Format as a JSON object:
+            {{
+                "ending": "A rich but brief, satisfying conclusion to the story (2-4 sentences)."
+            }}
+            """
+
+def move_consequence_dialogue(node):
+    """Move any dialogue to consequence_dialogue if it's not a character dialogue"""
+    if "dialogue" in node and node["dialogue"] and not node["dialogue"].startswith("[You]"):
+        node["consequence_dialogue"] = node["dialogue"]
+        node["dialogue"] = ""
+
+def speculate_next_turn(speculator, nodes, current_node, choice_path, max_depth, theme, num_choices):
+    """While the player reads, generate what each choice will need when they arrive
+
+    That is the scene dialogue of every child, and the climactic scene for
+    children where the pre-generated story runs out at max depth. Children
+    are snapshotted as they will look on arrival, so the game loop's own
+    changes to the nodes cannot race with the background work.
+    """
+    for i, child_id in enumerate(current_node["children"]):
+        child = copy.deepcopy(nodes[child_id])
+        move_consequence_dialogue(child)
+        if node_needs_dialogue(child):
+            speculator.speculate(("dialogue", child_id), lambda child=child: generate_scene_dialogue(child, theme))
+
+        if len(choice_path) + 1 == max_depth and (child["is_end"] or not child["children"]):
+            path_nodes = get_path_nodes(nodes, choice_path)
+            prompt, _ = build_climax_prompt(path_nodes + [child], num_choices)
+            speculator.speculate(("climax", child_id), lambda prompt=prompt: generate_story_node(prompt))
+
 def print_ability_box(ability, width=70):
     """Print a special ability notification in a decorative box"""
     horizontal = "🔥" + "═" * width + "🔥"
@@ -250,100 +400,186 @@ def print_ability_box(ability, width=70):
     print(empty)
     print(horizontal)
 
-def load_game(theme, depth=3, choices_per_node=2):
-    """Generate and load a new story tree"""
-    # Clean up old story files first
-    for f in os.listdir():
-        if f.endswith('_story.json'):
-            try:
-                os.remove(f)
-                print(f"Removed old story file: {f}")
-            except:
-                pass
+def convert_story_node(node_id, node_data):
+    """Convert a node from the saved story graph into the format the game loop navigates"""
+    # Store dialogue and consequence separately
+    dialogue = node_data.get("dialogue", "")
+    consequence = ""
+    
+    # If this is not the first node, the original dialogue field might contain action consequences
+    if node_id != "node_0" and isinstance(dialogue, dict):
+        consequence = dialogue
+        dialogue = ""
+    elif node_id != "node_0" and not dialogue:
+        # For older formats, use the original field as consequence text
+        consequence = node_data.get("dialogue", "")
+    
+    return {
+        "story": node_data["story"],
+        "is_end": node_data.get("is_end", False),
+        "dialogue": dialogue,  # Character dialogue
+        "consequence_dialogue": consequence,  # Result of choices
+        "scene_state": node_data.get("scene_state", {}),  # Include scene_state
+        "characters": node_data.get("characters", {}),    # Include characters
+        "outcome": node_data.get("outcome", {             # Include outcome data
+            "health_change": 0,
+            "experience_change": 0,
+            "inventory_changes": []
+        }),
+        "children": [],
+        "child_actions": []  # Store action text separately from full scene descriptions
+    }
+
+class StoryNodes(MutableMapping):
+    """The game's nodes, converted from a loaded story as the player reaches them.
+
+    story is a BinaryStory (or a story dict). A node is converted with
+    convert_story_node, and linked to its children, the first time it is
+    looked up, so starting a game reads a few nodes instead of the whole
+    file. Nodes added or replaced by the game are kept in memory. close()
+    closes the story file.
+    """
+    def __init__(self, story, theme):
+        self._story = story
+        self._graph = story["graph"]
+        self._theme = theme
+        self._nodes = {}
+        edges = self._graph["edges"]
+        if hasattr(edges, "from_node"):
+            self._edges_from = edges.from_node
+        else:
+            by_from = {}
+            for edge in edges:
+                by_from.setdefault(edge["from"], []).append(edge)
+            self._edges_from = lambda node_id: by_from.get(node_id, [])
+
+    def __getitem__(self, node_id):
+        node = self._nodes.get(node_id)
+        if node is None:
+            node = self._nodes[node_id] = convert_story_node(node_id, self._graph["nodes"][node_id])
+            for edge in self._edges_from(node_id):
+                if edge["to"] in node["children"]:
+                    continue
+                node["children"].append(edge["to"])
+                # Get action text from edge if available, otherwise generate it from the target's story
+                node["child_actions"].append(edge.get("action") or generate_action_choice(self[edge["to"]]["story"], self._theme))
+        return node
+
+    def __setitem__(self, node_id, node):
+        self._nodes[node_id] = node
+
+    def __delitem__(self, node_id):
+        del self._nodes[node_id]
+
+    def __contains__(self, node_id):
+        return node_id in self._nodes or node_id in self._graph["nodes"]
+
+    def __iter__(self):
+        yield from self._graph["nodes"]
+        for node_id in self._nodes:
+            if node_id not in self._graph["nodes"]:
+                yield node_id
+
+    def __len__(self):
+        return len(self._graph["nodes"]) + sum(1 for node_id in self._nodes if node_id not in self._graph["nodes"])
+
+    def close(self):
+        if hasattr(self._story, "close"):
+            self._story.close()
+
+def link_story_nodes(nodes, edges, theme):
+    """Add child node ids and action choices from the graph edges; returns the number of new links"""
+    edge_count = 0
+    for edge in edges:
+        from_id = edge["from"]
+        to_id = edge["to"]
+        if from_id in nodes:
+            # Check if this child is already in the list (avoid duplicates)
+            if to_id not in nodes[from_id]["children"]:
+                nodes[from_id]["children"].append(to_id)
+                edge_count += 1
                 
-    # Generate a new story tree
-    filename = return_story_tree(theme, depth, choices_per_node)
+                # Generate a concise action choice if needed
+                if len(nodes[from_id]["child_actions"]) < len(nodes[from_id]["children"]):
+                    # Get action text from edge if available
+                    if "action" in edge and edge["action"]:
+                        action = edge["action"]
+                    else:
+                        # Generate action from target node's story
+                        action = generate_action_choice(nodes[to_id]["story"], theme)
+                    
+                    nodes[from_id]["child_actions"].append(action)
+    
+    # Validate that all nodes with children have matching child_actions
+    for node_id, node_data in nodes.items():
+        if len(node_data["children"]) != len(node_data["child_actions"]):
+            print(f"Warning: Node {node_id} has {len(node_data['children'])} children but {len(node_data['child_actions'])} actions")
+            # Fix by adding generic actions if needed
+            while len(node_data["child_actions"]) < len(node_data["children"]):
+                child_id = node_data["children"][len(node_data["child_actions"])]
+                action = generate_action_choice(nodes[child_id]["story"], theme)
+                node_data["child_actions"].append(action)
     
-    # Load the saved game state
+    return edge_count
+
+def load_game(theme, depth=3, choices_per_node=2, regenerate=False):
+    """Load the story tree for these settings, generating it only if the story library has none
+
+    Pass regenerate=True to replace the saved story with a new one.
+    """
+    def generate(path):
+        # A brand new story must not be rebuilt from journaled or cached responses
+        with llm_client.refreshing(regenerate):
+            return_story_tree(theme, depth, choices_per_node, resume=not regenerate, filename=path)
+
+    filename = get_or_create_story(theme, depth, choices_per_node, ARC_VERSION, generate, regenerate=regenerate)
+    
+    # Open the saved story from its memory-mapped binary copy; scenes are read as they are reached
+    save_data = None
     try:
-        with open(filename, 'r') as f:
-            save_data = json.load(f)
-            
-        # Extract graph data
-        graph_data = save_data.get("graph", {})
-        
-        # Build a simple tree for navigation
-        nodes = {}
-        for node_id, node_data in graph_data["nodes"].items():
-            # Store dialogue and consequence separately
-            dialogue = node_data.get("dialogue", "")
-            consequence = ""
-            
-            # If this is not the first node, the original dialogue field might contain action consequences
-            if node_id != "node_0" and isinstance(dialogue, dict):
-                consequence = dialogue
-                dialogue = ""
-            elif node_id != "node_0" and not dialogue:
-                # For older formats, use the original field as consequence text
-                consequence = node_data.get("dialogue", "")
-            
-            nodes[node_id] = {
-                "story": node_data["story"],
-                "is_end": node_data.get("is_end", False),
-                "dialogue": dialogue,  # Character dialogue
-                "consequence_dialogue": consequence,  # Result of choices
-                "scene_state": node_data.get("scene_state", {}),  # Include scene_state
-                "characters": node_data.get("characters", {}),    # Include characters
-                "outcome": node_data.get("outcome", {             # Include outcome data
-                    "health_change": 0,
-                    "experience_change": 0,
-                    "inventory_changes": []
-                }),
-                "children": [],
-                "child_actions": []  # Store action text separately from full scene descriptions
-            }
+        save_data = load_story_file(ensure_binary_story(filename))
+        nodes = StoryNodes(save_data, theme)
+        nodes["node_0"]
         
-        # Add child nodes and create action choices
-        edge_count = 0
-        for edge in graph_data["edges"]:
-            from_id = edge["from"]
-            to_id = edge["to"]
-            if from_id in nodes:
-                # Check if this child is already in the list (avoid duplicates)
-                if to_id not in nodes[from_id]["children"]:
-                    nodes[from_id]["children"].append(to_id)
-                    edge_count += 1
-                    
-                    # Generate a concise action choice if needed
-                    if len(nodes[from_id]["child_actions"]) < len(nodes[from_id]["children"]):
-                        # Get action text from edge if available
-                        if "action" in edge and edge["action"]:
-                            action = edge["action"]
-                        else:
-                            # Generate action from target node's story
-                            action = generate_action_choice(nodes[to_id]["story"], theme)
-                        
-                        nodes[from_id]["child_actions"].append(action)
-        
-        print(f"Loaded {len(nodes)} nodes with {edge_count} connections")
-        
-        # Validate that all nodes with children have matching child_actions
-        for node_id, node_data in nodes.items():
-            if len(node_data["children"]) != len(node_data["child_actions"]):
-                print(f"Warning: Node {node_id} has {len(node_data['children'])} children but {len(node_data['child_actions'])} actions")
-                # Fix by adding generic actions if needed
-                while len(node_data["child_actions"]) < len(node_data["children"]):
-                    child_id = node_data["children"][len(node_data["child_actions"])]
-                    action = generate_action_choice(nodes[child_id]["story"], theme)
-                    node_data["child_actions"].append(action)
+        print(f"Loaded story with {len(nodes)} nodes")
                 
         return nodes, "node_0", depth
     except Exception as e:
+        if hasattr(save_data, "close"):
+            save_data.close()
         print(f"Error loading game: {e}")
         import traceback
         traceback.print_exc()
         return None, None, None
 
+def load_lazy_game(theme, depth=3, choices_per_node=2):
+    """Start a story that is generated as the player goes (LAZY_STORY=on in keys.env)
+
+    Only the opening scene and its choices exist at first. Returns
+    (nodes, current_node_id, max_depth, lazy_story); call reveal_lazy_node
+    when the player reaches a node so its choices get generated.
+    """
+    try:
+        lazy_story = start_lazy_story(theme, depth, choices_per_node)
+        nodes = {}
+        for node_id, node_data in lazy_story.graph["nodes"].items():
+            nodes[node_id] = convert_story_node(node_id, node_data)
+        link_story_nodes(nodes, lazy_story.graph["edges"], theme)
+        return nodes, "node_0", depth, lazy_story
+    except Exception as e:
+        print(f"Error starting game: {e}")
+        import traceback
+        traceback.print_exc()
+        return None, None, None, None
+
+def reveal_lazy_node(nodes, lazy_story, node_id, theme):
+    """Generate the children of node_id if needed and add them to nodes"""
+    child_ids = lazy_story.expand(node_id)
+    for child_id in child_ids:
+        if child_id not in nodes:
+            nodes[child_id] = convert_story_node(child_id, lazy_story.graph["nodes"][child_id])
+    link_story_nodes(nodes, [edge for edge in lazy_story.graph["edges"] if edge["from"] == node_id], theme)
+
 def generate_action_choice(scene_text, theme):
     """Generate a concise action-oriented choice (1-2 sentences) from scene description"""
     # List of action verbs by category
@@ -372,7 +608,7 @@ def generate_action_choice(scene_text, theme):
         
     # Generate an appropriate action based on scene content
     if any(word in scene_lower for word in ["door", "entrance", "exit", "passage", "path", "corridor"]):
-        verb = movement_verbs[hash(scene_text) % len(movement_verbs)]
+        verb = movement_verbs[stable_hash(scene_text) % len(movement_verbs)]
         
         # Find what to enter
         for target in ["doorway", "passage", "corridor", "entrance", "tunnel", "opening"]:
@@ -382,7 +618,7 @@ def generate_action_choice(scene_text, theme):
         return f"{verb} the area cautiously, ready for whatever awaits."
         
     elif any(word in scene_lower for word in ["person", "figure", "alien", "creature", "officer", "guard", "character"]):
-        verb = interaction_verbs[hash(scene_text) % len(interaction_verbs)]
+        verb = interaction_verbs[stable_hash(scene_text) % len(interaction_verbs)]
         
         # Find who to interact with
         for target in ["figure", "person", "officer", "alien", "guard", "creature", "individual"]:
@@ -392,7 +628,7 @@ def generate_action_choice(scene_text, theme):
         return f"{verb} the mysterious figure to gain valuable information."
         
     elif any(word in scene_lower for word in ["terminal", "computer", "console", "device", "technology", "system"]):
-        verb = tech_verbs[hash(scene_text) % len(tech_verbs)]
+        verb = tech_verbs[stable_hash(scene_text) % len(tech_verbs)]
         
         # Find what tech to interact with
         for target in ["terminal", "console", "system", "device", "computer", "machine", "panel"]:
@@ -402,7 +638,7 @@ def generate_action_choice(scene_text, theme):
         return f"{verb} the technology to gain an advantage."
         
     elif any(word in scene_lower for word in ["enemy", "threat", "weapon", "danger", "attack", "fight"]):
-        verb = combat_verbs[hash(scene_text) % len(combat_verbs)]
+        verb = combat_verbs[stable_hash(scene_text) % len(combat_verbs)]
         
         # Find what to fight
         for target in ["enemy", "guard", "creature", "attacker", "threat", "opponent"]:
@@ -412,7 +648,7 @@ def generate_action_choice(scene_text, theme):
         return f"{verb} the immediate threat before it's too late."
         
     elif any(word in scene_lower for word in ["hide", "stealth", "quiet", "silent", "undetected", "sneak"]):
-        verb = stealth_verbs[hash(scene_text) % len(stealth_verbs)]
+        verb = stealth_verbs[stable_hash(scene_text) % len(stealth_verbs)]
         
         # Find what to avoid
         for target in ["guard", "patrol", "camera", "sensor", "security", "threat"]:
@@ -423,7 +659,7 @@ def generate_action_choice(scene_text, theme):
     
     else:
         # Default to exploration
-        verb = exploration_verbs[hash(scene_text) % len(exploration_verbs)]
+        verb = exploration_verbs[stable_hash(scene_text) % len(exploration_verbs)]
         
         # Look for interesting objects to explore
         for target in ["area", "room", "building", "structure", "wreckage", "ruins", "debris"]:
@@ -492,11 +728,23 @@ def main():
         except ValueError:
             print("Please enter a valid number.")
     
+    # Reuse a story generated earlier with the same settings unless the player wants a new one
+    regenerate = False
+    if not lazy_story_enabled() and has_story(theme, depth, choices_per_node, ARC_VERSION):
+        regenerate_input = input("\nYou have played this story before. Generate a brand new one instead? (y/N): ")
+        regenerate = regenerate_input.strip().lower().startswith("y")
+    
     print(f"\nGenerating a {theme} story with depth {depth} and {choices_per_node} choices per node...")
-    print("This may take a minute or two. Please wait...\n")
     
     # Load or generate the story
-    nodes, current_node_id, max_depth = load_game(theme, depth, choices_per_node)
+    lazy_story = None
+    if lazy_story_enabled():
+        # Only the opening is generated now; later scenes are generated as you reach them
+        print("Please wait...\n")
+        nodes, current_node_id, max_depth, lazy_story = load_lazy_game(theme, depth, choices_per_node)
+    else:
+        print("This may take a minute or two. Please wait...\n")
+        nodes, current_node_id, max_depth = load_game(theme, depth, choices_per_node, regenerate)
     
     if not nodes or not current_node_id:
         print("Failed to load or generate game!")
@@ -539,6 +787,40 @@ def main():
     # Keep track of player's choice path
     choice_path = ["0"]
     
+    # Progress is saved as a log of turns, compacted into the story file now and then
+    save_log = SaveLog(f"{theme.lower().replace(' ', '_')}_story.json")
+    saved_node_ids = set()
+    story_state_data = {}
+    
+    # Offer to continue the last journey (its logged turns included) if it was in this story
+    saved = read_save(save_log.path) if not regenerate and not lazy_story else None
+    journey = saved_journey(saved, nodes, theme, max_depth) if saved else None
+    if journey:
+        resume_input = input(f"\nContinue your last journey ({len(journey) - 1} choices in)? (Y/n): ")
+        if not resume_input.strip().lower().startswith("n"):
+            saved = save_log.load()
+            story_state_data = saved["story_state"]
+            player = story_state_data.get("characters", {}).get("player", {})
+            player_stats["health"] = player.get("health", player_stats["health"])
+            player_stats["experience"] = player.get("experience", player_stats["experience"])
+            player_stats["inventory"] = story_state_data.get("inventory", player_stats["inventory"])
+            choice_path = [str(step) for step in story_state_data["visited_nodes"]]
+            story_state_data["visited_nodes"] = choice_path
+            for node_id in journey:
+                nodes[node_id]["visited"] = True
+            current_node_id = journey[-1]
+            saved_node_ids.update(saved.get("graph", {}))
+            next_ability_milestone = next((m for m in ability_milestones if m > player_stats["experience"]), 1000)
+    
+    def story_snapshot():
+        saved_node_ids.clear()
+        saved_node_ids.update(nodes)
+        # Streamed one node at a time (compact JSON, replaced atomically)
+        return [("story_state", story_state_data), ("graph", StreamedObject(nodes.items()))]
+    
+    # Generates upcoming scenes in the background while the player reads
+    speculator = create_speculator()
+    
     # Game loop
     while True:
         # Clear screen
@@ -549,6 +831,10 @@ def main():
         print(f"\n🧭 PATH: {path_display}")
         print("=" * 70)
         
+        # Generate the choices for this scene if the story is being built as we go
+        if lazy_story:
+            reveal_lazy_node(nodes, lazy_story, current_node_id, theme)
+        
         # Get current node
         current_node = nodes[current_node_id]
         
@@ -570,8 +856,8 @@ def main():
                 "inventory": player_stats["inventory"]
             }
             
-        # Generate dialogue for this node if needed
-        enrich_node_with_dialogue(current_node, theme)
+        # Generate dialogue for this node if needed (usually ready from think-time speculation)
+        enrich_node_with_dialogue(current_node, theme, speculator.take(("dialogue", current_node_id)))
         
         # Display scene context and player status
         print_scene_context(current_node, player_name, player_stats)
@@ -609,33 +895,20 @@ def main():
 
         if is_last_pregenerated and at_max_depth:
             # Dynamically generate the 'ending-pointed' node
-            # Gather context: path, choices, results
-            story_so_far = []
-            node_id = "node_0"
-            for idx in range(1, len(choice_path)):
-                node_id = node_id + f"_{choice_path[idx]}"
-                node = nodes.get(node_id)
-                if node:
-                    story_so_far.append(f"Step {idx}: {node['story']}")
-                    if node.get('consequence_dialogue'):
-                        story_so_far.append(f"Result: {node['consequence_dialogue']}")
-            context_text = "\n".join(story_so_far)
             # Use the same number of choices as the user selected at the start
             num_choices = choices_per_node
-            prompt = f"""
-            The player has reached the climax of their interactive story. Here is the journey so far:
-            {context_text}
-            
-            Now, generate a climactic scene that feels like the penultimate moment before the story's true ending. The scene should be highly specific to the events and choices so far. Offer exactly {num_choices} action-oriented choices, each clearly leading to a final outcome. Make it rich but concise: 5 sentences maximum. Format as a JSON object:
-            {{
-                "story": "Rich, dramatic text for the climactic scene",
-                "choices": [
-                    {{"text": "Action the player takes (verb first)", "consequences": "Immediate result"}},
-                    ...
-                ]
-            }}
-            """
-            dynamic_ending_node = generate_story_node(prompt)
+            prompt, context_text = build_climax_prompt(get_path_nodes(nodes, choice_path), num_choices)
+            dynamic_ending_node = speculator.take(("climax", current_node_id))
+            ending_streamed = False
+            ending_shown = False
+            if not dynamic_ending_node and stream_text_enabled():
+                # Show the scene as Gemini writes it instead of after the whole reply
+                print(f"\n📜 FINAL CHALLENGE 📜")
+                dynamic_ending_node = print_box_streamed(lambda on_text: stream_story_node(prompt, on_text))
+                ending_streamed = True
+                ending_shown = bool(dynamic_ending_node)
+            elif not dynamic_ending_node:
+                dynamic_ending_node = generate_story_node(prompt)
             if not dynamic_ending_node:
                 # Fallback if Gemini fails
                 fallback_choices = [
@@ -653,8 +926,10 @@ def main():
             dynamic_ending_context = context_text
 
             # Present the dynamic ending node
-            print(f"\n📜 FINAL CHALLENGE 📜")
-            print_box(dynamic_ending_node["story"])
+            if not ending_streamed:
+                print(f"\n📜 FINAL CHALLENGE 📜")
+            if not ending_shown:
+                print_box(dynamic_ending_node["story"])
             # Show choices
             max_box_width = 70
             choice_prefixes = [f"{i+1}. " for i in range(len(dynamic_ending_choices))]
@@ -679,6 +954,11 @@ def main():
                     print(f"║{'-'*max_box_width}║")
             print(f"╚{'═'*max_box_width}╝")
 
+            # Write every possible conclusion while the player decides
+            for i, ending_choice in enumerate(dynamic_ending_choices):
+                conclusion_prompt = build_conclusion_prompt(context_text, ending_choice)
+                speculator.speculate(("conclusion", i), lambda conclusion_prompt=conclusion_prompt: generate_story_node(conclusion_prompt))
+
             # Get player choice for the dynamic ending node
             valid_choice = False
             while not valid_choice:
@@ -694,21 +974,24 @@ def main():
                     print("Please enter a valid number.")
 
             # Now, generate the final conclusion node
-            final_context = context_text + f"\nFinal Choice: {chosen_ending_choice['text']}\nResult: {chosen_ending_choice.get('consequences','')}"
-            conclusion_prompt = f"""
-            The player has completed their interactive story. Here is the full journey:
-            {final_context}
-            
-            Write a powerful, natural conclusion to the story. The ending should reflect the player's choices and actions, and can be positive, negative, or mixed. Make the ending concise: keep it to 2-4 sentences maximum. Format as a JSON object:
-            {{
-                "ending": "A rich but brief, satisfying conclusion to the story (2-4 sentences)."
-            }}
-            """
-            dynamic_conclusion_node = generate_story_node(conclusion_prompt)
+            dynamic_conclusion_node = speculator.take(("conclusion", choice_index))
+            speculator.retain(())
+            conclusion_streamed = False
+            conclusion_shown = False
+            if not dynamic_conclusion_node and stream_text_enabled():
+                print(f"\n🏁 STORY CONCLUSION 🏁")
+                conclusion_prompt = build_conclusion_prompt(context_text, chosen_ending_choice)
+                dynamic_conclusion_node = print_box_streamed(lambda on_text: stream_story_node(conclusion_prompt, on_text, field="ending"))
+                conclusion_streamed = True
+                conclusion_shown = bool(dynamic_conclusion_node and "ending" in dynamic_conclusion_node)
+            elif not dynamic_conclusion_node:
+                dynamic_conclusion_node = generate_story_node(build_conclusion_prompt(context_text, chosen_ending_choice))
             if not dynamic_conclusion_node or "ending" not in dynamic_conclusion_node:
                 dynamic_conclusion_node = {"ending": "Your journey comes to an end. The consequences of your actions echo into the future."}
-            print(f"\n🏁 STORY CONCLUSION 🏁")
-            print_box(dynamic_conclusion_node["ending"])
+            if not conclusion_streamed:
+                print(f"\n🏁 STORY CONCLUSION 🏁")
+            if not conclusion_shown:
+                print_box(dynamic_conclusion_node["ending"])
             break
 
         # (rest of the original loop follows as before)
@@ -756,6 +1039,9 @@ def main():
         # Draw the bottom border
         print(f"╚{'═'*max_box_width}╝")
         
+        # Prepare the next scene for every choice while the player decides
+        speculate_next_turn(speculator, nodes, current_node, choice_path, max_depth, theme, choices_per_node)
+        
         # Get player choice
         valid_choice = False
         while not valid_choice:
@@ -770,6 +1056,9 @@ def main():
                     # Update current node to the chosen one
                     current_node_id = choices[choice_index][0]
                     
+                    # Drop background work for the choices not taken
+                    speculator.retain({("dialogue", current_node_id), ("climax", current_node_id)})
+                    
                     # Update choice path
                     choice_path.append(str(choice_index + 1))
                     
@@ -778,37 +1067,41 @@ def main():
                     current_node["visited"] = True
                     
                     # Save the current state to JSON
-                    save_data = {
-                        "story_state": {
-                            "characters": {
-                                "player": {
-                                    "health": player_stats["health"],
-                                    "experience": player_stats["experience"],
-                                    "mood": "determined",
-                                    "status_effects": [],
-                                    "inventory": player_stats["inventory"]
-                                }
-                            },
-                            "current_scene": current_node,
-                            "inventory": player_stats["inventory"],
-                            "visited_nodes": choice_path,
-                            "theme": theme,
-                            "max_depth": max_depth
+                    story_state_data = {
+                        "characters": {
+                            "player": {
+                                "health": player_stats["health"],
+                                "experience": player_stats["experience"],
+                                "mood": "determined",
+                                "status_effects": [],
+                                "inventory": player_stats["inventory"]
+                            }
                         },
-                        "graph": nodes
+                        "current_scene": current_node,
+                        "inventory": player_stats["inventory"],
+                        "visited_nodes": choice_path,
+                        "theme": theme,
+                        "max_depth": max_depth
                     }
                     
-                    # Save to a file
-                    filename = f"{theme.lower().replace(' ', '_')}_story.json"
-                    with open(filename, 'w') as f:
-                        json.dump(save_data, f, indent=2)
+                    # Log this turn: the new state, the node left (its children may have
+                    # just been generated), the node reached and any nodes not saved yet
+                    changes = [
+                        ["set", ["story_state", "characters"], story_state_data["characters"]],
+                        ["set", ["story_state", "current_scene"], current_node],
+                        ["set", ["story_state", "inventory"], story_state_data["inventory"]],
+                        ["append", ["story_state", "visited_nodes"], choice_path[-1]]
+                    ]
+                    for node_id in [previous_node_id, current_node_id] + nodes[previous_node_id]["children"]:
+                        if node_id not in nodes or (node_id in saved_node_ids and node_id not in (previous_node_id, current_node_id)):
+                            continue
+                        changes.append(["set", ["graph", node_id], nodes[node_id]])
+                        saved_node_ids.add(node_id)
+                    save_log.record("move", changes, story_snapshot)
                     
                     chosen_node = nodes[current_node_id]
                     
-                    # Move any dialogue to consequence_dialogue if it's not a character dialogue
-                    if "dialogue" in chosen_node and chosen_node["dialogue"] and not chosen_node["dialogue"].startswith("[You]"):
-                        chosen_node["consequence_dialogue"] = chosen_node["dialogue"]
-                        chosen_node["dialogue"] = ""
+                    move_consequence_dialogue(chosen_node)
                     
                     # Apply outcome effects from the chosen node immediately
                     if "outcome" in chosen_node:
@@ -846,7 +1139,7 @@ def main():
                             print_box(f"You gained {exp_change} experience points.")
                             
                             # Check if player reached an ability milestone
-                            current_abilities = [a["name"] for a in player_stats["abilities"]]
+                            current_abilities = {a["name"] for a in player_stats["abilities"]}
                             
                             # If we crossed a milestone, grant a new ability
                             if old_exp < next_ability_milestone and new_exp >= next_ability_milestone:
@@ -895,6 +1188,16 @@ def main():
             except ValueError:
                 print("Please enter a valid number.")
     
+    speculator.close()
+    if lazy_story:
+        lazy_story.close()
+    # Leave a complete story file behind for the visualizer
+    if save_log.pending:
+        save_log.compact(story_snapshot)
+    save_log.close()
+    if isinstance(nodes, StoryNodes):
+        nodes.close()
+    
     # Game over screen
     print("\nGame Over!")
     print("=" * 50)
@@ -1,14 +1,20 @@
-import json, textwrap, networkx as nx, plotly.graph_objects as go
+import textwrap, networkx as nx, plotly.graph_objects as go
 from collections import defaultdict
 from collections import defaultdict
 from IPython.display import display
+import os
+from story_format import read_story_file
+from save_log import read_save
 
 def wrap_text(txt, width=40):
     return "<br>".join(textwrap.wrap(txt, width))
 
 def load_story_json(path):
-    with open(path, 'r') as f:
-        return json.load(f)
+    # Accepts story JSON files and memory-mapped .story files (see story_format.py);
+    # a game save also gets the turns logged since its last snapshot
+    if os.path.exists(f"{path}.log"):
+        return read_save(path)
+    return read_story_file(path)
     
 
 def build_story_graph(story_dict):
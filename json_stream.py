@@ -0,0 +1,390 @@
+import json
+import os
+import re
+
+ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+class JsonFieldStream:
+    """Pulls the text of one string field out of JSON while it is still arriving.
+
+    feed() takes the response chunk by chunk and returns the part of the
+    field's value decoded so far that it has not returned before, so a
+    scene can be shown as the model writes it. Only keys at the given
+    nesting depth match (1 = the top-level object), so e.g. a "story" inside
+    the "choices" list is not picked up. Text before the JSON, such as a
+    ```json fence, is skipped.
+    """
+    def __init__(self, field, depth=1):
+        self.field = field
+        self.target_depth = depth
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.unicode_digits = None
+        self.high_surrogate = None
+        self.capturing = False
+        self.expect_value = False
+        self.buffer = []
+        self.last_string = None
+        self.value = []
+        self.done = False
+
+    def feed(self, chunk):
+        out = []
+        for char in chunk:
+            if self.in_string:
+                self._string_char(char, out)
+            elif char == '"':
+                self.in_string = True
+                self.buffer = []
+                self.capturing = self.expect_value and not self.done
+                self.expect_value = False
+            elif char == ':':
+                self.expect_value = self.last_string == self.field and self.depth == self.target_depth
+                self.last_string = None
+            elif char in "{[":
+                self.depth += 1
+                self.expect_value = False
+            elif char in "}]":
+                self.depth -= 1
+            elif not char.isspace():
+                self.expect_value = False
+                self.last_string = None
+        text = "".join(out)
+        self.value.append(text)
+        return text
+
+    def _string_char(self, char, out):
+        target = out if self.capturing else self.buffer
+        if self.unicode_digits is not None:
+            self.unicode_digits += char
+            if len(self.unicode_digits) == 4:
+                try:
+                    code = int(self.unicode_digits, 16)
+                except ValueError:
+                    code = 0xFFFD
+                self.unicode_digits = None
+                if 0xD800 <= code < 0xDC00:
+                    self.high_surrogate = code
+                    return
+                if 0xDC00 <= code < 0xE000 and self.high_surrogate is not None:
+                    code = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                self.high_surrogate = None
+                target.append(chr(code))
+        elif self.escape:
+            self.escape = False
+            if char == 'u':
+                self.unicode_digits = ""
+            else:
+                target.append(ESCAPES.get(char, char))
+        elif char == '\\':
+            self.escape = True
+        elif char == '"':
+            self.in_string = False
+            if self.capturing:
+                self.capturing = False
+                self.done = True
+            else:
+                self.last_string = "".join(self.buffer)
+        else:
+            target.append(char)
+
+    @property
+    def text(self):
+        """Everything decoded from the field so far"""
+        return "".join(self.value)
+
+def stream_text_enabled():
+    """True unless STREAM_TEXT is switched off in keys.env"""
+    return os.getenv("STREAM_TEXT", "on").lower() not in ("0", "off", "false", "no")
+
+class JsonRepairError(ValueError):
+    """Raised when a response contains no JSON object or array at all"""
+
+# Characters that end a string, or need handling inside it
+_STRING_SPECIAL = {'"': re.compile(r'["\\]'), "'": re.compile(r"['\\]")}
+# Characters that end an unquoted key or value
+_BARE_END = re.compile(r'[,:{}\[\]"\n]')
+_NUMBER = re.compile(r'-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?$')
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+
+class JsonRepairParser:
+    """Single-pass, tolerant JSON parser for model output, fed in chunks.
+
+    Repairs the usual LLM faults while it reads instead of in separate
+    passes over the text:
+
+    - prose and ```json fences around the JSON are skipped
+    - unquoted keys and values (bare words become strings)
+    - single-quoted strings, Python True/False/None
+    - trailing and missing commas
+    - raw newlines and unescaped quotes inside strings (a quote only ends
+      a string if a comma, colon or closing bracket follows, or a new line)
+    - // comments between keys and values
+    - truncation: finish() closes an unterminated string and any open
+      objects and arrays, dropping a key that never got its value
+
+    feed() may be called with any split of the text, so a streamed reply
+    is parsed as it arrives; finish() returns the first complete object or
+    array. The names of the repairs that were needed are kept in .repairs.
+    """
+    def __init__(self):
+        self.stack = []  # [container, key, expecting] per open object/array
+        self.root = None
+        self.done = False
+        self.started = False
+        self.mode = None  # None, "string", "bare" or "comment"
+        self.quote = None
+        self.parts = []
+        self.escape = False
+        self.unicode_digits = None
+        self.pending_quote = False
+        self.pending_space = ""
+        self.pending_slash = False  # a "/" that ended a chunk: a comment if the next character is "/" too
+        self.after_comma = False
+        self.repairs = set()
+
+    def feed(self, text):
+        i = 0
+        n = len(text)
+        while i < n and not self.done:
+            if not self.started:
+                starts = [pos for pos in (text.find('{', i), text.find('[', i)) if pos >= 0]
+                if not starts:
+                    if text[i:].strip():
+                        self.repairs.add("skipped_text")
+                    return
+                start = min(starts)
+                if text[i:start].strip():
+                    self.repairs.add("skipped_text")
+                self.started = True
+                i = start
+            elif self.pending_quote:
+                i = self._resolve_quote(text, i)
+            elif self.pending_slash:
+                self.pending_slash = False
+                if text[i] == "/":
+                    self._start_comment()
+                    i += 1
+                else:
+                    self.mode = "bare"
+                    self.parts = ["/"]
+            elif self.mode == "comment":
+                # Skip to the end of the line, however many chunks that takes
+                end = text.find("\n", i)
+                if end < 0:
+                    return
+                self.mode = None
+                i = end
+            elif self.mode == "string":
+                i = self._read_string(text, i)
+            elif self.mode == "bare":
+                match = _BARE_END.search(text, i)
+                end = match.start() if match else n
+                self.parts.append(text[i:end])
+                i = end
+                if match:
+                    self._end_bare()
+            else:
+                i = self._read_structure(text, i)
+
+    def _read_structure(self, text, i):
+        char = text[i]
+        if char in " \t\r\n":
+            return i + 1
+        if char in "{[":
+            container = {} if char == "{" else []
+            self._add_value(container, is_container=True)
+            self.stack.append([container, None, "key" if char == "{" else "value"])
+        elif char in "}]":
+            if self.stack:
+                self.stack.pop()
+            if self.after_comma:
+                self.repairs.add("trailing_comma")
+            if not self.stack:
+                self.done = True
+        elif char == ":":
+            if self.stack and self.stack[-1][2] == "colon":
+                self.stack[-1][2] = "value"
+        elif char == ",":
+            if self.stack:
+                frame = self.stack[-1]
+                frame[2] = "key" if isinstance(frame[0], dict) else "value"
+                self.after_comma = True
+                return i + 1
+        elif char in "\"'":
+            if char == "'":
+                self.repairs.add("single_quotes")
+            self.mode = "string"
+            self.quote = char
+            self.parts = []
+        elif char == "/" and i + 1 == len(text):
+            # Whether this starts a comment depends on the next chunk
+            self.pending_slash = True
+            return i + 1
+        elif char == "/" and text[i + 1] == "/":
+            self._start_comment()
+            return i + 2
+        else:
+            self.mode = "bare"
+            self.parts = []
+            return i
+        self.after_comma = False
+        return i + 1
+
+    def _start_comment(self):
+        self.mode = "comment"
+        self.repairs.add("comment")
+
+    def _read_string(self, text, i):
+        if self.unicode_digits is not None:
+            needed = 4 - len(self.unicode_digits)
+            self.unicode_digits += text[i:i + needed]
+            i += needed
+            if len(self.unicode_digits) == 4:
+                self._end_unicode()
+            return i
+        if self.escape:
+            self.escape = False
+            char = text[i]
+            if char == "u":
+                self.unicode_digits = ""
+            else:
+                self.parts.append(ESCAPES.get(char, char))
+            return i + 1
+        match = _STRING_SPECIAL[self.quote].search(text, i)
+        if not match:
+            self.parts.append(text[i:])
+            return len(text)
+        self.parts.append(text[i:match.start()])
+        if match.group() == "\\":
+            self.escape = True
+        else:
+            # Only the end of the string if what follows says so
+            self.pending_quote = True
+            self.pending_space = ""
+        return match.end()
+
+    def _end_unicode(self):
+        try:
+            self.parts.append(chr(int(self.unicode_digits, 16)))
+        except ValueError:
+            self.parts.append("\\u" + self.unicode_digits)
+        self.unicode_digits = None
+
+    def _resolve_quote(self, text, i):
+        n = len(text)
+        start = i
+        while i < n and text[i] in " \t\r\n":
+            i += 1
+        self.pending_space += text[start:i]
+        if i == n:
+            return i
+        self.pending_quote = False
+        if text[i] in ",:}]" or "\n" in self.pending_space:
+            if text[i] not in ",:}]":
+                self.repairs.add("missing_comma")
+            self._end_string()
+            return i
+        # A quote inside the text, e.g. "He said "run" and left"
+        self.repairs.add("unescaped_quote")
+        self.parts.append(self.quote + self.pending_space)
+        return i
+
+    def _end_string(self):
+        value = "".join(self.parts)
+        if any("\ud800" <= char <= "\udfff" for char in value):
+            # Join \uXXXX surrogate pairs into the character they encode
+            value = value.encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+        self.mode = None
+        self.parts = []
+        self._place_token(value, quoted=True)
+
+    def _end_bare(self):
+        token = "".join(self.parts).strip()
+        self.mode = None
+        self.parts = []
+        if token:
+            self._place_token(token, quoted=False)
+
+    def _place_token(self, token, quoted):
+        self.after_comma = False
+        if not self.stack:
+            return
+        frame = self.stack[-1]
+        if isinstance(frame[0], dict) and frame[2] in ("key", "comma"):
+            if frame[2] == "comma":
+                self.repairs.add("missing_comma")
+            if not quoted:
+                self.repairs.add("bare_key")
+            frame[1] = token
+            frame[2] = "colon"
+            return
+        self._add_value(token if quoted else self._bare_value(token))
+
+    def _bare_value(self, token):
+        if token in _LITERALS:
+            if token[0].isupper():
+                self.repairs.add("python_literal")
+            return _LITERALS[token]
+        if _NUMBER.match(token):
+            return float(token) if any(c in token for c in ".eE") else int(token)
+        self.repairs.add("bare_value")
+        return token
+
+    def _add_value(self, value, is_container=False):
+        if not self.stack:
+            self.root = value
+            return
+        frame = self.stack[-1]
+        if frame[2] == "comma":
+            self.repairs.add("missing_comma")
+        if isinstance(frame[0], dict):
+            if frame[1] is not None:
+                frame[0][frame[1]] = value
+            frame[1] = None
+        else:
+            frame[0].append(value)
+        frame[2] = "comma"
+
+    def finish(self):
+        """Return the parsed object or array, closing anything left open"""
+        if self.pending_quote:
+            self.pending_quote = False
+            self._end_string()
+        elif self.mode == "string":
+            self.repairs.add("truncated")
+            if self.unicode_digits is not None:
+                self.unicode_digits = None
+            self._end_string()
+        elif self.mode == "bare":
+            self._end_bare()
+        elif self.pending_slash:
+            self.pending_slash = False
+            self._place_token("/", quoted=False)
+        if self.stack:
+            self.repairs.add("truncated")
+            self.stack = []
+            self.done = True
+        if self.root is None:
+            raise JsonRepairError("No JSON object found in response")
+        return self.root
+
+def parse_json(text):
+    """Parse JSON from a model response, repairing it if needed (see JsonRepairParser).
+
+    Well-formed JSON, with or without a code fence around it, is handed to
+    the json module directly; only broken replies go through the repairing
+    parser. Raises JsonRepairError if there is no JSON object or array.
+    """
+    start = min((pos for pos in (text.find('{'), text.find('[')) if pos >= 0), default=-1)
+    if start >= 0:
+        end = text.rfind('}' if text[start] == '{' else ']')
+        if end > start:
+            try:
+                return json.loads(text[start:end + 1])
+            except ValueError:
+                pass
+    parser = JsonRepairParser()
+    parser.feed(text)
+    return parser.finish()
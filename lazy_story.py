@@ -0,0 +1,79 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Background threads used to generate the next layer while the player reads
+DEFAULT_PREFETCH_WORKERS = 4
+
+def lazy_story_enabled():
+    """True if LAZY_STORY is switched on in keys.env"""
+    return os.getenv("LAZY_STORY", "off").lower() in ("1", "on", "true", "yes")
+
+class LazyStoryTree:
+    """Story graph whose nodes are generated when the player reaches them.
+
+    Starts from a graph holding the root and its choices. expand(node_id)
+    generates the children of a node on first visit; with prefetch on,
+    the children of every newly revealed node are generated in the
+    background so the next expand() usually finds them ready.
+
+    fetch and apply follow generation_engine.expand_tree: fetch(node_id)
+    makes the LLM call and must not mutate the graph, apply(node_id, data)
+    adds the children to the graph. trace is the Tracer the story's
+    generation is recorded into, if it has one.
+    """
+    def __init__(self, story_graph, fetch, apply, expanded=("node_0",), prefetch=True,
+                 max_workers=DEFAULT_PREFETCH_WORKERS, trace=None):
+        self.graph = story_graph
+        self.trace = trace
+        self._fetch = fetch
+        self._apply = apply
+        self._expanded = set(expanded)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if prefetch else None
+
+    def children(self, node_id):
+        return [edge["to"] for edge in self.graph["edges"] if edge["from"] == node_id]
+
+    def needs_expansion(self, node_id):
+        node = self.graph["nodes"].get(node_id)
+        return node is not None and not node.get("is_end", False) and node_id not in self._expanded
+
+    def expand(self, node_id):
+        """Make sure the children of node_id exist and return their ids"""
+        with self._lock:
+            if not self.needs_expansion(node_id):
+                return self.children(node_id)
+            future = self._pending.pop(node_id, None)
+
+        # Wait for the prefetch if one is running, otherwise generate now
+        data = future.result() if future else self._fetch(node_id)
+
+        with self._lock:
+            if self.needs_expansion(node_id):
+                self._apply(node_id, data)
+                self._expanded.add(node_id)
+            child_ids = self.children(node_id)
+
+        self.prefetch(child_ids)
+        return child_ids
+
+    def prefetch(self, node_ids):
+        """Start generating the children of node_ids in the background"""
+        if self._executor is None:
+            return
+        with self._lock:
+            for node_id in node_ids:
+                if self.needs_expansion(node_id) and node_id not in self._pending:
+                    self._pending[node_id] = self._executor.submit(self._fetch, node_id)
+
+    def close(self):
+        """Stop background generation; prefetches that have not started are dropped"""
+        if self._executor is None:
+            return
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        self._executor.shutdown(wait=False)
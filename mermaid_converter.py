@@ -1,5 +1,5 @@
-import json
 import re
+from story_format import read_story_file
 
 def clean_text(text, max_words=25):
     words = re.findall(r'\w+', text)
@@ -9,8 +9,8 @@ def escape_mermaid(text):
     return text.replace('"', "'").replace("\n", " ").replace("<", "").replace(">", "")
 
 def json_to_mermaid(filename, output_file="story_graph.mmd"):
-    with open(filename, 'r') as f:
-        data = json.load(f)
+    # Story JSON or a memory-mapped .story file (see story_format.py)
+    data = read_story_file(filename)
 
     nodes = data["graph"]["nodes"]
     edges = data["graph"]["edges"]
@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+from story_writer import StreamedObject, write_json_atomic
+
+# Number of logged turns after which the log is folded into a fresh snapshot
+DEFAULT_COMPACT_EVERY = int(os.getenv("SAVE_COMPACT_EVERY", "50"))
+
+def _container(state, path):
+    for key in path[:-1]:
+        state = state.setdefault(key, {})
+    return state
+
+def apply_change(state, change):
+    """Apply one logged change to a loaded save.
+
+    A change is [op, path, value] where path is a list of keys:
+    "set" replaces the value, "append" adds to a list and "update" merges
+    a dict into the one already there.
+    """
+    op, path, value = change
+    target = _container(state, path)
+    key = path[-1]
+    if op == "set":
+        target[key] = value
+    elif op == "append":
+        target.setdefault(key, []).append(value)
+    elif op == "update":
+        target.setdefault(key, {}).update(value)
+    else:
+        raise ValueError(f"Unknown save log operation: {op}")
+
+def _read_save(path, log_path):
+    """(state, generation, records, good_bytes) for the save at path, or None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        state = json.load(f)
+    generation = state.pop("save_generation", 0)
+
+    records = []
+    good_bytes = 0
+    if os.path.exists(log_path):
+        with open(log_path, 'rb') as f:
+            lines = f.readlines()
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except json.JSONDecodeError:
+            header = {}
+        if header.get("generation") == generation:
+            good_bytes = len(lines[0])
+            for line in lines[1:]:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A crash mid-write can leave a partial last line
+                    break
+                good_bytes += len(line)
+
+    for record in records:
+        for change in record["changes"]:
+            apply_change(state, change)
+    return state, generation, records, good_bytes
+
+def read_save(path):
+    """The state saved at path with its logged changes replayed, or None.
+
+    For readers of a save (the visualizer, tools); unlike SaveLog.load it
+    leaves the log alone, so a game still playing can keep appending to it.
+    """
+    saved = _read_save(path, f"{path}.log")
+    return saved[0] if saved is not None else None
+
+class SaveLog:
+    """Player progress saved as a snapshot plus an append-only log of changes.
+
+    Each turn only the changes it made (a move, new stats, newly generated
+    nodes) are appended to path.log as one line and fsynced, so a save costs
+    the same however large the story grows. Every compact_every turns the
+    full state is written to path (atomically, in the usual save format) and
+    the log starts over.
+
+    Snapshot and log carry a generation number. A log left behind by a
+    crash during compaction belongs to the previous snapshot and is ignored;
+    a partial last line from a crash mid-append is dropped. The snapshot
+    alone can be behind the log, so read a save with read_save (or load).
+    """
+    def __init__(self, path, compact_every=None):
+        self.path = path
+        self.log_path = f"{path}.log"
+        self.compact_every = DEFAULT_COMPACT_EVERY if compact_every is None else compact_every
+        self.generation = 0
+        self.pending = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return the saved state (snapshot with logged changes replayed), or None.
+
+        Later record() calls append to this save instead of starting over.
+        """
+        saved = _read_save(self.path, self.log_path)
+        if saved is None:
+            return None
+        state, self.generation, records, good_bytes = saved
+
+        with self._lock:
+            if good_bytes:
+                # Drop any partial trailing line before appending to the log again
+                self._file = open(self.log_path, 'r+')
+                self._file.truncate(good_bytes)
+                self._file.seek(good_bytes)
+            else:
+                self._start_log()
+            self.pending = len(records)
+        return state
+
+    def record(self, kind, changes, snapshot):
+        """Save one turn.
+
+        kind names the turn for anyone reading the log ("move", "turn", ...)
+        and changes is a list of [op, path, value] (see apply_change).
+        snapshot() returns the complete state as (key, value) pairs; it is
+        only called when a snapshot is written: on the first save and every
+        compact_every turns.
+        """
+        with self._lock:
+            if self._file is None or self.pending + 1 >= self.compact_every:
+                self._compact(snapshot)
+                return
+            self._write({"type": kind, "changes": changes})
+            self.pending += 1
+
+    def compact(self, snapshot):
+        """Write a full snapshot now and start an empty log"""
+        with self._lock:
+            self._compact(snapshot)
+
+    def _compact(self, snapshot):
+        self.generation += 1
+        items = list(snapshot()) + [("save_generation", self.generation)]
+        write_json_atomic(self.path, StreamedObject(items))
+        self._start_log()
+        self.pending = 0
+
+    def _start_log(self):
+        if self._file is not None:
+            self._file.close()
+        tmp_path = f"{self.log_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({"generation": self.generation}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.log_path)
+        self._file = open(self.log_path, 'a')
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and not self._file.closed:
+                self._file.close()
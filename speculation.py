@@ -0,0 +1,90 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads generating likely next scenes while the player reads
+DEFAULT_SPECULATION_WORKERS = 4
+
+# Most speculative LLM calls one game may start (SPECULATION_BUDGET in keys.env, 0 = off)
+DEFAULT_SPECULATION_BUDGET = 60
+
+class Speculator:
+    """Runs likely-needed generation in the background during player think-time.
+
+    Jobs are keyed, e.g. ("dialogue", node_id). take(key) returns the result
+    of a finished or running job, or None if it was never started so the
+    caller can generate it on demand.
+
+    Cancellation policy: once the player commits to a choice, retain(keys)
+    drops every job not in keys. Queued jobs are cancelled before they
+    spend an API call; jobs already running finish but their results are
+    discarded and counted as wasted.
+
+    Budget: at most budget jobs are ever started. Once it is used up,
+    speculate() does nothing and the game falls back to on-demand calls.
+    """
+    def __init__(self, budget=DEFAULT_SPECULATION_BUDGET, max_workers=DEFAULT_SPECULATION_WORKERS):
+        self.budget = budget
+        self.started = 0
+        self.used = 0
+        self.cancelled = 0
+        self.wasted = 0
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if budget > 0 else None
+
+    def speculate(self, key, generate):
+        """Start generate() in the background unless key is already running or the budget is spent"""
+        if self._executor is None:
+            return
+        with self._lock:
+            if key in self._jobs or self.started >= self.budget:
+                return
+            self.started += 1
+            self._jobs[key] = self._executor.submit(generate)
+
+    def take(self, key):
+        """Result of the job for key (waiting for it if still running), or None"""
+        with self._lock:
+            future = self._jobs.pop(key, None)
+        if future is None:
+            return None
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Speculative generation failed: {e}")
+            return None
+        self.used += 1
+        return result
+
+    def retain(self, keep):
+        """Drop every job whose key is not in keep"""
+        with self._lock:
+            for key in [key for key in self._jobs if key not in keep]:
+                future = self._jobs.pop(key)
+                if future.cancel():
+                    self.cancelled += 1
+                    # A cancelled job never made its call, so give it back to the budget
+                    self.started -= 1
+                else:
+                    self.wasted += 1
+
+    def close(self):
+        """Cancel all outstanding jobs and stop the worker threads"""
+        if self._executor is None:
+            return
+        self.retain(())
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            "started": self.started,
+            "used": self.used,
+            "cancelled": self.cancelled,
+            "wasted": self.wasted,
+            "budget": self.budget
+        }
+
+def create_speculator():
+    """Speculator using SPECULATION_BUDGET from keys.env"""
+    return Speculator(budget=int(os.getenv("SPECULATION_BUDGET", DEFAULT_SPECULATION_BUDGET)))
@@ -0,0 +1,253 @@
+import re
+from functools import lru_cache
+
+# Inflections the suffix rules below cannot produce
+IRREGULAR_FORMS = {
+    "find": ["found"], "run": ["ran"], "fight": ["fought"], "seek": ["sought"], "meet": ["met"],
+    "hide": ["hid"], "build": ["built"], "flee": ["fled"], "deal": ["dealt"],
+    "creep": ["crept"], "withdraw": ["withdrew", "withdrawn"], "analyze": ["analyse", "analysis"]
+}
+
+def word_forms(keyword):
+    """The keyword and its usual inflections and derived words, e.g. fight,
+    fights, fighting, fighter, fought, or move, moving, movement.
+
+    Phrases (keywords with spaces) are only matched as written; compounds
+    ("moonlight") are separate keywords.
+    """
+    forms = {keyword}
+    if " " in keyword or len(keyword) < 3:
+        return forms
+    vowels = "aeiou"
+    forms.update(IRREGULAR_FORMS.get(keyword, ()))
+    forms.add(keyword + ("es" if keyword.endswith(("s", "x", "z", "ch", "sh")) else "s"))
+    forms.update({keyword + suffix for suffix in ("ment", "ments")})
+    if keyword.endswith("ee"):
+        forms.update({keyword + "d", keyword + "r", keyword + "ing"})
+    elif keyword.endswith("e"):
+        forms.update({keyword + "d", keyword + "r", keyword + "rs", keyword[:-1] + "ing", keyword + "ly",
+                      keyword + "st", keyword + "ty", keyword + "ry"})
+        # create -> creation, explore -> exploration
+        forms.update({keyword[:-1] + suffix for suffix in ("ion", "ions", "ation", "ations")})
+    elif keyword.endswith("y") and keyword[-2] not in vowels:
+        forms.update({keyword[:-1] + suffix for suffix in ("ies", "ied", "ier", "iest", "ily")} | {keyword + "ing"})
+    else:
+        forms.update({keyword + suffix for suffix in (
+            "ed", "ing", "er", "ers", "est", "y", "ly", "en", "ness", "ion", "ions", "ation", "ations",
+            "ous", "ful", "ry", "ize", "ized"
+        )})
+        # run -> running, trap -> trapped
+        if keyword[-1] not in vowels + "wxy" and keyword[-2] in vowels and keyword[-3] not in vowels:
+            forms.update({keyword + keyword[-1] + suffix for suffix in ("ed", "ing", "er", "y")})
+    return forms
+
+class KeywordMatches:
+    """What a KeywordClassifier found in one text"""
+    def __init__(self, groups, found):
+        self.groups = groups
+        self.found = found  # (group, tag) -> [(word index, keyword)], in text order
+
+    def has(self, group, tag):
+        return (group, tag) in self.found
+
+    def tags(self, group):
+        """Tags of group that matched, in the order they were declared"""
+        return [tag for tag in self.groups.get(group, ()) if (group, tag) in self.found]
+
+    def first(self, group, default=None):
+        """The first declared tag of group that matched, like an if/elif chain of keyword checks"""
+        for tag in self.groups.get(group, ()):
+            if (group, tag) in self.found:
+                return tag
+        return default
+
+    def keywords(self, group):
+        """Keywords of group found in the text, in text order, each once"""
+        hits = sorted((position, keyword) for (hit_group, _), found in self.found.items()
+                      if hit_group == group for position, keyword in found)
+        seen = []
+        for _, keyword in hits:
+            if keyword not in seen:
+                seen.append(keyword)
+        return seen
+
+# Words: runs of letters and digits, so "sword-and-key" is three words
+WORD = re.compile(r"[^\W_]+")
+
+class KeywordClassifier:
+    """Finds every keyword of a vocabulary in a text in a single pass (Aho-Corasick).
+
+    vocabulary is {group: {tag: [keywords]}}, e.g.
+    {"weather": {"rainy": ["rain", "storm"], "snowy": ["snow"]}}. Keywords
+    only match whole words, in any of their inflections (see word_forms),
+    so "sea" finds "seas" but not "search", and "ship" finds "ships" but not
+    "relationship". A keyword may be a phrase such as "star wars".
+
+    The automaton runs over the words of the text rather than its
+    characters: it is built once, and classify() reads the text once with
+    one dictionary step per word, whatever the number of keywords.
+    """
+    def __init__(self, vocabulary):
+        self.groups = {group: list(tags) for group, tags in vocabulary.items()}
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]  # per state: (words, keyword, [(group, tag)]) of the keywords ending there
+        forms = {}
+        for group, tags in vocabulary.items():
+            for tag, keywords in tags.items():
+                for keyword in keywords:
+                    keyword = keyword.lower()
+                    for form in word_forms(keyword):
+                        forms.setdefault(tuple(WORD.findall(form)), {}).setdefault(keyword, []).append((group, tag))
+        # Single-word forms by word, for classifying many texts at once (see story_enrichment.py)
+        self.word_labels = {}
+        self.phrase_groups = set()
+        for words, owners in forms.items():
+            for labels in owners.values():
+                if len(words) == 1:
+                    self.word_labels.setdefault(words[0], set()).update(labels)
+                else:
+                    self.phrase_groups.update(group for group, _ in labels)
+        for words, owners in forms.items():
+            state = self._insert(words)
+            for keyword, labels in owners.items():
+                self.output[state].append((len(words), keyword, labels))
+        self._link()
+
+    def _insert(self, words):
+        state = 0
+        for word in words:
+            next_state = self.goto[state].get(word)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][word] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        return state
+
+    def _link(self):
+        """Breadth-first failure links; each state also reports the keywords of its fallbacks"""
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for word, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(word, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def classify(self, text):
+        """Return the KeywordMatches of text (matching is case-insensitive)"""
+        found = {}
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = 0
+        for position, word in enumerate(WORD.findall(text.lower())):
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            for length, keyword, labels in output[state]:
+                for label in labels:
+                    found.setdefault(label, []).append((position - length + 1, keyword))
+        return KeywordMatches(self.groups, found)
+
+# Compound words that name an object ("starship" is a ship)
+OBJECT_COMPOUNDS = {
+    "ship": ["starship", "spaceship", "airship", "warship"],
+    "power": ["firepower"],
+    "program": ["reprogram"]
+}
+
+# Everything the enrichment heuristics look for in a scene. Tags of a group
+# are listed in order of precedence (see KeywordMatches.first).
+STORY_VOCABULARY = {
+    "location": {
+        "Castle": ["castle", "palace", "fortress"],
+        "Forest": ["forest", "woods", "tree"],
+        "Mountains": ["mountain", "peak", "cliff"],
+        "Ship": ["ship", "boat", "sea", "ocean", "starship", "spaceship", "airship"],
+        "Cave": ["cave", "cavern", "underground"],
+        "Settlement": ["city", "town", "village"],
+        "Temple": ["temple", "shrine", "altar", "wayshrine"],
+        "Desert": ["desert", "sand", "dune", "sandstorm"],
+        "Jungle": ["jungle", "tropical"],
+        "Laboratory": ["lab", "laboratory", "facility"]
+    },
+    "time": {
+        "night": ["night", "midnight", "nightfall", "tonight"]
+    },
+    "weather": {
+        "rainy": ["rain", "storm", "rainfall", "thunderstorm"],
+        "snowy": ["snow", "snowfall"],
+        "windy": ["wind", "breeze", "whirlwind"]
+    },
+    "ambient": {
+        "dark": ["dark"],
+        "busy": ["noisy", "busy"],
+        "quiet": ["quiet"]
+    },
+    "character": {
+        "enemy": ["enemy", "villain", "foe", "opponent", "adversary", "antagonist"],
+        "ally": ["ally", "friend", "companion", "partner", "helper", "supporter"],
+        "neutral": ["stranger", "merchant", "traveler", "native", "inhabitant", "civilian"]
+    },
+    "object": {keyword: [keyword] + OBJECT_COMPOUNDS.get(keyword, []) for keyword in [
+        "sword", "key", "door", "map", "artifact", "treasure", "weapon", "book",
+        "device", "machine", "creature", "monster", "ship", "vehicle", "potion",
+        "scroll", "computer", "terminal", "gold", "jewel", "crystal", "orb",
+        "data", "file", "code", "program", "system", "network", "core", "power",
+        "energy", "shield", "armor", "tool", "equipment", "supplies", "rations",
+        "medicine", "herb", "plant", "animal", "beast", "spirit", "ghost", "undead"
+    ]},
+    "action": {
+        "searching": ["search", "look", "seek", "hunt", "explore", "scan", "survey", "probe"],
+        "fighting": ["fight", "battle", "combat", "attack", "defend", "struggle", "clash", "engage", "dogfight", "cyberattack"],
+        "escaping": ["escape", "flee", "run", "evade", "avoid", "retreat", "withdraw", "bolt"],
+        "investigating": ["investigate", "examine", "inspect", "study", "analyze", "probe", "research"],
+        "meeting": ["meet", "encounter", "find", "discover", "greet", "approach", "confront"],
+        "travelling": ["travel", "journey", "trek", "voyage", "expedition", "move", "advance"],
+        "hiding": ["hide", "conceal", "stealth", "sneak", "lurk", "skulk", "creep"],
+        "negotiating": ["negotiate", "bargain", "deal", "trade", "barter", "haggle", "discuss"],
+        "hacking": ["hack", "crack", "breach", "infiltrate", "access", "override", "bypass"],
+        "healing": ["heal", "cure", "mend", "restore", "revive", "treat", "nurse"],
+        "crafting": ["craft", "create", "build", "forge", "construct", "assemble", "fashion"]
+    },
+    "risk": {
+        "danger": ["danger", "endanger", "fight", "dogfight", "trap", "struggle", "injury", "wound", "attack", "cyberattack", "battle"],
+        "rest": ["rest", "safe", "recover", "heal", "respite", "calm"]
+    },
+    "feature": {
+        "ancient ruins": ["ancient"],
+        "darkness": ["dark"],
+        "strange light": ["light", "moonlight", "sunlight", "starlight", "torchlight"],
+        "unusual sounds": ["sound", "noise"]
+    },
+    "exploring": {
+        "exploring": ["search", "look", "explore", "investigate", "find", "discover"]
+    },
+    "find": {
+        "Bundle of Wires": ["tech", "technology", "technological", "computer"],
+        "Strange Plant Sample": ["nature", "forest", "cave"],
+        "Ancient Pottery Shard": ["old", "ruin"]
+    },
+    "reaction": {
+        "danger": ["danger", "endanger", "threat", "threaten"],
+        "discovery": ["discover", "find"],
+        "people": ["person", "character", "people"]
+    }
+}
+
+STORY_FEATURES = KeywordClassifier(STORY_VOCABULARY)
+
+@lru_cache(maxsize=1024)
+def story_features(text):
+    """KeywordMatches of STORY_VOCABULARY in a scene's text.
+
+    Enrichment, dialogue and outcomes all classify the same scene, so the
+    result is kept for the most recent texts and each is read only once.
+    """
+    return STORY_FEATURES.classify(text)
@@ -0,0 +1,469 @@
+"""
+Compact binary story files (.story) with memory-mapped random access.
+
+A .story file holds the same data as a story JSON file, but it is laid
+out so one node can be read without parsing the rest:
+
+    header       magic, version, counts and section offsets
+    strings      every distinct string once (ids, keys, story text, ...)
+    node index   (id string, record offset) per node, in file order
+    hash table   open-addressing table over node ids for O(1) lookup
+    edges        (from id, to id, extra fields offset) per edge
+    records      node fields, edge extras and the story state, in a small
+                 tagged binary encoding that refers to strings by index
+
+Opening a file only maps it; nodes, strings and story text are decoded
+when first touched. Convert with:
+
+    python story_format.py to-binary ninjago_story.json
+    python story_format.py to-json ninjago_story.story
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from collections.abc import Mapping, MutableMapping, Sequence
+
+BINARY_STORY_EXTENSION = ".story"
+
+MAGIC = b"STRY"
+FORMAT_VERSION = 1
+
+# Set when "graph" is the node dict itself (game.py saves) instead of {"nodes", "edges"}
+FLAG_FLAT_GRAPH = 1
+
+HEADER = struct.Struct("<4sHHIIIIQQQQQQ")
+NODE_ENTRY = struct.Struct("<IQ")
+EDGE_ENTRY = struct.Struct("<IIQ")
+U32 = struct.Struct("<I")
+U64 = struct.Struct("<Q")
+I64 = struct.Struct("<q")
+F64 = struct.Struct("<d")
+
+NO_STORY = 0xFFFFFFFF
+EMPTY_SLOT = 0
+
+# Placeholder for story text that has not been read from the file yet
+_NOT_LOADED = object()
+
+class StoryFormatError(ValueError):
+    """Raised for files that are not valid .story files"""
+
+def _id_hash(text):
+    """64-bit FNV-1a; stable across processes, unlike hash()"""
+    value = 0xcbf29ce484222325
+    for byte in text.encode("utf-8"):
+        value = ((value ^ byte) * 0x100000001b3) & 0xFFFFFFFFFFFFFFFF
+    return value
+
+class _StringTable:
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def intern(self, text):
+        ref = self.index.get(text)
+        if ref is None:
+            ref = self.index[text] = len(self.strings)
+            self.strings.append(text)
+        return ref
+
+def _encode(value, out, strings):
+    if value is None:
+        out += b"N"
+    elif value is True:
+        out += b"T"
+    elif value is False:
+        out += b"F"
+    elif isinstance(value, int):
+        out += b"i" + I64.pack(value)
+    elif isinstance(value, float):
+        out += b"d" + F64.pack(value)
+    elif isinstance(value, str):
+        out += b"s" + U32.pack(strings.intern(value))
+    elif isinstance(value, Mapping):
+        out += b"m" + U32.pack(len(value))
+        for key, item in value.items():
+            out += U32.pack(strings.intern(str(key)))
+            _encode(item, out, strings)
+    elif isinstance(value, (list, tuple)):
+        out += b"l" + U32.pack(len(value))
+        for item in value:
+            _encode(item, out, strings)
+    else:
+        raise TypeError(f"Cannot store {type(value).__name__} in a story file")
+
+def write_binary_story(path, story_data):
+    """Write story JSON data (as loaded by json.load) to path in the binary format"""
+    strings = _StringTable()
+    records = bytearray()
+    graph = story_data.get("graph", {})
+    flat = "nodes" not in graph or "edges" not in graph
+    nodes = graph if flat else graph["nodes"]
+    edges = [] if flat else graph["edges"]
+
+    node_entries = []
+    for node_id, node_data in nodes.items():
+        offset = len(records)
+        story = node_data.get("story")
+        records += U32.pack(strings.intern(story) if isinstance(story, str) else NO_STORY)
+        _encode({key: value for key, value in node_data.items()
+                 if not (key == "story" and isinstance(story, str))}, records, strings)
+        node_entries.append((strings.intern(node_id), offset))
+
+    edge_entries = []
+    for edge in edges:
+        offset = len(records)
+        _encode({key: value for key, value in edge.items() if key not in ("from", "to")}, records, strings)
+        edge_entries.append((strings.intern(edge["from"]), strings.intern(edge["to"]), offset))
+
+    state_offset = len(records)
+    _encode(story_data.get("story_state", {}), records, strings)
+
+    # Hash table of node indexes (+1, so 0 marks an empty slot), at most half full
+    table_size = 1
+    while table_size < 2 * max(1, len(node_entries)):
+        table_size *= 2
+    table = [EMPTY_SLOT] * table_size
+    for node_idx, (id_ref, _) in enumerate(node_entries):
+        slot = _id_hash(strings.strings[id_ref]) & (table_size - 1)
+        while table[slot] != EMPTY_SLOT:
+            slot = (slot + 1) & (table_size - 1)
+        table[slot] = node_idx + 1
+
+    encoded = [text.encode("utf-8") for text in strings.strings]
+    string_offsets = bytearray()
+    position = 0
+    for blob in encoded:
+        string_offsets += U64.pack(position)
+        position += len(blob)
+    string_offsets += U64.pack(position)
+
+    strings_off = HEADER.size
+    blob_off = strings_off + len(string_offsets)
+    node_index_off = blob_off + position
+    hash_off = node_index_off + NODE_ENTRY.size * len(node_entries)
+    edges_off = hash_off + U32.size * table_size
+    records_off = edges_off + EDGE_ENTRY.size * len(edge_entries)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, FLAG_FLAT_GRAPH if flat else 0, len(encoded),
+                            len(node_entries), len(edge_entries), table_size, strings_off,
+                            node_index_off, hash_off, edges_off, records_off, records_off + state_offset))
+        f.write(string_offsets)
+        for blob in encoded:
+            f.write(blob)
+        for id_ref, offset in node_entries:
+            f.write(NODE_ENTRY.pack(id_ref, records_off + offset))
+        f.write(struct.pack(f"<{table_size}I", *table))
+        for from_ref, to_ref, offset in edge_entries:
+            f.write(EDGE_ENTRY.pack(from_ref, to_ref, records_off + offset))
+        f.write(records)
+    os.replace(tmp_path, path)
+    return path
+
+class StoryNode(MutableMapping):
+    """One node of a BinaryStory; fields are decoded on first access, the story text separately"""
+    def __init__(self, story, offset):
+        self._story = story
+        self._offset = offset
+        self._fields = None
+        self._story_ref = None
+
+    def _load(self):
+        if self._fields is None:
+            story_ref = U32.unpack_from(self._story._buffer, self._offset)[0]
+            fields, _ = self._story._decode(self._offset + U32.size)
+            if story_ref != NO_STORY:
+                self._story_ref = story_ref
+                fields = {"story": _NOT_LOADED, **fields}
+            self._fields = fields
+        return self._fields
+
+    def __getitem__(self, key):
+        value = self._load()[key]
+        if value is _NOT_LOADED:
+            # Story text is only read the first time it is asked for
+            value = self._fields[key] = self._story._string(self._story_ref)
+        return value
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+
+    def __delitem__(self, key):
+        del self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def to_dict(self):
+        return {key: self[key] for key in self}
+
+    def copy(self):
+        """Shallow copy as a plain dict, like dict.copy()"""
+        return self.to_dict()
+
+class NodeTable(Mapping):
+    """Read-only mapping of node id -> StoryNode with O(1) hashed lookup"""
+    def __init__(self, story):
+        self._story = story
+        self._cache = {}
+
+    def _node_at(self, node_idx):
+        node = self._cache.get(node_idx)
+        if node is None:
+            _, offset = NODE_ENTRY.unpack_from(self._story._buffer, self._story._node_index_off + NODE_ENTRY.size * node_idx)
+            node = self._cache[node_idx] = StoryNode(self._story, offset)
+        return node
+
+    def _find(self, node_id):
+        story = self._story
+        mask = story._table_size - 1
+        slot = _id_hash(node_id) & mask
+        while True:
+            entry = U32.unpack_from(story._buffer, story._hash_off + U32.size * slot)[0]
+            if entry == EMPTY_SLOT:
+                return None
+            id_ref, _ = NODE_ENTRY.unpack_from(story._buffer, story._node_index_off + NODE_ENTRY.size * (entry - 1))
+            if story._string(id_ref) == node_id:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def __getitem__(self, node_id):
+        node_idx = self._find(node_id) if isinstance(node_id, str) else None
+        if node_idx is None:
+            raise KeyError(node_id)
+        return self._node_at(node_idx)
+
+    def __contains__(self, node_id):
+        return isinstance(node_id, str) and self._find(node_id) is not None
+
+    def __iter__(self):
+        story = self._story
+        for node_idx in range(story._node_count):
+            id_ref, _ = NODE_ENTRY.unpack_from(story._buffer, story._node_index_off + NODE_ENTRY.size * node_idx)
+            yield story._string(id_ref)
+
+    def __len__(self):
+        return self._story._node_count
+
+    def items(self):
+        # Faster than the Mapping default, which would look every id up again
+        for node_idx, node_id in enumerate(self):
+            yield node_id, self._node_at(node_idx)
+
+class EdgeList(Sequence):
+    """Read-only list of edge dicts, decoded on access"""
+    def __init__(self, story):
+        self._story = story
+        self._by_from = None
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        story = self._story
+        from_ref, to_ref, offset = EDGE_ENTRY.unpack_from(story._buffer, story._edges_off + EDGE_ENTRY.size * index)
+        extra, _ = story._decode(offset)
+        return {"from": story._string(from_ref), "to": story._string(to_ref), **extra}
+
+    def __len__(self):
+        return self._story._edge_count
+
+    def from_node(self, node_id):
+        """Edges leaving node_id, in file order.
+
+        The first call indexes the edges by their from id, reading only the
+        fixed-size entries; only the edges returned are decoded.
+        """
+        if self._by_from is None:
+            story = self._story
+            by_from = {}
+            for index in range(len(self)):
+                from_ref = U32.unpack_from(story._buffer, story._edges_off + EDGE_ENTRY.size * index)[0]
+                by_from.setdefault(from_ref, []).append(index)
+            self._by_from = {story._string(from_ref): indexes for from_ref, indexes in by_from.items()}
+        return [self[index] for index in self._by_from.get(node_id, ())]
+
+class BinaryStory(Mapping):
+    """A memory-mapped .story file that reads like the JSON story dict.
+
+    story["graph"]["nodes"][node_id] looks a node up in O(1) without
+    decoding any other node, and story["story_state"] is decoded on first
+    use, so existing code written against json.load() keeps working.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._buffer = None
+        self._file = open(path, 'rb')
+        try:
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise StoryFormatError(f"{path} is empty")
+        if len(self._buffer) < HEADER.size:
+            self.close()
+            raise StoryFormatError(f"{path} is too short to be a story file")
+        (magic, version, flags, self._string_count, self._node_count, self._edge_count, self._table_size,
+         self._strings_off, self._node_index_off, self._hash_off, self._edges_off, _,
+         self._state_off) = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise StoryFormatError(f"{path} is not a version {FORMAT_VERSION} story file")
+        self._blob_off = self._strings_off + U64.size * (self._string_count + 1)
+        self._strings = {}
+        self._state = None
+        self.nodes = NodeTable(self)
+        self.edges = EdgeList(self)
+        self.flat_graph = bool(flags & FLAG_FLAT_GRAPH)
+
+    def _string(self, ref):
+        text = self._strings.get(ref)
+        if text is None:
+            start, end = struct.unpack_from("<QQ", self._buffer, self._strings_off + U64.size * ref)
+            text = self._strings[ref] = self._buffer[self._blob_off + start:self._blob_off + end].decode("utf-8")
+        return text
+
+    def _decode(self, pos):
+        buffer = self._buffer
+        tag = buffer[pos:pos + 1]
+        pos += 1
+        if tag == b"s":
+            return self._string(U32.unpack_from(buffer, pos)[0]), pos + U32.size
+        if tag == b"m":
+            count = U32.unpack_from(buffer, pos)[0]
+            pos += U32.size
+            result = {}
+            for _ in range(count):
+                key = self._string(U32.unpack_from(buffer, pos)[0])
+                result[key], pos = self._decode(pos + U32.size)
+            return result, pos
+        if tag == b"l":
+            count = U32.unpack_from(buffer, pos)[0]
+            pos += U32.size
+            result = []
+            for _ in range(count):
+                item, pos = self._decode(pos)
+                result.append(item)
+            return result, pos
+        if tag == b"i":
+            return I64.unpack_from(buffer, pos)[0], pos + I64.size
+        if tag == b"d":
+            return F64.unpack_from(buffer, pos)[0], pos + F64.size
+        if tag == b"N":
+            return None, pos
+        if tag == b"T":
+            return True, pos
+        if tag == b"F":
+            return False, pos
+        raise StoryFormatError(f"Corrupt record at offset {pos - 1} in {self.path}")
+
+    @property
+    def story_state(self):
+        if self._state is None:
+            self._state, _ = self._decode(self._state_off)
+        return self._state
+
+    @property
+    def graph(self):
+        return self.nodes if self.flat_graph else {"nodes": self.nodes, "edges": self.edges}
+
+    def __getitem__(self, key):
+        if key == "story_state":
+            return self.story_state
+        if key == "graph":
+            return self.graph
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("story_state", "graph"))
+
+    def __len__(self):
+        return 2
+
+    def to_dict(self):
+        """The whole story as plain dicts and lists, in the JSON schema"""
+        nodes = {node_id: node.to_dict() for node_id, node in self.nodes.items()}
+        graph = nodes if self.flat_graph else {"nodes": nodes, "edges": list(self.edges)}
+        return {"story_state": self.story_state, "graph": graph}
+
+    def close(self):
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+def binary_story_path(json_path):
+    return os.path.splitext(json_path)[0] + BINARY_STORY_EXTENSION
+
+def convert_json_to_binary(json_path, binary_path=None):
+    """Convert a story JSON file to the binary format; returns the .story path"""
+    binary_path = binary_path or binary_story_path(json_path)
+    with open(json_path, 'r') as f:
+        story_data = json.load(f)
+    return write_binary_story(binary_path, story_data)
+
+def convert_binary_to_json(binary_path, json_path=None, indent=None):
+    """Convert a .story file back to the JSON schema; returns the JSON path"""
+    from story_writer import write_json_atomic
+    json_path = json_path or os.path.splitext(binary_path)[0] + ".json"
+    with BinaryStory(binary_path) as story:
+        write_json_atomic(json_path, story.to_dict(), indent)
+    return json_path
+
+def ensure_binary_story(json_path):
+    """Path of an up-to-date .story copy of json_path, converting it if needed.
+
+    Falls back to json_path if the conversion fails, so callers can
+    always pass the result to load_story_file.
+    """
+    binary_path = binary_story_path(json_path)
+    try:
+        if not os.path.exists(binary_path) or os.path.getmtime(binary_path) < os.path.getmtime(json_path):
+            convert_json_to_binary(json_path, binary_path)
+        return binary_path
+    except (OSError, ValueError, TypeError, struct.error) as e:
+        print(f"Could not convert {json_path} to the binary story format: {e}")
+        return json_path
+
+def load_story_file(path):
+    """Load a story from a .story file (memory-mapped) or a JSON file (parsed)"""
+    if path.endswith(BINARY_STORY_EXTENSION):
+        return BinaryStory(path)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def read_story_file(path):
+    """The whole story in a .story or JSON file as plain dicts, with nothing left open"""
+    story = load_story_file(path)
+    if isinstance(story, BinaryStory):
+        with story:
+            return story.to_dict()
+    return story
+
+def main():
+    if len(sys.argv) not in (3, 4) or sys.argv[1] not in ("to-binary", "to-json"):
+        print("Usage: python story_format.py to-binary|to-json <input> [output]")
+        sys.exit(1)
+    output = sys.argv[3] if len(sys.argv) == 4 else None
+    if sys.argv[1] == "to-binary":
+        print(f"Wrote {convert_json_to_binary(sys.argv[2], output)}")
+    else:
+        print(f"Wrote {convert_binary_to_json(sys.argv[2], output, indent=2)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+
+class StoryJournal:
+    """Append-only JSONL checkpoint log for story generation.
+
+    Every completed LLM step (arc, root scene, node expansion, dialogue) is
+    appended as one line and flushed to disk straight away, so a crashed or
+    interrupted run can be resumed without paying for those calls again.
+
+    The first line records the generation parameters. A journal written
+    with different parameters is ignored and overwritten.
+    """
+    def __init__(self, path, params, resume=True):
+        self.path = path
+        self.params = params
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        if resume and os.path.exists(path):
+            self._load()
+        if self.entries:
+            print(f"Resuming from {path}: {len(self.entries)} steps already generated")
+            self._file = open(path, 'a')
+        else:
+            self._file = open(path, 'w')
+            self._write({"params": params})
+
+    def _load(self):
+        with open(self.path, 'r') as f:
+            lines = f.readlines()
+        if not lines:
+            return
+        try:
+            header = json.loads(lines[0])
+        except json.JSONDecodeError:
+            return
+        if header.get("params") != self.params:
+            print(f"Ignoring {self.path}: it was written for different settings")
+            return
+
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash mid-write can leave a partial last line
+                break
+            self.entries[record["key"]] = record["data"]
+
+        # Drop any partial trailing line before appending to the file again
+        with open(self.path, 'w') as f:
+            f.write(lines[0])
+            for key, data in self.entries.items():
+                f.write(json.dumps({"key": key, "data": data}) + "\n")
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def record(self, key, data):
+        """Checkpoint the result of one step"""
+        with self._lock:
+            self.entries[key] = data
+            self._write({"key": key, "data": data})
+
+    def cached(self, key, generate):
+        """Return the journaled result for key, or call generate() and journal it.
+
+        None results are not journaled, so failed steps are retried on resume.
+        """
+        if key in self.entries:
+            return self.entries[key]
+        data = generate()
+        if data is not None:
+            self.record(key, data)
+        return data
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def discard(self):
+        """Close and delete the journal once the finished story has been saved"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,5 +1,6 @@
 import json
 import os
+from story_features import story_features
 
 class StoryState:
     """Class to track the state of the story"""
@@ -36,16 +37,16 @@ def enrich_scene(story_state):
     # This is a simple version that just returns a generic reaction
     # In a more complex implementation, this would call an AI model
     
-    scene_text = story_state.current_scene
+    features = story_features(story_state.current_scene)
     
     # Simple reactions based on scene content
-    if "danger" in scene_text.lower() or "threat" in scene_text.lower():
+    if features.has("reaction", "danger"):
         return "You feel a sense of unease as you assess the situation, looking for potential exits and advantages."
     
-    if "discover" in scene_text.lower() or "find" in scene_text.lower():
+    if features.has("reaction", "discovery"):
         return "You examine your discovery carefully, looking for any clues or useful information."
     
-    if "person" in scene_text.lower() or "character" in scene_text.lower() or "people" in scene_text.lower():
+    if features.has("reaction", "people"):
         return "You attempt to read their intentions, staying alert for any sign of hostility or deception."
     
     # Default reaction
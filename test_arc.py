@@ -1,18 +1,35 @@
-from google import genai
 import json
 import os
-import time
 import hashlib
 from Graph_Classes.Structure import Node, Graph
+from llm_backend import create_backend
+from llm_cache import CachedClient, create_response_cache
+from rate_limiter import create_rate_limited_client
+from story_journal import StoryJournal
+from story_writer import write_story_file
+from story_format import StoryFormatError, load_story_file
+from save_log import read_save
+from json_stream import parse_json
+from story_schema import STRING, INTEGER, BOOLEAN, object_schema, array_schema, validate, generate_structured, request_structured, reject_reply
+from story_context import StoryContext, summarize
 from dotenv import load_dotenv
 
 # Load environment variables from keys.env
 load_dotenv('keys.env')
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY not found in keys.env")
 
-client = genai.Client(api_key=GOOGLE_API_KEY)
+# Gemini by default; set LLM_BACKEND=fake in keys.env to run offline (see llm_backend.py)
+backend = create_backend()
+
+# Calls are throttled to the API quota and retried when rate limited (see rate_limiter.py)
+rate_limiter = create_rate_limited_client(backend)
+
+# Identical (model, prompt) requests are answered from the on-disk response cache
+response_cache = create_response_cache()
+client = CachedClient(rate_limiter, response_cache)
+
+# Scenes per LLM request while generating a level (STORY_BATCH_SIZE in keys.env),
+# 1 = one request per scene
+DEFAULT_BATCH_SIZE = int(os.getenv("STORY_BATCH_SIZE", "1"))
 
 class StoryState:
     def __init__(self):
@@ -90,26 +107,12 @@ def generate_story_arc(theme):
             model="gemini-2.0-flash",
         )
         
-        raw_text = response.text.strip()
-        
-        # Clean up response to extract valid JSON
-        if raw_text.startswith("```"):
-            lines = raw_text.split('\n')
-            if lines[0].startswith("```") and lines[-1].startswith("```"):
-                raw_text = '\n'.join(lines[1:-1])
-            elif lines[0].startswith("```"):
-                raw_text = '\n'.join(lines[1:])
-                
-        raw_text = raw_text.replace("```json", "").replace("```", "").strip()
-        
-        # Find JSON boundaries
-        start_idx = raw_text.find('{')
-        end_idx = raw_text.rfind('}') + 1
-        if start_idx < 0 or end_idx <= 0:
-            raise Exception("Invalid JSON format")
-            
-        json_text = raw_text[start_idx:end_idx]
-        arc_data = json.loads(json_text)
+        try:
+            arc_data = parse_json(response.text)
+        except Exception:
+            # Not served again from the response cache
+            client.models.evict(contents=[prompt], model="gemini-2.0-flash")
+            raise
         
         print(f"Successfully generated story arc for {theme}")
         return arc_data
@@ -142,13 +145,75 @@ def calculate_story_stage(current_level, max_depth, arc_length=8):
     # Calculate the stage proportionally for middle nodes
     return min(int((current_level / max_depth) * arc_length), arc_length - 1)
 
-def generate_story_tree(arc_data, tree_depth=8):
+def stage_progression_label(current_level, max_depth):
+    """Beginning, Middle, Late or Conclusion for a level of the tree"""
+    if current_level == max_depth:
+        return "Conclusion"
+    elif current_level < max_depth / 3:
+        return "Beginning"
+    elif current_level < max_depth * 2/3:
+        return "Middle"
+    return "Late"
+
+def stage_details(arc_data, story_stage_idx):
+    """The arc details of one stage, as given to the model"""
+    stage_data = arc_data["arc"][story_stage_idx]
+    return f"""
+    Stage {story_stage_idx + 1}: {stage_data['stage']}
+    Stage description: {stage_data['description']}
+    Characters in this stage: {', '.join(stage_data['characters'])}
+    Key plot points: {', '.join(stage_data['key_plot_points'])}
+    Thematic elements: {', '.join(stage_data['thematic_elements'])}
+    """
+
+def build_story_context(arc_data):
+    """Prompt prefix shared by every scene of a story (see story_context.py)
+
+    The prefix holds the rules and the scene format. The full prefix adds
+    the details of every arc stage; when it cannot be cached, each prompt
+    carries the details of its own stage instead.
+    """
+    prefix = f"""
+    You are writing scenes for a branching {arc_data['theme']} story that follows the hero's journey.
+    
+    Every scene must:
+    1. Advance the plot according to its stage of the story arc
+    2. Incorporate the thematic elements of that stage
+    3. Present 2 meaningful choices that could lead to different outcomes, or, for a final scene, a satisfying conclusion without choices
+    4. Maintain consistency with the {arc_data['theme']} setting and tone
+    5. Reference previous characters and locations when appropriate
+    
+    A scene is returned as JSON in this format, with the story path and ending flag given in the request:
+    {{
+        "story": "detailed scene description that advances the plot",
+        "scene_state": {{"location": "specific location fitting the stage", "time_of_day": "time period", "weather": "conditions", "ambient": "mood fitting the scene"}},
+        "characters": {{
+            "player": {{"health": number, "mood": "state fitting the scene", "status_effects": []}},
+            "others": [{{"name": "character name", "description": "brief description", "relationship": "relationship to player"}}]
+        }},
+        "story_path": <story path>,
+        "choices": [
+            {{"text": "first choice description", "consequences": {{"health_change": number, "item_changes": ["add_item", "remove_item"]}}}},
+            {{"text": "second choice description", "consequences": {{"health_change": number, "item_changes": ["add_item", "remove_item"]}}}}
+        ],
+        "is_ending": <true or false>
+    }}
+    Final scenes leave out "choices".
+    """
+    stages = "".join(stage_details(arc_data, idx) for idx in range(len(arc_data["arc"])))
+    full_prefix = f"{prefix}\n    The story arc:\n{stages}"
+    return StoryContext(client, prefix, full_prefix)
+
+def generate_story_tree(arc_data, tree_depth=8, journal=None, batch_size=DEFAULT_BATCH_SIZE):
     """
     Generate a complete story tree based on the story arc with customizable depth
     
     Args:
         arc_data: The story arc data
         tree_depth: The maximum depth of the tree (number of levels)
+        journal: Optional StoryJournal; generated scenes are checkpointed to it
+            and scenes already in it are reused instead of regenerated
+        batch_size: Number of scenes to request from the model in one call
     """
     
     # Initialize graph structure
@@ -156,59 +221,34 @@ def generate_story_tree(arc_data, tree_depth=8):
     story_state = StoryState()
     story_state.theme = arc_data["theme"]
     
+    # Rules, format and arc are shared by every prompt of this story
+    context = build_story_context(arc_data)
+    
     # Generate root node (level 0)
     root_prompt = f"""
-    Create the opening scene for a {arc_data['theme']} adventure based on this story context:
-    
-    Stage: {arc_data['arc'][0]['stage']}
-    Description: {arc_data['arc'][0]['description']}
-    Characters: {', '.join(arc_data['arc'][0]['characters'])}
-    Key Plot Points: {', '.join(arc_data['arc'][0]['key_plot_points'])}
-    Thematic Elements: {', '.join(arc_data['arc'][0]['thematic_elements'])}
-    
-    Create a rich, detailed opening scene that:
-    1. Introduces the protagonist
-    2. Establishes the setting
-    3. Hints at the coming adventure
-    4. Sets the tone and atmosphere for {arc_data['theme']}
+    Create the opening scene of the story, in stage 1 of the arc. It should:
+    1. Introduce the protagonist
+    2. Establish the setting
+    3. Hint at the coming adventure
+    4. Set the tone and atmosphere for {arc_data['theme']}
     
     Do not include choices. Focus on crafting a compelling introduction scene only.
-    
-    Return ONLY valid JSON in this format:
-    {{
-        "story": "detailed opening scene description",
-        "scene_state": {{
-            "location": "specific location",
-            "time_of_day": "time period",
-            "weather": "conditions",
-            "ambient": "mood"
-        }},
-        "characters": {{
-            "player": {{
-                "health": 100,
-                "mood": "initial state",
-                "status_effects": []
-            }},
-            "others": [
-                {{
-                    "name": "character name",
-                    "description": "brief description",
-                    "relationship": "relationship to player"
-                }}
-            ]
-        }},
-        "story_path": "The Ordinary World - Beginning"
-    }}
+    Start the player at health 100.
+    "story_path": "The Ordinary World - Beginning"
+    "is_ending": false
     """
     
     try:
-        response = client.models.generate_content(
-            contents=[root_prompt],
-            model="gemini-2.0-flash",
-        )
-        
-        raw_text = clean_response(response.text)
-        root_data = json.loads(raw_text)
+        root_data = journal.get("root") if journal else None
+        if root_data is None:
+            # Only the scene itself is needed here; the first level is generated separately
+            root_properties = story_node_schema(True)["properties"]
+            root_schema = object_schema(root_properties, required=["story", "scene_state", "characters"])
+            root_data = generate_structured(client, context.contents(root_prompt, "root", stage_details(arc_data, 0)), root_schema)
+            if root_data is None:
+                raise Exception("No valid root scene after asking again")
+            if journal:
+                journal.record("root", root_data)
         
         # Create the root node
         root_node = Node(root_data["story"])
@@ -225,22 +265,38 @@ def generate_story_tree(arc_data, tree_depth=8):
             nodes_by_level[level] = {}
             parent_level = level - 1
             
+            # Calculate which stage of the story we should be at
+            story_stage_idx = calculate_story_stage(level, tree_depth)
+            
+            # Collect the scenes for every child on this level, from the journal
+            # when available, otherwise generated batch_size scenes per request
+            level_data = {}
+            pending = []
+            for parent_pos, parent_node in nodes_by_level[parent_level].items():
+                for choice_idx in range(2):
+                    child_pos = parent_pos * 2 + choice_idx
+                    node_data = journal.get(f"node:{level}:{child_pos}") if journal else None
+                    if node_data is None:
+                        pending.append((child_pos, choice_idx, parent_node))
+                    else:
+                        level_data[child_pos] = node_data
+            
+            for start in range(0, len(pending), max(1, batch_size)):
+                batch = pending[start:start + max(1, batch_size)]
+                # Generate node content based on the current stage and previous choice
+                batch_data = generate_story_nodes_batch(arc_data, story_stage_idx, level, tree_depth, batch, context)
+                for (child_pos, _, _), node_data in zip(batch, batch_data):
+                    level_data[child_pos] = node_data
+                    # Fallback scenes are not checkpointed so a resumed run retries them
+                    if journal and not node_data.get("is_fallback"):
+                        journal.record(f"node:{level}:{child_pos}", node_data)
+            
             # For each node in the previous level
             for parent_pos, parent_node in nodes_by_level[parent_level].items():
-                # Calculate which stage of the story we should be at
-                story_stage_idx = calculate_story_stage(level, tree_depth)
-                
-                # Generate two choices for this parent
+                # Add the two choices for this parent
                 for choice_idx in range(2):
-                    # Generate node content based on the current stage and previous choice
-                    node_data = generate_story_node(
-                        arc_data, 
-                        story_stage_idx,
-                        level,
-                        tree_depth,
-                        choice_idx,
-                        parent_node
-                    )
+                    child_pos = parent_pos * 2 + choice_idx
+                    node_data = level_data[child_pos]
                     
                     # Create choice node
                     child_node = Node(node_data["story"], node_data.get("is_ending", False))
@@ -260,196 +316,184 @@ def generate_story_tree(arc_data, tree_depth=8):
                     graph.add_edge(parent_node, child_node)
                     
                     # Store in level tracking dictionary
-                    child_pos = parent_pos * 2 + choice_idx
                     nodes_by_level[level][child_pos] = child_node
                 
                 # Print progress
                 progress = sum(len(nodes) for _, nodes in nodes_by_level.items()) / (2**(tree_depth+1) - 1) * 100
                 print(f"Progress: {progress:.1f}% complete - Generated level {level}")
-            
-            # Avoid rate limiting
-            time.sleep(0.2)
     
+        context.report()
         return graph, story_state
         
     except Exception as e:
         print(f"Error generating story tree: {e}")
         raise
 
-def generate_story_node(arc_data, story_stage_idx, current_level, max_depth, choice_variant, parent_node):
-    """Generate a story node based on the current stage in the arc and tree depth"""
+def generate_story_node(arc_data, story_stage_idx, current_level, max_depth, choice_variant, parent_node, context=None):
+    """Generate a story node based on the current stage in the arc and tree depth
+
+    context is the story's StoryContext; rules, format and arc are sent
+    from it, so the prompt itself only describes this scene.
+    """
+    if context is None:
+        context = build_story_context(arc_data)
     
     # Get current stage data
     stage_data = arc_data["arc"][story_stage_idx]
     
     # Determine if this is the final level
     is_final_level = (current_level == max_depth)
+    stage_progression = stage_progression_label(current_level, max_depth)
     
-    # Extract previous state information
-    previous_location = parent_node.scene_state.get("location", "unknown")
-    previous_characters = []
-    if parent_node.characters.get("others"):
-        previous_characters = [char.get("name") for char in parent_node.characters.get("others", [])]
+    # Add branch-specific context
+    branch_choice = stage_data['potential_branches'][min(choice_variant, len(stage_data['potential_branches'])-1)]
     
-    # Get previous story path
-    previous_story_path = getattr(parent_node, "story_path", "Unknown")
+    # Only what is particular to this scene; the parent scene is summarized
+    prompt = f"""
+    Create the next scene, in stage {story_stage_idx + 1} of the arc ({stage_data['stage']}).
+    This scene is at level {current_level} of a {max_depth}-depth story tree, which means it's in the {stage_progression} of the adventure.
+    Previous scene: {summarize(parent_node.story, 400)}
+    Previous location: {parent_node.scene_state.get("location", "unknown")}
+    Previous story path: {getattr(parent_node, "story_path", "Unknown")}
+    The story follows this branch: {branch_choice}
+    {'This is a final scene: present a satisfying conclusion to the story.' if is_final_level else 'Present 2 meaningful choices.'}
+    "story_path": "{stage_data['stage']} - {stage_progression}"
+    "is_ending": {"true" if is_final_level else "false"}
+    """
+    node_id = f"level{current_level}:{getattr(parent_node, 'id', '')}:{choice_variant}"
+    prompt = context.contents(prompt, node_id, stage_details(arc_data, story_stage_idx))
     
-    # Calculate stage progression label
+    try:
+        # Structured output, validated; broken fields are asked for again (see story_schema.py)
+        node_data = generate_structured(client, prompt, story_node_schema(is_final_level))
+        if node_data is not None:
+            return normalize_story_node(node_data, is_final_level)
+        print("No valid story node after asking again")
+    except Exception as e:
+        print(f"Error generating story node: {e}")
+    
+    # Return a fallback node if generation fails
+    print(f"Warning: using a placeholder scene at level {current_level}")
+    fallback_data = generate_fallback_node(arc_data, story_stage_idx, current_level, max_depth)
+    fallback_data["is_fallback"] = True
+    return fallback_data
+
+def story_node_schema(is_final_level):
+    """Schema for one scene; non-ending scenes have exactly 2 choices"""
+    properties = {
+        "story": STRING,
+        "scene_state": object_schema({"location": STRING, "time_of_day": STRING, "weather": STRING, "ambient": STRING}),
+        "characters": object_schema({
+            "player": object_schema({"health": INTEGER, "mood": STRING, "status_effects": array_schema(STRING)}),
+            "others": array_schema(object_schema({"name": STRING, "description": STRING, "relationship": STRING}))
+        }),
+        "story_path": STRING,
+        "is_ending": BOOLEAN
+    }
+    if not is_final_level:
+        consequences = object_schema({"health_change": INTEGER, "item_changes": array_schema(STRING)})
+        properties["choices"] = array_schema(object_schema({"text": STRING, "consequences": consequences}), 2, 2)
+    return object_schema(properties)
+
+def normalize_story_node(node_data, is_final_level):
+    """Keep at most 2 choices for non-ending nodes and set the ending flag on the final level
+
+    Missing choices are not padded here; a node with fewer is invalid
+    (see story_node_schema) and gets re-asked or regenerated.
+    """
+    if not is_final_level and isinstance(node_data.get("choices"), list):
+        node_data["choices"] = node_data["choices"][:2]
+    
+    # Set ending flag for the final level
     if is_final_level:
-        stage_progression = "Conclusion"
-    elif current_level < max_depth / 3:
-        stage_progression = "Beginning"
-    elif current_level < max_depth * 2/3:
-        stage_progression = "Middle"
-    else:
-        stage_progression = "Late"
-    
-    # Build a context-aware prompt
-    context_description = f"""
-    Previous scene: {parent_node.story}
-    Previous location: {previous_location}
-    Previous story path: {previous_story_path}
-    Story stage: {stage_data['stage']}
-    Stage description: {stage_data['description']}
-    Characters in this stage: {', '.join(stage_data['characters'])}
-    Key plot points: {', '.join(stage_data['key_plot_points'])}
+        node_data["is_ending"] = True
+        
+    return node_data
+
+def is_valid_story_node(node_data, is_final_level):
+    """Check that a scene from a batched reply has everything a Node needs"""
+    return not validate(node_data, story_node_schema(is_final_level))
+
+def generate_story_nodes_batch(arc_data, story_stage_idx, current_level, max_depth, batch, context=None):
+    """Generate several scenes of the same level with one request
+    
+    Args:
+        batch: List of (child_pos, choice_variant, parent_node) tuples
+        
+    Returns:
+        list: One node dict per batch entry, like generate_story_node. Scenes
+            missing or invalid in the combined reply are generated one by one.
     """
+    if len(batch) == 1:
+        _, choice_variant, parent_node = batch[0]
+        return [generate_story_node(arc_data, story_stage_idx, current_level, max_depth, choice_variant, parent_node, context)]
     
-    # Add branch-specific context
-    branch_choice = stage_data['potential_branches'][min(choice_variant, len(stage_data['potential_branches'])-1)]
-    context_description += f"\nThe story follows this branch: {branch_choice}"
+    if context is None:
+        context = build_story_context(arc_data)
+    stage_data = arc_data["arc"][story_stage_idx]
+    is_final_level = (current_level == max_depth)
+    stage_progression = stage_progression_label(current_level, max_depth)
+    
+    # Per-scene context: where the branch comes from and which way it goes
+    scenes = []
+    for child_pos, choice_variant, parent_node in batch:
+        branch_choice = stage_data['potential_branches'][min(choice_variant, len(stage_data['potential_branches'])-1)]
+        scenes.append({
+            "id": f"scene_{child_pos}",
+            "previous_scene": summarize(parent_node.story, 400),
+            "previous_location": parent_node.scene_state.get("location", "unknown"),
+            "previous_story_path": getattr(parent_node, "story_path", "Unknown"),
+            "branch": branch_choice
+        })
     
-    # Generate the node content
     prompt = f"""
-    Create the next scene in a {arc_data['theme']} story with these details:
+    Create {len(batch)} separate next scenes for different branches of the story, in stage {story_stage_idx + 1} of the arc ({stage_data['stage']}).
+    The scenes are at level {current_level} of a {max_depth}-depth story tree, which means they are in the {stage_progression} of the adventure.
+    {'These are final scenes: each presents a satisfying conclusion to the story.' if is_final_level else 'Each scene presents 2 meaningful choices.'}
     
-    {context_description}
+    Each scene continues from its own previous scene and follows its own branch:
+    {json.dumps(scenes, indent=2)}
     
-    This scene is at level {current_level} of a {max_depth}-depth story tree, which means it's in the {stage_progression} of the adventure.
+    Every scene uses
+    "story_path": "{stage_data['stage']} - {stage_progression}"
+    "is_ending": {"true" if is_final_level else "false"}
     
-    This scene must:
-    1. Advance the plot according to the current stage: {stage_data['stage']}
-    2. Incorporate the thematic elements: {', '.join(stage_data['thematic_elements'])}
-    3. {'Present a satisfying conclusion to the story' if is_final_level else 'Present exactly 2 meaningful choices that could lead to different outcomes'}
-    4. Maintain consistency with the {arc_data['theme']} setting and tone
-    5. Reference previous characters and locations when appropriate
-    
-    Return ONLY valid JSON in this format:
-    {{
-        "story": "detailed scene description that advances the plot",
-        "scene_state": {{
-            "location": "specific location fitting the stage",
-            "time_of_day": "time period",
-            "weather": "conditions",
-            "ambient": "mood fitting the scene"
-        }},
-        "characters": {{
-            "player": {{
-                "health": number,
-                "mood": "state fitting the scene",
-                "status_effects": []
-            }},
-            "others": [
-                {{
-                    "name": "character name",
-                    "description": "brief description",
-                    "relationship": "relationship to player"
-                }}
-            ]
-        }},
-        "story_path": "{stage_data['stage']} - {stage_progression}",
-        {"" if is_final_level else '"choices": ['}
-            {"" if is_final_level else '{'}
-                {"" if is_final_level else '"text": "first choice description",'}
-                {"" if is_final_level else '"consequences": {'}
-                    {"" if is_final_level else '"health_change": number,'}
-                    {"" if is_final_level else '"item_changes": ["add_item", "remove_item"]'}
-                {"" if is_final_level else '}'}
-            {"" if is_final_level else '},'}
-            {"" if is_final_level else '{'}
-                {"" if is_final_level else '"text": "second choice description",'}
-                {"" if is_final_level else '"consequences": {'}
-                    {"" if is_final_level else '"health_change": number,'}
-                    {"" if is_final_level else '"item_changes": ["add_item", "remove_item"]'}
-                {"" if is_final_level else '}'}
-            {"" if is_final_level else '}'}
-        {"" if is_final_level else '],'}
-        "is_ending": {"true" if is_final_level else "false"}
-    }}
+    Return ONLY valid JSON with one scene per entry, using the same ids:
+    {{"nodes": [{{"id": "<scene id>", ...the scene fields...}}, ... one entry for every scene ...]}}
     """
+    prompt = context.contents(prompt, f"level{current_level}:batch{batch[0][0]}", stage_details(arc_data, story_stage_idx))
     
+    node_schema = story_node_schema(is_final_level)
+    batch_schema = object_schema({"nodes": array_schema(
+        object_schema({"id": STRING, **node_schema["properties"]}), len(batch), len(batch)
+    )})
+    by_id = {}
     try:
-        response = client.models.generate_content(
-            contents=[prompt],
-            model="gemini-2.0-flash",
-        )
-        
-        raw_text = clean_response(response.text)
-        node_data = json.loads(raw_text)
-        
-        # Force exactly 2 choices for non-ending nodes
-        if not is_final_level and "choices" in node_data and len(node_data["choices"]) != 2:
-            if len(node_data["choices"]) < 2:
-                # Add generic choices if needed
-                while len(node_data["choices"]) < 2:
-                    node_data["choices"].append({
-                        "text": f"Take an alternative path",
-                        "consequences": {
-                            "health_change": 0,
-                            "item_changes": []
-                        }
-                    })
-            else:
-                # Keep only the first two choices
-                node_data["choices"] = node_data["choices"][:2]
-        
-        # Set ending flag for the final level
-        if is_final_level:
-            node_data["is_ending"] = True
-            
-        return node_data
-        
+        # Each scene is validated on its own; broken ones are generated (and re-asked) separately below
+        batch_data = request_structured(client, prompt, batch_schema)
+        for node_data in batch_data.get("nodes", []):
+            if isinstance(node_data, dict) and is_valid_story_node(normalize_story_node(node_data, is_final_level), is_final_level):
+                by_id[node_data.get("id")] = node_data
+        if not by_id:
+            # Nothing in the reply was usable; do not serve it again
+            reject_reply(client, prompt, batch_schema)
     except Exception as e:
-        print(f"Error generating story node: {e}")
-        # Return a fallback node if generation fails
-        return generate_fallback_node(arc_data, story_stage_idx, current_level, max_depth)
-
-def clean_response(raw_text):
-    """Clean an API response to extract valid JSON"""
-    raw_text = raw_text.strip()
-    
-    # Handle code blocks
-    if raw_text.startswith("```"):
-        lines = raw_text.split('\n')
-        if lines[0].startswith("```") and lines[-1].startswith("```"):
-            raw_text = '\n'.join(lines[1:-1])
-        elif lines[0].startswith("```"):
-            raw_text = '\n'.join(lines[1:])
-    
-    raw_text = raw_text.replace("```json", "").replace("```", "").strip()
-    
-    # Find JSON boundaries
-    start_idx = raw_text.find('{')
-    end_idx = raw_text.rfind('}') + 1
-    if start_idx < 0 or end_idx <= 0:
-        raise Exception("Invalid JSON format")
-        
-    return raw_text[start_idx:end_idx]
+        print(f"Error generating story node batch: {e}")
+    
+    results = []
+    for child_pos, choice_variant, parent_node in batch:
+        node_data = by_id.get(f"scene_{child_pos}")
+        if node_data is None:
+            print(f"Batched reply had no valid scene_{child_pos}, generating it separately")
+            node_data = generate_story_node(arc_data, story_stage_idx, current_level, max_depth, choice_variant, parent_node, context)
+        results.append(node_data)
+    return results
 
 def generate_fallback_node(arc_data, story_stage_idx, current_level, max_depth):
     """Generate a fallback node if regular generation fails"""
     stage_data = arc_data["arc"][story_stage_idx]
     is_final_level = (current_level == max_depth)
-    
-    # Calculate stage progression label
-    if is_final_level:
-        stage_progression = "Conclusion"
-    elif current_level < max_depth / 3:
-        stage_progression = "Beginning"
-    elif current_level < max_depth * 2/3:
-        stage_progression = "Middle"
-    else:
-        stage_progression = "Late"
+    stage_progression = stage_progression_label(current_level, max_depth)
     
     fallback_data = {
         "story": f"You continue your adventure in the {arc_data['theme']} world. {stage_data['description']}",
@@ -499,56 +543,63 @@ def generate_fallback_node(arc_data, story_stage_idx, current_level, max_depth):
     return fallback_data
 
 def save_game_state(graph, story_state, filepath="game_save.json"):
-    """Save the game state to a file"""
-    save_data = {
-        "story_state": story_state.to_dict(),
-        "graph": {
-            "nodes": {},
-            "edges": []
-        }
-    }
+    """Save the game state to a file
+
+    Nodes and edges are generated from the graph while the file is being
+    written, so the full save is never built in memory.
+    """
+    def iter_nodes():
+        for node in graph.adjacency_list:
+            yield node.id, {
+                "story": node.story,
+                "scene_state": getattr(node, "scene_state", {}),
+                "characters": getattr(node, "characters", {}),
+                "story_path": getattr(node, "story_path", "Unknown"),
+                "is_end": node.is_end
+            }
     
-    for node in graph.adjacency_list:
-        save_data["graph"]["nodes"][node.id] = {
-            "story": node.story,
-            "scene_state": getattr(node, "scene_state", {}),
-            "characters": getattr(node, "characters", {}),
-            "story_path": getattr(node, "story_path", "Unknown"),
-            "is_end": node.is_end
-        }
-        
-        for child in graph.get_children(node):
-            save_data["graph"]["edges"].append({
-                "from": node.id,
-                "to": child.id,
-                "backtrack": getattr(child, "backtrack", False)
-            })
-    
-    with open(filepath, 'w') as f:
-        json.dump(save_data, f, indent=2)
+    def iter_edges():
+        for node in graph.adjacency_list:
+            for child in graph.get_children(node):
+                yield {
+                    "from": node.id,
+                    "to": child.id,
+                    "backtrack": getattr(child, "backtrack", False)
+                }
+    
+    write_story_file(filepath, story_state.to_dict(), iter_nodes(), iter_edges())
     print(f"Game state saved to {filepath}")
 
-def generate_predetermined_story(theme, depth=8):
-    """Generate a full predetermined story tree for the given theme with custom depth"""
+def generate_predetermined_story(theme, depth=8, resume=True, batch_size=DEFAULT_BATCH_SIZE):
+    """Generate a full predetermined story tree for the given theme with custom depth
+
+    Progress is checkpointed to {theme}_{depth}_story.journal.jsonl, so an
+    interrupted run picks up where it stopped unless resume=False.
+    """
     output_file = f"{theme.lower().replace(' ', '_')}_{depth}_story.json"
+    journal = StoryJournal(output_file.replace(".json", ".journal.jsonl"), {"theme": theme, "depth": depth}, resume=resume)
     
     print(f"\nGenerating story arc for {theme}...")
-    arc_data = generate_story_arc(theme)
+    arc_data = journal.cached("arc", lambda: generate_story_arc(theme))
     with open('arc_data.json', 'w') as file:
         json.dump(arc_data, file, indent=4)
     
     print(f"\nGenerating complete story tree with depth {depth} and 2 choices per node...")
     print("This may take some time. Progress will be displayed below:")
-    graph, story_state = generate_story_tree(arc_data, depth)
+    graph, story_state = generate_story_tree(arc_data, depth, journal, batch_size)
     
     # Save the complete story tree
     save_game_state(graph, story_state, output_file)
+    journal.discard()
     
     # Count the total number of nodes
     node_count = len(graph.adjacency_list)
     print(f"\nSuccess! Story tree for '{theme}' has been generated.")
     print(f"Total nodes: {node_count}")
     print(f"File saved as: {output_file}")
+    if response_cache:
+        stats = response_cache.stats()
+        print(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
     
     return graph, story_state
 
@@ -564,35 +615,44 @@ def load_game_state(filepath=None, theme=None, depth=8):
         # If a valid filepath is provided, load the game state
         if filepath and os.path.exists(filepath) and os.path.getsize(filepath) > 0:
             print(f"\nLoading game from {filepath}...")
-            with open(filepath, 'r') as f:
-                try:
-                    save_data = json.load(f)
-                except json.JSONDecodeError:
-                    print("\nCorrupted save file. Creating new game...")
-                    if theme:
-                        return generate_predetermined_story(theme, depth)
-                    else:
-                        raise Exception("Cannot create new game without theme")
+            try:
+                # .story files are memory-mapped, JSON files are parsed; a game save
+                # also gets the turns logged since its last snapshot
+                if os.path.exists(f"{filepath}.log"):
+                    save_data = read_save(filepath)
+                else:
+                    save_data = load_story_file(filepath)
+            except (json.JSONDecodeError, StoryFormatError):
+                print("\nCorrupted save file. Creating new game...")
+                if theme:
+                    return generate_predetermined_story(theme, depth)
+                else:
+                    raise Exception("Cannot create new game without theme")
             
-            graph = Graph()
-            story_state = StoryState.from_dict(save_data["story_state"])
+            try:
+                graph = Graph()
+                story_state = StoryState.from_dict(save_data["story_state"])
 
-            # Create all nodes first
-            for node_id, node_data in save_data["graph"]["nodes"].items():
-                node = Node(node_data["story"], node_data["is_end"])
-                node.scene_state = node_data["scene_state"]
-                node.characters = node_data["characters"]
-                node.story_path = node_data.get("story_path", "Unknown")
-                graph.add_node(node)
+                # Create all nodes first
+                for node_id, node_data in save_data["graph"]["nodes"].items():
+                    node = Node(node_data["story"], node_data["is_end"])
+                    node.scene_state = node_data["scene_state"]
+                    node.characters = node_data["characters"]
+                    node.story_path = node_data.get("story_path", "Unknown")
+                    graph.add_node(node)
             
-            # Add edges
-            for edge in save_data["graph"]["edges"]:
-                from_node = graph.get_node_with_id(edge["from"])
-                to_node = graph.get_node_with_id(edge["to"])
-                if from_node and to_node:
-                    graph.add_edge(from_node, to_node)
-                    if edge.get("backtrack"):
-                        to_node.backtrack = True
+                # Add edges
+                for edge in save_data["graph"]["edges"]:
+                    from_node = graph.get_node_with_id(edge["from"])
+                    to_node = graph.get_node_with_id(edge["to"])
+                    if from_node and to_node:
+                        graph.add_edge(from_node, to_node)
+                        if edge.get("backtrack"):
+                            to_node.backtrack = True
+            finally:
+                # A .story file stays memory-mapped until closed
+                if hasattr(save_data, "close"):
+                    save_data.close()
             
             return graph, story_state
         
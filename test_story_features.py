@@ -0,0 +1,133 @@
+"""Keyword tagging compared with the substring checks it replaced, on the scenes of the stories in this repo
+
+    python -m unittest test_story_features
+"""
+import json
+import os
+import re
+import unittest
+from benchmark import legacy_keyword_scan
+from story_features import STORY_FEATURES, STORY_VOCABULARY, story_features
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STORY_FILES = ["ninjago_story.json", "visuals/lord_of_the_rings_story.json", "visuals/ninjago_story.json",
+               "visuals/star_wars_story.json", "arc_data.json"]
+
+# Words in those stories where the old checks found a keyword inside another
+# word. None of them is about the keyword's tag, so the classifier should
+# not tag them either ("sea" in "search", "rain" in "terrain").
+IN_WORD_MATCHES = {
+    "ally": {"critically", "equally", "eternally", "finally", "fundamentally", "initially", "partially",
+             "potentially", "rallying", "unnaturally", "usually"},
+    "cave": {"scavenge", "scavenged", "scavenging"},
+    "core": {"score"},
+    "crack": {"crackle", "crackles"},
+    "cure": {"insecure", "secure", "securely"},
+    "deal": {"ideal", "ideals", "ordeal"},
+    "heal": {"health"},
+    "hunt": {"headhunter"},
+    "key": {"hawkeye"},
+    "lab": {"collaborates", "collaborating", "collaboration", "labeled"},
+    "light": {"blighted", "highlighting", "slight", "slightly"},
+    "look": {"overlooking"},
+    "mend": {"commendation"},
+    "move": {"removed"},
+    "nature": {"signature"},
+    "night": {"nightmare", "nightmares"},
+    "old": {"colder", "emboldened", "folded", "foretold", "golden", "hold", "holding", "holdouts", "holds",
+            "stronghold", "threshold", "uphold"},
+    "orb": {"absorbing", "forbidden", "orbit"},
+    "peak": {"speak", "speaking"},
+    "person": {"personal", "personalized"},
+    "power": {"empowered", "powerless"},
+    "rain": {"drained", "strain", "strains", "terrain", "trained", "training"},
+    "rations": {"considerations"},
+    "rest": {"forest", "nearest", "restored", "restores", "underestimated"},
+    "run": {"trunk"},
+    "sea": {"research", "seal", "sealed", "sealing", "seals", "seam", "seams", "search", "searching", "seasoned"},
+    "search": {"research"},
+    "ship": {"leadership", "relationship"},
+    "storm": {"sandstorm"},
+    "tech": {"techniques"},
+    "trade": {"trademark"},
+    "treat": {"retreat", "retreating"}
+}
+
+# Words from those stories that the old checks tagged and the whole-word
+# matching first missed: inflections, derived words and compounds
+TRUE_MATCHES = {
+    "fleeing": ("action", "escaping"),
+    "fled": ("action", "escaping"),
+    "found": ("action", "meeting"),
+    "fought": ("action", "fighting"),
+    "confrontation": ("action", "meeting"),
+    "inspection": ("action", "investigating"),
+    "investigation": ("action", "investigating"),
+    "movement": ("action", "travelling"),
+    "engagement": ("action", "fighting"),
+    "dogfight": ("risk", "danger"),
+    "cyberattacks": ("action", "fighting"),
+    "dangerous": ("reaction", "danger"),
+    "endangers": ("risk", "danger"),
+    "threatening": ("reaction", "danger"),
+    "safety": ("risk", "rest"),
+    "weaponry": ("object", "weapon"),
+    "weaponize": ("object", "weapon"),
+    "powerful": ("object", "power"),
+    "firepower": ("object", "power"),
+    "reprogrammed": ("object", "program"),
+    "airship": ("object", "ship"),
+    "moonlight": ("feature", "strange light"),
+    "whirlwind": ("weather", "windy"),
+    "sandstorm": ("location", "Desert"),
+    "wayshrine": ("location", "Temple"),
+    "technological": ("find", "Bundle of Wires"),
+    "enemies": ("character", "enemy"),
+    "allies": ("character", "ally")
+}
+
+def strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from strings(item)
+
+def scene_texts():
+    """Every piece of text (scenes, choices, dialogue, descriptions) in STORY_FILES"""
+    texts = []
+    for name in STORY_FILES:
+        with open(os.path.join(HERE, name), encoding="utf-8") as f:
+            texts.extend(text for text in strings(json.load(f)) if len(text) > 20)
+    return list(dict.fromkeys(texts))
+
+class LegacyComparisonTest(unittest.TestCase):
+    def test_legacy_only_tags_are_in_word_matches(self):
+        texts = scene_texts()
+        self.assertGreater(len(texts), 200)
+        for text in texts:
+            found = set(STORY_FEATURES.classify(text).found)
+            for group, tag in legacy_keyword_scan(text) - found:
+                for keyword in STORY_VOCABULARY[group][tag]:
+                    for word in re.findall(rf"[^\W_]*{re.escape(keyword)}[^\W_]*", text.lower()):
+                        self.assertIn(word, IN_WORD_MATCHES.get(keyword, ()),
+                                      f"{group}/{tag}: '{keyword}' in '{word}' is not tagged")
+
+    def test_in_word_matches_are_not_tagged(self):
+        for keyword, words in IN_WORD_MATCHES.items():
+            labels = {(group, tag) for group, tags in STORY_VOCABULARY.items()
+                      for tag, keywords in tags.items() if keyword in keywords}
+            for word in words:
+                self.assertFalse(labels & set(story_features(word).found), f"'{word}' tagged as '{keyword}'")
+
+    def test_true_matches_are_tagged(self):
+        texts = " ".join(scene_texts()).lower()
+        for word, (group, tag) in TRUE_MATCHES.items():
+            self.assertTrue(story_features(word).has(group, tag), f"'{word}' not tagged {group}/{tag}")
+            self.assertIn(word, texts)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,18 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, render_template, request, jsonify, session, stream_with_context
 from flask_session import Session # Import Flask-Session
 import os
 import sys
+import json
+import copy
+import uuid
+from lazy_story import lazy_story_enabled
+from story_library import has_story, normalize_theme
+from story_jobs import StoryJobQueue
+from webarc import ARC_VERSION
 from game_logic import (
-    load_game, enrich_node_with_dialogue, get_scene_context_html,
+    load_shared_game, get_shared_story, share_lazy_story, drop_shared_story, node_view, node_overlay,
+    save_player_progress, load_player_progress,
+    load_lazy_game, reveal_lazy_node, enrich_node_with_dialogue, get_scene_context_html,
     get_story_html, get_dialogue_html, get_consequence_html,
     get_ability_notification_html, get_health_notification_html,
     get_experience_notification_html, get_item_notification_html,
@@ -23,9 +32,36 @@ app.config["SECRET_KEY"] = os.urandom(24) # More secure secret key generation
 # Initialize the Session extension
 Session(app)
 
+# Stories being generated as they are played, by session['lazy_story_id'].
+# They hold worker threads, so they live in the process rather than the session.
+lazy_stories = {}
+
+# The story graph itself is never stored in the session: sessions hold its
+# story_id (see game_logic.shared_stories), the player's position, stats and
+# path, and the fields of the current node this session changed.
+
+# New stories are generated in the background; /start_game answers with a
+# job to poll at /jobs/<id> and is called again once the story is ready
+story_jobs = StoryJobQueue()
+
+def generate_story_job(theme, depth, choices_per_node, regenerate):
+    def work(job):
+        story_id, nodes, _, _ = load_shared_game(theme, depth, choices_per_node, regenerate, progress=job.update)
+        if not nodes:
+            raise Exception("Story generation failed. Check server logs.")
+        return story_id
+    return story_jobs.submit((normalize_theme(theme), depth, choices_per_node), work)
+
+def close_lazy_story():
+    lazy_story = lazy_stories.pop(session.get('lazy_story_id'), None)
+    if lazy_story:
+        lazy_story.close()
+        drop_shared_story(session.get('story_id'))
+
 @app.route('/')
 def index():
     # Clear any existing game state
+    close_lazy_story()
     session.clear()
     return render_template('index.html')
 
@@ -39,10 +75,25 @@ def start_game():
     depth = int(data.get('depth', 3))
     choices_per_node = int(data.get('choices_per_node', 2))
     player_name = data.get('player_name', 'Adventurer')
+    # Lazy games only generate the opening now and the rest as the player reaches it
+    lazy = bool(data.get('lazy', lazy_story_enabled()))
+    # Stories are reused from the story library unless a new one is asked for
+    regenerate = bool(data.get('regenerate', False))
     
+    if not lazy and (regenerate or not has_story(theme, depth, choices_per_node, ARC_VERSION)):
+        # Too slow for a request; the client polls the job and then starts the game again
+        job = generate_story_job(theme, depth, choices_per_node, regenerate)
+        return jsonify(job.to_dict()), 202
+
     # Load the game
+    close_lazy_story()
+    lazy_story = None
     try:
-        nodes, current_node_id, max_depth = load_game(theme, depth, choices_per_node)
+        if lazy:
+            nodes, current_node_id, max_depth, lazy_story = load_lazy_game(theme, depth, choices_per_node)
+            story_id = f"lazy_{uuid.uuid4().hex}"
+        else:
+            story_id, nodes, current_node_id, max_depth = load_shared_game(theme, depth, choices_per_node, regenerate)
     except Exception as e:
         print(f"Error in load_game: {e}") # Log the error
         return jsonify({'error': 'Error loading game logic. Check server logs.'}), 500
@@ -50,33 +101,54 @@ def start_game():
     if not nodes or not current_node_id:
         return jsonify({'error': 'Failed to load game data (nodes or current_node_id is missing)'}), 500
     
-    # Initialize player stats
-    player_stats = {
-        "health": 100,
-        "experience": 10,
-        "inventory": [],
-        "abilities": []
-    }
+    # Pick up where this player left this story, unless that journey is over
+    saved = None if lazy or regenerate else load_player_progress(story_id, player_name)
+    if saved and (saved[0] not in nodes or nodes[saved[0]].get("is_end") or saved[1]["player_stats"]["health"] <= 0):
+        saved = None
     
-    # Add a starting ability based on theme
-    try:
-        starting_ability = generate_special_ability(theme, 10)
-        if starting_ability:
-            player_stats["abilities"].append(starting_ability)
-    except Exception as e:
-        print(f"Error generating starting ability: {e}")
-        # Continue without starting ability if it fails
-        starting_ability = None 
+    starting_ability = None
+    node_overlay_data = None
+    choice_path = ["Start"]
+    if saved:
+        current_node_id, progress = saved
+        player_stats = progress["player_stats"]
+        choice_path = progress["choice_path"]
+        node_overlay_data = progress.get("node_overlay")
+    else:
+        # Initialize player stats
+        player_stats = {
+            "health": 100,
+            "experience": 10,
+            "inventory": [],
+            "abilities": []
+        }
+        
+        # Add a starting ability based on theme
+        try:
+            starting_ability = generate_special_ability(theme, 10)
+            if starting_ability:
+                player_stats["abilities"].append(starting_ability)
+        except Exception as e:
+            print(f"Error generating starting ability: {e}")
+            # Continue without starting ability if it fails
+            starting_ability = None 
     
     # Store game state in session
-    session['nodes'] = nodes
+    session['story_id'] = story_id
+    session['story_settings'] = [depth, choices_per_node]
+    session['node_overlay'] = node_overlay_data
     session['current_node_id'] = current_node_id
     session['player_name'] = player_name
     session['player_stats'] = player_stats
     session['theme'] = theme
-    session['choice_path'] = ["Start"]
+    session['choice_path'] = choice_path
+    session['lazy_story_id'] = None
+    if lazy_story:
+        session['lazy_story_id'] = story_id
+        lazy_stories[story_id] = lazy_story
+        share_lazy_story(story_id, nodes)
     
-    current_node = nodes.get(current_node_id)
+    current_node = node_view(nodes, current_node_id, session['node_overlay'])
     if not current_node:
         return jsonify({'error': f'Initial node {current_node_id} not found after loading.'}), 500
 
@@ -85,15 +157,9 @@ def start_game():
     story_html = get_story_html(current_node["story"])
     dialogue_html = get_dialogue_html(current_node.get("dialogue", ""))
     
-    choices_html = '<div class="choices-container">'
+    choices_html = '<div class="choices-container"></div>'
     if current_node.get("children") and current_node.get("child_actions"):
-        for i, (child_id, action) in enumerate(zip(current_node["children"], current_node["child_actions"])):
-            choices_html += f'''
-            <button class="choice-btn" data-choice="{i}">
-                {action}
-            </button>
-            '''
-    choices_html += '</div>'
+        choices_html = get_choices_html(current_node)
     
     initial_notifications = []
     if starting_ability:
@@ -113,37 +179,52 @@ def start_game():
         'player_stats': player_stats
     })
 
-@app.route('/make_choice', methods=['POST'])
-def make_choice():
-    data = request.get_json()
-    if not data:
-        return jsonify({'error': 'No data received for choice'}), 400
+def get_choices_html(node):
+    """Buttons for the choices of node"""
+    choices_html = '<div class="choices-container">'
+    for i, (child_id, action) in enumerate(zip(node["children"], node["child_actions"])):
+        choices_html += f'''
+            <button class="choice-btn" data-choice="{i}">
+                {action}
+            </button>
+            '''
+    choices_html += '</div>'
+    return choices_html
+
+def apply_choice(data):
+    """Apply the player's choice to the session
 
+    Returns (error, None, None) if the choice cannot be made, otherwise
+    (None, response, finish_choices) where response holds everything about
+    the new scene except choices_html, and finish_choices() returns it
+    (generating the next choices first for lazy stories).
+    """
     choice_index = int(data.get('choice_index', -1))
     
-    nodes = session.get('nodes')
     current_node_id = session.get('current_node_id')
     player_name = session.get('player_name')
     player_stats = session.get('player_stats')
     theme = session.get('theme')
     choice_path = session.get('choice_path')
+    depth, choices_per_node = session.get('story_settings', [3, 2])
+    nodes = get_shared_story(session.get('story_id'), theme, depth, choices_per_node) if theme else None
 
     if not all([nodes, current_node_id is not None, player_name, player_stats, theme, choice_path]):
-        return jsonify({'error': 'Game state not found. Please restart the game.'}), 400
+        return 'Game state not found. Please restart the game.', None, None
     
-    current_node = nodes.get(current_node_id)
+    current_node = node_view(nodes, current_node_id, session.get('node_overlay'))
     if not current_node:
-        return jsonify({'error': f'Current node {current_node_id} not found in game data. Please restart.'}), 400
+        return f'Current node {current_node_id} not found in game data. Please restart.', None, None
         
     if not (0 <= choice_index < len(current_node.get("children", []))):
-        return jsonify({'error': 'Invalid choice index. Please restart.'}), 400
+        return 'Invalid choice index. Please restart.', None, None
     
     chosen_action = current_node["child_actions"][choice_index]
     chosen_node_id = current_node["children"][choice_index]
     chosen_node = nodes.get(chosen_node_id)
 
     if not chosen_node:
-        return jsonify({'error': f'Chosen node {chosen_node_id} not found in game data. Please restart.'}), 400
+        return f'Chosen node {chosen_node_id} not found in game data. Please restart.', None, None
 
     choice_path.append(chosen_action) 
     session['choice_path'] = choice_path
@@ -178,6 +259,9 @@ def make_choice():
     session['player_stats'] = player_stats
     
     is_end_node = chosen_node.get("is_end", False) or is_game_over_by_health
+    lazy_story = lazy_stories.get(session.get('lazy_story_id'))
+    # The shared node is read-only; this session's changes go in its overlay
+    chosen_node = dict(nodes[chosen_node_id])
     if is_game_over_by_health and not chosen_node.get("is_end", False):
         chosen_node["story"] = chosen_node.get("story_on_death", "Your journey ends here, succumbing to your fate.")
         chosen_node["dialogue"] = ""
@@ -189,6 +273,7 @@ def make_choice():
         
         # Update character emotions and stats based on the outcome
         if "characters" in chosen_node:
+            chosen_node["characters"] = copy.deepcopy(chosen_node["characters"])
             for char_name, char_data in chosen_node["characters"].items():
                 if char_name.lower() == "player":
                     # Update player character data
@@ -211,6 +296,23 @@ def make_choice():
                     else:
                         char_data["mood"] = "aggressive"
 
+    overlay = node_overlay(nodes, chosen_node_id, chosen_node)
+    session['node_overlay'] = overlay
+    if not lazy_story:
+        save_player_progress(session.get('story_id'), player_name, chosen_node_id,
+                             {"player_stats": player_stats, "choice_path": choice_path, "node_overlay": overlay})
+
+    def finish_choices():
+        if is_end_node:
+            return ""
+        if lazy_story:
+            # Generate the choices for the new scene (usually already prefetched)
+            reveal_lazy_node(nodes, lazy_story, chosen_node_id, theme)
+        node = node_view(nodes, chosen_node_id, overlay)
+        if not node.get("children") or not node.get("child_actions"):
+            return ""
+        return get_choices_html(node)
+
     # Generate HTML for the new scene
     scene_html = get_scene_context_html(chosen_node, player_name, player_stats)
     story_html = get_story_html(chosen_node["story"])
@@ -225,19 +327,7 @@ def make_choice():
             consequence_text = "The pain of your injuries makes it difficult to focus."
     consequence_html = get_consequence_html(consequence_text)
     
-    # Generate choices HTML if not at an end node
-    choices_html = ""
-    if not is_end_node and chosen_node.get("children") and chosen_node.get("child_actions"):
-        choices_html = '<div class="choices-container">'
-        for i, (child_id, action) in enumerate(zip(chosen_node["children"], chosen_node["child_actions"])):
-            choices_html += f'''
-            <button class="choice-btn" data-choice="{i}">
-                {action}
-            </button>
-            '''
-        choices_html += '</div>'
-    
-    return jsonify({
+    return None, {
         'player_name': player_name,
         'theme': theme,
         'choice_path': choice_path,
@@ -245,11 +335,60 @@ def make_choice():
         'story_html': story_html,
         'dialogue_html': dialogue_html,
         'consequence_html': consequence_html,
-        'choices_html': choices_html,
         'notifications': notifications,
         'is_end': is_end_node,
         'player_stats': player_stats 
-    })
+    }, finish_choices
+
+@app.route('/make_choice', methods=['POST'])
+def make_choice():
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'No data received for choice'}), 400
+    error, response, finish_choices = apply_choice(data)
+    if error:
+        return jsonify({'error': error}), 400
+    response['choices_html'] = finish_choices()
+    return jsonify(response)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/make_choice_stream', methods=['POST'])
+def make_choice_stream():
+    """Same as /make_choice, as Server-Sent Events
+
+    A "scene" event with the new scene is sent straight away, then a
+    "choices" event with choices_html once the next choices are ready
+    (for lazy stories they may still be being generated), then "done".
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'No data received for choice'}), 400
+    # Runs before streaming starts, so the session is saved with the response headers
+    error, response, finish_choices = apply_choice(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    def events():
+        yield sse_event("scene", response)
+        try:
+            yield sse_event("choices", {'choices_html': finish_choices()})
+        except Exception as e:
+            print(f"Error generating choices: {e}")
+            yield sse_event("choices", {'choices_html': '', 'error': 'Could not generate the next choices.'})
+        yield sse_event("done", {})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = story_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job.'}), 404
+    return jsonify(job.to_dict())
 
 @app.route('/game_over')
 def game_over():
@@ -2,7 +2,11 @@ import time
 import json
 import os
 import textwrap
-from webarc import return_story_tree, generate_scene_dialogue, generate_special_ability
+import threading
+from story_library import get_or_create_story, story_path
+from story_store import create_story_store
+from story_seed import stable_hash
+from webarc import ARC_VERSION, client as llm_client, return_story_tree, start_lazy_story, generate_scene_dialogue, generate_special_ability
 
 def wrap_text(text, width=70):
     words = text.split()
@@ -262,78 +266,92 @@ def enrich_node_with_dialogue(node, theme):
     if dialogue:
         node["dialogue"] = dialogue
 
-def load_game(theme, depth=3, choices_per_node=2):
-    """Generate and load a new story tree"""
-    # Clean up old story files first
-    for f in os.listdir():
-        if f.endswith('_story.json'):
-            try:
-                os.remove(f)
-            except:
-                pass
+def convert_story_node(node_id, node_data):
+    """Convert a node from the saved story graph into the format the routes navigate"""
+    dialogue = node_data.get("dialogue", "")
+    consequence = ""
+    
+    if node_id != "node_0" and isinstance(dialogue, dict):
+        consequence = dialogue
+        dialogue = ""
+    elif node_id != "node_0" and not dialogue:
+        consequence = node_data.get("dialogue", "")
+    
+    # Store both the full story and the current story text
+    return {
+        "story": node_data["story"],  # This is the full story text
+        "full_story": node_data["story"],  # Keep a copy of the full story
+        "is_end": node_data.get("is_end", False),
+        "dialogue": dialogue,
+        "consequence_dialogue": consequence,
+        "scene_state": node_data.get("scene_state", {}),
+        "characters": node_data.get("characters", {}),
+        "outcome": node_data.get("outcome", {
+            "health_change": 0,
+            "experience_change": 0,
+            "inventory_changes": []
+        }),
+        "children": [],
+        "child_actions": []
+    }
+
+def link_story_nodes(nodes, edges, theme):
+    """Add child node ids and action choices from the graph edges"""
+    for edge in edges:
+        from_id = edge["from"]
+        to_id = edge["to"]
+        if from_id in nodes:
+            if to_id not in nodes[from_id]["children"]:
+                nodes[from_id]["children"].append(to_id)
                 
-    # Generate a new story tree
-    filename = return_story_tree(theme, depth, choices_per_node)
+                if len(nodes[from_id]["child_actions"]) < len(nodes[from_id]["children"]):
+                    if "action" in edge and edge["action"]:
+                        action = edge["action"]
+                    else:
+                        action = generate_action_choice(nodes[to_id]["story"], theme)
+                    
+                    nodes[from_id]["child_actions"].append(action)
+    
+    # Validate that all nodes with children have matching child_actions
+    for node_id, node_data in nodes.items():
+        if len(node_data["children"]) != len(node_data["child_actions"]):
+            while len(node_data["child_actions"]) < len(node_data["children"]):
+                child_id = node_data["children"][len(node_data["child_actions"])]
+                action = generate_action_choice(nodes[child_id]["story"], theme)
+                node_data["child_actions"].append(action)
+
+# Stories shared by every session of this server (STORY_STORE in keys.env, off = read the JSON files)
+story_store = create_story_store()
+
+def load_game(theme, depth=3, choices_per_node=2, regenerate=False, progress=None):
+    """Load the story tree for these settings, generating it only if the story library has none
+
+    Pass regenerate=True to replace the saved story with a new one.
+    progress(stage, done, total) is called while a story is generated.
+    """
+    def generate(path):
+        # A brand new story must not be rebuilt from journaled or cached responses
+        with llm_client.refreshing(regenerate):
+            return_story_tree(theme, depth, choices_per_node, resume=not regenerate, filename=path, progress=progress)
+
+    filename = get_or_create_story(theme, depth, choices_per_node, ARC_VERSION, generate, regenerate=regenerate)
     
     try:
-        with open(filename, 'r') as f:
-            save_data = json.load(f)
+        if story_store:
+            # Imported once per library file; later sessions read it from the store
+            story_id = story_store.import_story_file(filename, theme, depth, choices_per_node, ARC_VERSION)
+            save_data = story_store.load_story(story_id)
+        else:
+            with open(filename, 'r') as f:
+                save_data = json.load(f)
             
         graph_data = save_data.get("graph", {})
         
         nodes = {}
         for node_id, node_data in graph_data["nodes"].items():
-            dialogue = node_data.get("dialogue", "")
-            consequence = ""
-            
-            if node_id != "node_0" and isinstance(dialogue, dict):
-                consequence = dialogue
-                dialogue = ""
-            elif node_id != "node_0" and not dialogue:
-                consequence = node_data.get("dialogue", "")
-            
-            # Store both the full story and the current story text
-            nodes[node_id] = {
-                "story": node_data["story"],  # This is the full story text
-                "full_story": node_data["story"],  # Keep a copy of the full story
-                "is_end": node_data.get("is_end", False),
-                "dialogue": dialogue,
-                "consequence_dialogue": consequence,
-                "scene_state": node_data.get("scene_state", {}),
-                "characters": node_data.get("characters", {}),
-                "outcome": node_data.get("outcome", {
-                    "health_change": 0,
-                    "experience_change": 0,
-                    "inventory_changes": []
-                }),
-                "children": [],
-                "child_actions": []
-            }
-        
-        edge_count = 0
-        for edge in graph_data["edges"]:
-            from_id = edge["from"]
-            to_id = edge["to"]
-            if from_id in nodes:
-                if to_id not in nodes[from_id]["children"]:
-                    nodes[from_id]["children"].append(to_id)
-                    edge_count += 1
-                    
-                    if len(nodes[from_id]["child_actions"]) < len(nodes[from_id]["children"]):
-                        if "action" in edge and edge["action"]:
-                            action = edge["action"]
-                        else:
-                            action = generate_action_choice(nodes[to_id]["story"], theme)
-                        
-                        nodes[from_id]["child_actions"].append(action)
+            nodes[node_id] = convert_story_node(node_id, node_data)
         
-        # Validate that all nodes with children have matching child_actions
-        for node_id, node_data in nodes.items():
-            if len(node_data["children"]) != len(node_data["child_actions"]):
-                while len(node_data["child_actions"]) < len(node_data["children"]):
-                    child_id = node_data["children"][len(node_data["child_actions"])]
-                    action = generate_action_choice(nodes[child_id]["story"], theme)
-                    node_data["child_actions"].append(action)
+        link_story_nodes(nodes, graph_data["edges"], theme)
                 
         return nodes, "node_0", depth
     except Exception as e:
@@ -342,6 +360,128 @@ def load_game(theme, depth=3, choices_per_node=2):
         traceback.print_exc()
         return None, None, None
 
+# Story graphs shared by every session of this process, by story id. Sessions
+# only read them; what a session changes is kept in its own small overlay
+# (see node_view), so a story is held in memory once however many people play it.
+shared_stories = {}
+shared_stories_lock = threading.Lock()
+
+def load_shared_game(theme, depth=3, choices_per_node=2, regenerate=False, progress=None):
+    """Like load_game, but returns (story_id, nodes, current_node_id, max_depth) with nodes shared by all sessions
+
+    The story id is the story's library file. Treat the returned nodes as
+    read-only.
+    """
+    story_id = story_path(theme, depth, choices_per_node, ARC_VERSION)
+    if not regenerate:
+        nodes = get_shared_story(story_id, theme, depth, choices_per_node)
+        if nodes:
+            return story_id, nodes, "node_0", depth
+
+    nodes, current_node_id, max_depth = load_game(theme, depth, choices_per_node, regenerate, progress)
+    if nodes:
+        with shared_stories_lock:
+            shared_stories[story_id] = (nodes, os.path.getmtime(story_id))
+    return story_id, nodes, current_node_id, max_depth
+
+def get_shared_story(story_id, theme, depth=3, choices_per_node=2):
+    """The shared nodes of a story, read from its library file if this process does not hold it yet
+
+    Returns None if the story is not available. A library file replaced by
+    a regenerated story is read again.
+    """
+    with shared_stories_lock:
+        entry = shared_stories.get(story_id)
+    if entry and entry[1] is None:
+        # Generated as it is played: there is no file, it lives here until closed
+        return entry[0]
+    if not os.path.exists(story_id):
+        return None
+    mtime = os.path.getmtime(story_id)
+    if entry and entry[1] == mtime:
+        return entry[0]
+
+    nodes, _, _ = load_game(theme, depth, choices_per_node)
+    if not nodes:
+        return None
+    with shared_stories_lock:
+        shared_stories[story_id] = (nodes, mtime)
+    return nodes
+
+def share_lazy_story(story_id, nodes):
+    """Register the nodes of a story generated as it is played (owned by one session)"""
+    with shared_stories_lock:
+        shared_stories[story_id] = (nodes, None)
+
+def drop_shared_story(story_id):
+    with shared_stories_lock:
+        shared_stories.pop(story_id, None)
+
+def save_player_progress(story_id, player_name, current_node_id, data):
+    """Keep a player's place in a library story in the story store, if there is one"""
+    if not story_store or not story_id or not os.path.exists(story_id):
+        return
+    try:
+        # The story is already imported (see load_game), so this only looks up its id
+        stored_id = story_store.import_story_file(story_id)
+        story_store.save_player(stored_id, player_name, current_node_id, data)
+    except Exception as e:
+        print(f"Error saving player progress: {e}")
+
+def load_player_progress(story_id, player_name):
+    """(current_node_id, data) saved by save_player_progress, or None"""
+    if not story_store or not story_id or not os.path.exists(story_id):
+        return None
+    try:
+        return story_store.load_player(story_store.import_story_file(story_id), player_name)
+    except Exception as e:
+        print(f"Error loading player progress: {e}")
+        return None
+
+def node_view(nodes, node_id, overlay):
+    """The node as one session sees it: the shared node with the session's changed fields on top
+
+    overlay is {"node_id": ..., "fields": {...}} or None.
+    """
+    node = nodes.get(node_id)
+    if node is None:
+        return None
+    if overlay and overlay.get("node_id") == node_id:
+        return {**node, **overlay["fields"]}
+    return node
+
+def node_overlay(nodes, node_id, node):
+    """The fields of a session's copy of a node that differ from the shared node"""
+    shared = nodes[node_id]
+    return {"node_id": node_id, "fields": {key: value for key, value in node.items() if shared.get(key) != value}}
+
+def load_lazy_game(theme, depth=3, choices_per_node=2):
+    """Start a story that is generated as the player goes instead of all up front
+
+    Returns (nodes, current_node_id, max_depth, lazy_story); call
+    reveal_lazy_node when the player reaches a node.
+    """
+    try:
+        lazy_story = start_lazy_story(theme, depth, choices_per_node)
+        nodes = {}
+        for node_id, node_data in lazy_story.graph["nodes"].items():
+            nodes[node_id] = convert_story_node(node_id, node_data)
+        link_story_nodes(nodes, lazy_story.graph["edges"], theme)
+        return nodes, "node_0", depth, lazy_story
+    except Exception as e:
+        print(f"Error starting game: {e}")
+        import traceback
+        traceback.print_exc()
+        return None, None, None, None
+
+def reveal_lazy_node(nodes, lazy_story, node_id, theme):
+    """Generate the children of node_id if needed and add them to nodes"""
+    child_ids = lazy_story.expand(node_id)
+    for child_id in child_ids:
+        if child_id not in nodes:
+            nodes[child_id] = convert_story_node(child_id, lazy_story.graph["nodes"][child_id])
+    link_story_nodes(nodes, [edge for edge in lazy_story.graph["edges"] if edge["from"] == node_id], theme)
+
 def generate_action_choice(scene_text, theme):
     """Generate a concise action-oriented choice from scene description"""
     # List of action verbs by category
@@ -365,42 +505,42 @@ def generate_action_choice(scene_text, theme):
         return scene_text
         
     if any(word in scene_lower for word in ["door", "entrance", "exit", "passage", "path", "corridor"]):
-        verb = movement_verbs[hash(scene_text) % len(movement_verbs)]
+        verb = movement_verbs[stable_hash(scene_text) % len(movement_verbs)]
         for target in ["doorway", "passage", "corridor", "entrance", "tunnel", "opening"]:
             if target in scene_lower:
                 return f"{verb} the {target} to see what lies beyond."
         return f"{verb} the area cautiously, ready for whatever awaits."
         
     elif any(word in scene_lower for word in ["person", "figure", "alien", "creature", "officer", "guard", "character"]):
-        verb = interaction_verbs[hash(scene_text) % len(interaction_verbs)]
+        verb = interaction_verbs[stable_hash(scene_text) % len(interaction_verbs)]
         for target in ["figure", "person", "officer", "alien", "guard", "creature", "individual"]:
             if target in scene_lower:
                 return f"{verb} the {target} to learn more about the situation."
         return f"{verb} the mysterious figure to gain valuable information."
         
     elif any(word in scene_lower for word in ["terminal", "computer", "console", "device", "technology", "system"]):
-        verb = tech_verbs[hash(scene_text) % len(tech_verbs)]
+        verb = tech_verbs[stable_hash(scene_text) % len(tech_verbs)]
         for target in ["terminal", "console", "system", "device", "computer", "machine", "panel"]:
             if target in scene_lower:
                 return f"{verb} the {target} to access its data or functions."
         return f"{verb} the technology to gain an advantage."
         
     elif any(word in scene_lower for word in ["enemy", "threat", "weapon", "danger", "attack", "fight"]):
-        verb = combat_verbs[hash(scene_text) % len(combat_verbs)]
+        verb = combat_verbs[stable_hash(scene_text) % len(combat_verbs)]
         for target in ["enemy", "guard", "creature", "attacker", "threat", "opponent"]:
             if target in scene_lower:
                 return f"{verb} the {target} using your available resources."
         return f"{verb} the immediate threat before it's too late."
         
     elif any(word in scene_lower for word in ["hide", "stealth", "quiet", "silent", "undetected", "sneak"]):
-        verb = stealth_verbs[hash(scene_text) % len(stealth_verbs)]
+        verb = stealth_verbs[stable_hash(scene_text) % len(stealth_verbs)]
         for target in ["guard", "patrol", "camera", "sensor", "security", "threat"]:
             if target in scene_lower:
                 return f"{verb} the {target} without being detected."
         return f"{verb} any potential dangers as you proceed carefully."
     
     else:
-        verb = exploration_verbs[hash(scene_text) % len(exploration_verbs)]
+        verb = exploration_verbs[stable_hash(scene_text) % len(exploration_verbs)]
         for target in ["area", "room", "building", "structure", "wreckage", "ruins", "debris"]:
             if target in scene_lower:
                 return f"{verb} the {target} to discover what secrets it holds."
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Upper bound on concurrent LLM calls while expanding a tree level
+DEFAULT_MAX_IN_FLIGHT = 8
+
+# Threads generating dialogue while the tree is still being expanded (DIALOGUE_WORKERS in keys.env)
+DEFAULT_DIALOGUE_WORKERS = int(os.getenv("DIALOGUE_WORKERS", "4"))
+
+async def _fetch_level(frontier, fetch, executor, semaphore, fetch_batch=None, batch_size=1):
+    """Run fetch() for every item of one BFS level, at most max_in_flight at a time
+
+    With fetch_batch and batch_size > 1, items are fetched batch_size at a time
+    instead and each batch counts as one call in flight.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def run(item):
+        async with semaphore:
+            return await loop.run_in_executor(executor, fetch, item)
+
+    async def run_batch(batch):
+        async with semaphore:
+            return await loop.run_in_executor(executor, fetch_batch, batch)
+
+    if fetch_batch is None or batch_size <= 1:
+        # gather() keeps results in frontier order regardless of completion order
+        return await asyncio.gather(*(run(item) for item in frontier))
+
+    batches = [frontier[i:i + batch_size] for i in range(0, len(frontier), batch_size)]
+    batch_results = await asyncio.gather(*(run_batch(batch) for batch in batches))
+    return [data for results in batch_results for data in results]
+
+async def _expand_levels(frontier, fetch, apply, max_in_flight, fetch_batch=None, batch_size=1):
+    semaphore = asyncio.Semaphore(max_in_flight)
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        level = 0
+        while frontier:
+            results = await _fetch_level(frontier, fetch, executor, semaphore, fetch_batch, batch_size)
+
+            # Apply results one at a time, in order, so graph mutation and the
+            # next frontier are identical to a sequential BFS
+            next_frontier = []
+            for item, data in zip(frontier, results):
+                next_frontier.extend(apply(item, data) or [])
+
+            print(f"Level {level} expanded: {len(frontier)} nodes, {len(next_frontier)} queued for the next level")
+            frontier = next_frontier
+            level += 1
+
+def expand_tree(frontier, fetch, apply, max_in_flight=DEFAULT_MAX_IN_FLIGHT, fetch_batch=None, batch_size=1):
+    """
+    Expand a tree breadth-first, one level at a time, with bounded concurrency.
+
+    Args:
+        frontier: Items to expand at the first level (e.g. (node_id, depth) tuples)
+        fetch: Blocking function item -> data, usually one LLM call. Runs on worker
+            threads, so it must not mutate shared state.
+        apply: Function (item, data) -> list of child items for the next level.
+            Always runs on the calling thread, in frontier order.
+        max_in_flight: Maximum number of fetch() calls running at the same time
+        fetch_batch: Optional blocking function [items] -> [data], one result per
+            item, used to fetch batch_size items of a level with a single call
+        batch_size: Items per fetch_batch() call; 1 uses fetch() for every item
+
+    Wall-clock time scales with tree depth rather than node count, while the
+    resulting tree is the same as a sequential BFS would produce.
+    """
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight must be at least 1")
+    asyncio.run(_expand_levels(list(frontier), fetch, apply, max_in_flight, fetch_batch, batch_size))
+
+
+class PipelineStage:
+    """A generation stage that runs on its own thread pool, alongside expand_tree.
+
+    Work is queued with submit() as soon as its input exists (e.g. a node's
+    dialogue right after the node is created) and picked up by the stage's
+    workers in order, so the stage overlaps tree expansion instead of
+    running after it and the whole build takes about as long as the slower
+    of the two. Neither side waits for the other until results() is called.
+    """
+    def __init__(self, name, workers):
+        if workers < 1:
+            raise ValueError("a pipeline stage needs at least 1 worker")
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, work):
+        """Queue work() under key; a key already queued is not queued again"""
+        with self._lock:
+            if key not in self._futures:
+                self._futures[key] = self._executor.submit(work)
+
+    def results(self, progress=None):
+        """Wait for all queued work and return {key: result}.
+
+        Work that raised is reported and left out. progress, if given, is
+        called as progress(name, done, total) as work finishes.
+        """
+        with self._lock:
+            keys = {future: key for key, future in self._futures.items()}
+        results = {}
+        for done, future in enumerate(as_completed(keys), 1):
+            try:
+                results[keys[future]] = future.result()
+            except Exception as e:
+                print(f"{self.name} failed for {keys[future]}: {e}")
+            if progress:
+                progress(self.name, done, len(keys))
+        self._executor.shutdown()
+        return results
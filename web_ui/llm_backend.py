@@ -0,0 +1,320 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+
+DEFAULT_BACKEND = "gemini"
+
+class BackendError(Exception):
+    """Error raised by a backend, with the HTTP-style status code when one is known"""
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class LLMUsage:
+    """Token counts of a call, named like the usage_metadata of genai responses"""
+    def __init__(self, prompt_token_count, candidates_token_count, cached_content_token_count=0):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.cached_content_token_count = cached_content_token_count
+
+class LLMResponse:
+    """Response returned by non-Gemini backends; mirrors the .text attribute of genai responses"""
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+class LLMBackend:
+    """Interface every generator talks to.
+
+    Backends expose models.generate_content(contents=[...], model=...) and
+    return an object with a .text attribute, the same call shape as
+    genai.Client, so backends can be swapped without touching call sites.
+    models.generate_content_stream(...) yields the response in chunks,
+    each with a .text attribute.
+    """
+    name = "base"
+
+    def __init__(self):
+        self.models = self
+
+    def generate_content(self, contents, model, **kwargs):
+        raise NotImplementedError
+
+    def generate_content_stream(self, contents, model, **kwargs):
+        # Backends without streaming answer in a single chunk
+        yield self.generate_content(contents=contents, model=model, **kwargs)
+
+    def cache_prefix(self, model, prefix, ttl_seconds):
+        """Store prefix with the provider so calls whose contents start with it reuse it.
+
+        Returns True if the prefix was cached; backends without context
+        caching return False and the prefix is simply sent with each call.
+        """
+        return False
+
+class GeminiBackend(LLMBackend):
+    """Adapter for the Google Gemini API"""
+    name = "gemini"
+
+    def __init__(self, api_key):
+        super().__init__()
+        # Imported here so the fake backend works without the Gemini SDK installed
+        from google import genai
+        self._client = genai.Client(api_key=api_key)
+        # (model, prefix text) -> name of the cached content holding it
+        self._prefix_caches = {}
+
+    def _cached_prefix(self, contents, model, kwargs):
+        """Swap a cached leading prefix for a reference to the cache; returns (contents, kwargs, cache key)"""
+        key = (model, contents[0]) if contents and isinstance(contents[0], str) else None
+        name = self._prefix_caches.get(key)
+        if name is None:
+            return contents, kwargs, None
+        config = dict(kwargs.get("config") or {})
+        config["cached_content"] = name
+        return contents[1:], {**kwargs, "config": config}, key
+
+    def generate_content(self, contents, model, **kwargs):
+        sent_contents, sent_kwargs, key = self._cached_prefix(contents, model, kwargs)
+        if key is None:
+            return self._client.models.generate_content(contents=contents, model=model, **kwargs)
+        try:
+            return self._client.models.generate_content(contents=sent_contents, model=model, **sent_kwargs)
+        except Exception as e:
+            if "cached" not in str(e).lower():
+                raise
+            # The cache expired or was deleted; send the prefix again from now on
+            print(f"Cached prompt prefix unavailable ({e}), sending it in full")
+            self._prefix_caches.pop(key, None)
+            return self._client.models.generate_content(contents=contents, model=model, **kwargs)
+
+    def generate_content_stream(self, contents, model, **kwargs):
+        contents, kwargs, _ = self._cached_prefix(contents, model, kwargs)
+        return self._client.models.generate_content_stream(contents=contents, model=model, **kwargs)
+
+    def cache_prefix(self, model, prefix, ttl_seconds):
+        if (model, prefix) in self._prefix_caches:
+            return True
+        cache = self._client.caches.create(
+            model=model,
+            config={"contents": [prefix], "ttl": f"{int(ttl_seconds)}s"}
+        )
+        self._prefix_caches[(model, prefix)] = cache.name
+        return True
+
+class FakeBackend(LLMBackend):
+    """Deterministic local stand-in for Gemini, for offline benchmarking and profiling.
+
+    Looks at the prompt to decide which JSON shape the caller expects and
+    returns schema-valid content derived from a hash of the prompt, so the
+    same prompt always gets the same answer. Each call sleeps for latency
+    seconds (plus up to latency_jitter), and fails with a simulated 429 with
+    probability failure_rate. Streamed responses arrive in small chunks,
+    the first after a fifth of the latency. Cached prompt prefixes are
+    reported in the usage counts the way Gemini reports them.
+    """
+    name = "fake"
+
+    VERBS = ["Search", "Sneak past", "Confront", "Climb", "Investigate", "Hack", "Follow", "Negotiate with"]
+    TARGETS = ["the castle gate", "the forest trail", "the ancient temple", "the city market",
+               "the mountain pass", "the hidden cave", "the guard captain", "the old laboratory"]
+    DETAILS = ["under cover of night", "while the storm rages", "before the enemy arrives",
+               "with your trusted ally", "as the crowd grows noisy", "in the quiet before dawn"]
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, failure_rate=0.0, seed=0):
+        super().__init__()
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.calls = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cached_prefixes = set()
+
+    # Characters per streamed chunk, roughly a few tokens
+    STREAM_CHUNK_SIZE = 16
+
+    def _start_call(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._rng.random() * self.latency_jitter
+            fail = self._rng.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        return delay, fail
+
+    def generate_content(self, contents, model, **kwargs):
+        prompt = "\n".join(str(part) for part in contents)
+        delay, fail = self._start_call()
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise BackendError("429 RESOURCE_EXHAUSTED: simulated rate limit from FakeBackend", status_code=429)
+
+        rng = random.Random(f"{self.seed}:{model}:{prompt}")
+        text = self._respond(prompt, rng)
+        return LLMResponse(text, self._usage(contents, model, prompt, text))
+
+    def _usage(self, contents, model, prompt, text):
+        """Token counts as Gemini would report them, ~4 characters per token"""
+        cached = len(contents[0]) // 4 if contents and (model, contents[0]) in self._cached_prefixes else 0
+        return LLMUsage(len(prompt) // 4, len(text) // 4, cached)
+
+    def cache_prefix(self, model, prefix, ttl_seconds):
+        with self._lock:
+            self._cached_prefixes.add((model, prefix))
+        return True
+
+    def generate_content_stream(self, contents, model, **kwargs):
+        prompt = "\n".join(str(part) for part in contents)
+        delay, fail = self._start_call()
+        if delay > 0:
+            time.sleep(delay / 5)
+        if fail:
+            raise BackendError("429 RESOURCE_EXHAUSTED: simulated rate limit from FakeBackend", status_code=429)
+
+        rng = random.Random(f"{self.seed}:{model}:{prompt}")
+        text = self._respond(prompt, rng)
+        chunks = [text[i:i + self.STREAM_CHUNK_SIZE] for i in range(0, len(text), self.STREAM_CHUNK_SIZE)]
+        for chunk in chunks:
+            yield LLMResponse(chunk)
+            if delay > 0:
+                time.sleep(delay * 4 / 5 / len(chunks))
+
+    def _sentence(self, rng):
+        return f"{rng.choice(self.VERBS)} {rng.choice(self.TARGETS)} {rng.choice(self.DETAILS)}."
+
+    def _scene(self, rng, sentences=3):
+        parts = []
+        for _ in range(sentences):
+            sentence = self._sentence(rng)
+            parts.append(f"You {sentence[0].lower()}{sentence[1:]}")
+        return " ".join(parts)
+
+    def _choice_count(self, prompt):
+        match = re.search(r"(?:EXACTLY|exactly|Generate|generate)\s+(\d+)", prompt)
+        return int(match.group(1)) if match else 2
+
+    def _story_node(self, prompt, rng):
+        is_ending = '"is_ending": true' in prompt
+        path_match = re.search(r'"story_path": "([^"]*)"', prompt)
+        node = {
+            "story": self._scene(rng),
+            "scene_state": {"location": rng.choice(self.TARGETS)[4:].title(), "time_of_day": "night",
+                            "weather": "stormy", "ambient": "tense"},
+            "characters": {
+                "player": {"health": 100, "mood": "determined", "status_effects": []},
+                "others": [{"name": "Mentor", "description": "A seasoned guide", "relationship": "ally"}]
+            },
+            "story_path": path_match.group(1) if path_match else "Unknown",
+            "is_ending": is_ending
+        }
+        if not is_ending:
+            node["choices"] = [
+                {"text": self._sentence(rng), "consequences": {"health_change": rng.randint(-10, 5), "item_changes": []}}
+                for _ in range(2)
+            ]
+        return node
+
+    def _respond_batch(self, prompt, rng, count):
+        """Reply to a prompt asking for several nodes at once, one entry per id in the prompt"""
+        entries = []
+        for node_id in re.findall(r'"id": "([^"<]+)"', prompt):
+            if '"scene_state"' in prompt:
+                entry = self._story_node(prompt, rng)
+            elif '"endings"' in prompt:
+                entry = {"endings": [{"text": self._scene(rng, 2)} for _ in range(count)]}
+            else:
+                entry = {"choices": [{"text": self._sentence(rng), "consequences": self._scene(rng, 1)}
+                                     for _ in range(count)]}
+            entry["id"] = node_id
+            entries.append(entry)
+        return json.dumps({"nodes": entries})
+
+    def _respond(self, prompt, rng):
+        count = self._choice_count(prompt)
+
+        if '"nodes": [' in prompt:
+            return self._respond_batch(prompt, rng, count)
+
+        if '"endings"' in prompt:
+            return json.dumps({"endings": [{"text": self._scene(rng, 2)} for _ in range(count)]})
+
+        if '"ending"' in prompt:
+            return json.dumps({"ending": self._scene(rng, 2)})
+
+        if '"arc": [' in prompt:
+            theme_match = re.search(r'"theme": "([^"]*)"', prompt)
+            stages = ["The Ordinary World", "The Call to Adventure", "Crossing the Threshold",
+                      "Tests, Allies, and Enemies", "The Approach", "The Ordeal", "The Reward",
+                      "Return and Resolution"]
+            return json.dumps({
+                "theme": theme_match.group(1) if theme_match else "adventure",
+                "golden_path": self._scene(rng, 5),
+                "arc": [
+                    {
+                        "stage": stage,
+                        "description": self._scene(rng, 2),
+                        "characters": ["Mentor", "Rival"],
+                        "key_plot_points": [self._sentence(rng), self._sentence(rng)],
+                        "potential_branches": [self._sentence(rng), self._sentence(rng)],
+                        "thematic_elements": ["courage", "loyalty"]
+                    }
+                    for stage in stages
+                ]
+            })
+
+        if '"scene_state"' in prompt:
+            return json.dumps(self._story_node(prompt, rng))
+
+        if '"choices"' in prompt:
+            return json.dumps({
+                "story": self._scene(rng),
+                "is_ending": False,
+                "choices": [
+                    {"text": self._sentence(rng), "consequences": self._scene(rng, 1)}
+                    for _ in range(count)
+                ]
+            })
+
+        if "dialogue exchange" in prompt:
+            speaker_match = re.search(r"between the player and (.+?) in a", prompt)
+            speaker = speaker_match.group(1) if speaker_match else "Stranger"
+            return "\n".join([
+                f"[You]: What do you know about {rng.choice(self.TARGETS)}?",
+                f"[{speaker}]: {self._sentence(rng)} That is all I can tell you.",
+                "[You]: Then we move now."
+            ])
+
+        if "thought" in prompt:
+            sentence = self._sentence(rng)
+            return f"I should {sentence[0].lower()}{sentence[1:]}"
+
+        # Free-form requests such as the story arc outline
+        return "\n".join(f"{i}. {self._scene(rng, 2)}" for i in range(1, 9))
+
+def create_backend(name=None):
+    """Build the backend selected by LLM_BACKEND in keys.env ("gemini" or "fake")
+
+    The fake backend reads FAKE_LLM_LATENCY, FAKE_LLM_LATENCY_JITTER,
+    FAKE_LLM_FAILURE_RATE and FAKE_LLM_SEED.
+    """
+    name = (name or os.getenv("LLM_BACKEND", DEFAULT_BACKEND)).lower()
+    if name == "fake":
+        return FakeBackend(
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0")),
+            latency_jitter=float(os.getenv("FAKE_LLM_LATENCY_JITTER", "0")),
+            failure_rate=float(os.getenv("FAKE_LLM_FAILURE_RATE", "0")),
+            seed=int(os.getenv("FAKE_LLM_SEED", "0"))
+        )
+    if name == "gemini":
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY not found in keys.env")
+        return GeminiBackend(api_key)
+    raise ValueError(f"Unknown LLM_BACKEND '{name}' (expected 'gemini' or 'fake')")
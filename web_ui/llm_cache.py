@@ -0,0 +1,286 @@
+import contextlib
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# Default cache settings (see create_response_cache for the environment overrides)
+DEFAULT_CACHE_PATH = ".llm_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL = 30 * 24 * 3600  # seconds, 0 = never expire
+
+# How many writes to allow between eviction checks
+EVICTION_CHECK_INTERVAL = 64
+
+class ResponseCache:
+    """Disk-backed cache of LLM responses, keyed by a hash of model and prompt.
+
+    Entries live in a single SQLite file so they survive restarts and crashes.
+    Least recently used entries are evicted once the entry count or total size
+    goes over its limit, and entries older than ttl seconds count as misses.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes_since_check = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.commit()
+        self._evict()
+
+    @staticmethod
+    def make_key(model, prompt, extra=""):
+        """Content address for a request: sha256 over model, prompt and any request options"""
+        digest = hashlib.sha256()
+        for part in (model, prompt, extra):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, model, prompt, extra=""):
+        """Return the cached response text, or None on a miss"""
+        key = self.make_key(model, prompt, extra)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            response, created_at = row
+            if self.ttl and now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE responses SET last_access = ?, hit_count = hit_count + 1 WHERE key = ?",
+                (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return response
+
+    def put(self, model, prompt, response, extra=""):
+        """Store a response, evicting old entries if the cache is over its limits"""
+        key = self.make_key(model, prompt, extra)
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now)
+            )
+            self._conn.commit()
+            self._writes_since_check += 1
+            if self._writes_since_check < EVICTION_CHECK_INTERVAL:
+                return
+        self._evict()
+
+    def delete(self, model, prompt, extra=""):
+        """Remove one response, e.g. a reply its caller could not use"""
+        key = self.make_key(model, prompt, extra)
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until within limits"""
+        with self._lock:
+            self._writes_since_check = 0
+            if self.ttl:
+                cursor = self._conn.execute(
+                    "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,)
+                )
+                self.evictions += cursor.rowcount
+
+            count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            if count > self.max_entries or total_bytes > self.max_bytes:
+                rows = self._conn.execute(
+                    "SELECT key, size FROM responses ORDER BY last_access ASC"
+                )
+                doomed = []
+                for key, size in rows:
+                    if count <= self.max_entries and total_bytes <= self.max_bytes:
+                        break
+                    doomed.append((key,))
+                    count -= 1
+                    total_bytes -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+                self.evictions += len(doomed)
+            self._conn.commit()
+
+    def stats(self):
+        """Hit/miss counters for this process plus the current size of the cache"""
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": total_bytes
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+class CachedResponse:
+    """Minimal stand-in for a model response served from the cache"""
+    def __init__(self, text):
+        self.text = text
+
+class CachedClient:
+    """Wraps a client so models.generate_content() is answered from the cache when possible.
+
+    Exposes the same models.generate_content(contents=..., model=...) call as
+    genai.Client, so existing call sites do not change. Entries are namespaced
+    by the backend name so e.g. fake responses never answer real requests.
+    Streamed responses are cached once complete; a cached answer is streamed
+    back as a single chunk.
+
+    Any non-empty reply is cached as it arrives. A caller that rejects a
+    reply (unparseable or invalid JSON) calls evict() with the same
+    arguments, so the broken reply is not served again.
+    """
+    def __init__(self, client, cache=None, namespace=None):
+        self.client = client
+        self.cache = cache
+        self.namespace = namespace if namespace is not None else getattr(client, "name", "")
+        self.models = self
+        self._refreshing = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def refreshing(self, enabled=True, this_thread=False):
+        """Within this block, skip cached answers (fresh responses are still cached)
+
+        With this_thread, only requests made by the calling thread skip
+        the cache, e.g. to ask again after a rejected reply.
+        """
+        if not enabled:
+            yield
+            return
+        if this_thread:
+            self._local.refreshing = getattr(self._local, "refreshing", 0) + 1
+            try:
+                yield
+            finally:
+                self._local.refreshing -= 1
+            return
+        with self._lock:
+            self._refreshing += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._refreshing -= 1
+
+    def _use_cached(self):
+        return not self._refreshing and not getattr(self._local, "refreshing", 0)
+
+    def _entry(self, contents, model, kwargs):
+        """(model, prompt, extra) the cache stores a request under"""
+        prompt = "\n".join(str(part) for part in contents)
+        extra = repr(sorted(kwargs.items())) if kwargs else ""
+        return (f"{self.namespace}/{model}" if self.namespace else model), prompt, extra
+
+    def evict(self, contents, model, **kwargs):
+        """Forget the cached reply to this request, e.g. because it could not be parsed"""
+        if self.cache is not None:
+            self.cache.delete(*self._entry(contents, model, kwargs))
+
+    def generate_content(self, contents, model, **kwargs):
+        if self.cache is None:
+            return self.client.models.generate_content(contents=contents, model=model, **kwargs)
+
+        cache_model, prompt, extra = self._entry(contents, model, kwargs)
+        if self._use_cached():
+            cached_text = self.cache.get(cache_model, prompt, extra)
+            if cached_text is not None:
+                return CachedResponse(cached_text)
+
+        response = self.client.models.generate_content(contents=contents, model=model, **kwargs)
+        # Only cache real answers; empty responses are usually transient failures
+        if response.text:
+            self.cache.put(cache_model, prompt, response.text, extra)
+        return response
+
+    def cache_prefix(self, model, prefix, ttl_seconds):
+        """Cache a shared prompt prefix with the provider; answers served from disk never use it"""
+        return self.client.models.cache_prefix(model, prefix, ttl_seconds)
+
+    def generate_content_stream(self, contents, model, **kwargs):
+        if self.cache is None:
+            yield from self.client.models.generate_content_stream(contents=contents, model=model, **kwargs)
+            return
+
+        cache_model, prompt, extra = self._entry(contents, model, kwargs)
+        if self._use_cached():
+            cached_text = self.cache.get(cache_model, prompt, extra)
+            if cached_text is not None:
+                yield CachedResponse(cached_text)
+                return
+
+        parts = []
+        for chunk in self.client.models.generate_content_stream(contents=contents, model=model, **kwargs):
+            parts.append(chunk.text or "")
+            yield chunk
+        text = "".join(parts)
+        if text:
+            self.cache.put(cache_model, prompt, text, extra)
+
+def create_response_cache():
+    """Build the on-disk cache configured in keys.env, or None if LLM_CACHE=off
+
+    Settings: LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_MAX_BYTES and
+    LLM_CACHE_TTL (seconds, 0 = never expire).
+    """
+    if os.getenv("LLM_CACHE", "on").lower() in ("0", "off", "false", "no"):
+        return None
+    try:
+        return ResponseCache(
+            path=os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+            ttl=float(os.getenv("LLM_CACHE_TTL", DEFAULT_TTL))
+        )
+    except sqlite3.Error as e:
+        print(f"Could not open LLM response cache: {e}")
+        return None
@@ -0,0 +1,307 @@
+import os
+import random
+import re
+import threading
+import time
+from tracing import tracer
+
+# Gemini quota for one API key (LLM_RPM / LLM_TPM in keys.env, 0 = no limit)
+DEFAULT_REQUESTS_PER_MINUTE = 1000
+DEFAULT_TOKENS_PER_MINUTE = 1000000
+
+# Concurrent requests: the limit starts at DEFAULT_CONCURRENCY and adapts
+# between 1 and LLM_MAX_CONCURRENCY
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_CONCURRENCY = 16
+
+# Retries of a throttled or failed request, with jittered exponential backoff
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_RETRY_BASE_DELAY = 1.0
+DEFAULT_RETRY_MAX_DELAY = 60.0
+
+# Status codes that mean "slow down / try again" rather than "bad request"
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Rough token estimate used to charge the token bucket before a call
+CHARS_PER_TOKEN = 4
+EXPECTED_RESPONSE_TOKENS = 500
+
+class TokenBucket:
+    """Allows rate_per_minute units per minute, with bursts up to capacity"""
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount=1):
+        """Wait until amount units are available and take them"""
+        # A single request bigger than the bucket still goes through once it is full
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def charge(self, amount):
+        """Take amount units without waiting, e.g. to correct an estimate afterwards"""
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+class AdaptiveConcurrency:
+    """Concurrency limit tuned by AIMD (additive increase, multiplicative decrease).
+
+    Every success raises the limit by 1/limit, so it grows by about one per
+    round of requests; a throttled request halves it. The limit settles
+    just under the level the API can sustain.
+    """
+    def __init__(self, initial=DEFAULT_CONCURRENCY, minimum=1, maximum=DEFAULT_MAX_CONCURRENCY):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def on_throttle(self):
+        with self._condition:
+            self.limit = max(self.minimum, self.limit / 2)
+
+# A status in an error message without a code attribute: at the very start
+# ("503 UNAVAILABLE") or labelled ("status code: 429"), never any number in the text
+STATUS_IN_MESSAGE = re.compile(r"^\s*(\d{3})\b|\bstatus(?:[ _]code)?\s*[:=]?\s*(\d{3})\b", re.IGNORECASE)
+
+def error_status(error):
+    """HTTP status code of a backend or Gemini SDK error, if it has one
+
+    Reads the code the error carries (status_code, google.genai's
+    APIError.code, or the status of an attached HTTP response) before
+    falling back to a status at the start of the message.
+    """
+    for source in (error, getattr(error, "response", None)):
+        for attribute in ("status_code", "code"):
+            status = getattr(source, attribute, None)
+            if isinstance(status, int):
+                return status
+    match = STATUS_IN_MESSAGE.search(str(error))
+    if match:
+        return int(match.group(1) or match.group(2))
+    if "RESOURCE_EXHAUSTED" in str(error):
+        return 429
+    return None
+
+def response_token_counts(response, estimated_prompt_tokens):
+    """(prompt, response) tokens of a call, from Gemini usage metadata when available"""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    response_tokens = getattr(usage, "candidates_token_count", None)
+    if isinstance(prompt_tokens, int) and isinstance(response_tokens, int):
+        return prompt_tokens, response_tokens
+    return estimated_prompt_tokens, len(response.text or "") // CHARS_PER_TOKEN
+
+class RateLimitedClient:
+    """Wraps a client so every models.generate_content() call respects the API quota.
+
+    Before a call it takes one request from the requests-per-minute bucket,
+    the estimated prompt and response tokens from the tokens-per-minute
+    bucket, and a slot from the adaptive concurrency limit. 429 and 5xx
+    errors shrink the concurrency limit and are retried with jittered
+    exponential backoff, so large generations slow down instead of falling
+    back to canned content. Other errors are raised straight away.
+
+    Streamed calls (models.generate_content_stream) hold their slot until
+    the last chunk; they are only retried if they fail before the first.
+
+    A leading prefix cached through cache_prefix is not charged to the
+    tokens-per-minute bucket: the provider holds it, and the call only
+    sends what follows.
+    """
+    def __init__(self, client, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE, concurrency=None,
+                 max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_RETRY_BASE_DELAY,
+                 max_delay=DEFAULT_RETRY_MAX_DELAY):
+        self.client = client
+        self.name = getattr(client, "name", "")
+        self.models = self
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.throttled = 0
+        self._cached_prefixes = set()  # (model, prefix) cached with the provider
+
+    def _backoff(self, attempt):
+        # "Full jitter": spreads retries of many throttled threads apart
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _prompt_tokens(self, contents, model):
+        """Estimated prompt tokens a call sends, leaving out a prefix cached with the provider"""
+        if contents and isinstance(contents[0], str) and (model, contents[0]) in self._cached_prefixes:
+            contents = contents[1:]
+        return sum(len(str(part)) for part in contents) // CHARS_PER_TOKEN
+
+    def _acquire_quota(self, prompt_tokens):
+        if self.request_bucket:
+            self.request_bucket.acquire()
+        if self.token_bucket:
+            self.token_bucket.acquire(prompt_tokens + EXPECTED_RESPONSE_TOKENS)
+
+    def _retry_delay(self, error, attempt):
+        """Backoff before retrying error, or None if it must be raised"""
+        status = error_status(error)
+        if status not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+            return None
+        if status == 429:
+            self.throttled += 1
+            tracer.increment("llm_throttled")
+        self.concurrency.on_throttle()
+        delay = self._backoff(attempt)
+        self.retries += 1
+        tracer.increment("llm_retries")
+        print(f"LLM request failed ({status}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        return delay
+
+    def generate_content(self, contents, model, **kwargs):
+        prompt_tokens = self._prompt_tokens(contents, model)
+        attempt = 0
+        while True:
+            self._acquire_quota(prompt_tokens)
+
+            self.concurrency.acquire()
+            try:
+                tracer.increment("llm_api_calls")
+                with tracer.span("network"):
+                    response = self.client.models.generate_content(contents=contents, model=model, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                response = None
+            finally:
+                self.concurrency.release()
+
+            if response is None:
+                # Back off without holding a concurrency slot
+                time.sleep(delay)
+                continue
+
+            self.concurrency.on_success()
+            used_prompt_tokens, response_tokens = response_token_counts(response, prompt_tokens)
+            tracer.increment("prompt_tokens", used_prompt_tokens)
+            tracer.increment("response_tokens", response_tokens)
+            cached_tokens = getattr(getattr(response, "usage_metadata", None), "cached_content_token_count", None)
+            cached_tokens = cached_tokens if isinstance(cached_tokens, int) else 0
+            if cached_tokens:
+                tracer.increment("cached_prompt_tokens", cached_tokens)
+            if self.token_bucket:
+                # Correct the estimate now that the real usage is known; cached tokens are not charged
+                self.token_bucket.charge(used_prompt_tokens - cached_tokens + response_tokens
+                                         - prompt_tokens - EXPECTED_RESPONSE_TOKENS)
+            return response
+
+    def cache_prefix(self, model, prefix, ttl_seconds):
+        """Cache a shared prompt prefix with the provider (see LLMBackend.cache_prefix)"""
+        if self.request_bucket:
+            self.request_bucket.acquire()
+        cached = self.client.cache_prefix(model, prefix, ttl_seconds)
+        if cached:
+            self._cached_prefixes.add((model, prefix))
+        return cached
+
+    def generate_content_stream(self, contents, model, **kwargs):
+        prompt_tokens = self._prompt_tokens(contents, model)
+        attempt = 0
+        while True:
+            self._acquire_quota(prompt_tokens)
+
+            self.concurrency.acquire()
+            started = False
+            response_chars = 0
+            try:
+                tracer.increment("llm_api_calls")
+                with tracer.span("network"):
+                    call_start = time.perf_counter()
+                    for chunk in self.client.models.generate_content_stream(contents=contents, model=model, **kwargs):
+                        if not started:
+                            started = True
+                            tracer.record("first_token", time.perf_counter() - call_start)
+                        response_chars += len(chunk.text or "")
+                        yield chunk
+            except Exception as e:
+                delay = None if started else self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+            else:
+                delay = None
+            finally:
+                self.concurrency.release()
+
+            if delay is not None:
+                # Back off without holding a concurrency slot
+                time.sleep(delay)
+                continue
+
+            self.concurrency.on_success()
+            response_tokens = response_chars // CHARS_PER_TOKEN
+            tracer.increment("prompt_tokens", prompt_tokens)
+            tracer.increment("response_tokens", response_tokens)
+            if self.token_bucket:
+                self.token_bucket.charge(response_tokens - EXPECTED_RESPONSE_TOKENS)
+            return
+
+    def stats(self):
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "retries": self.retries,
+            "throttled": self.throttled
+        }
+
+def create_rate_limited_client(client):
+    """Wrap client with the limits from keys.env
+
+    Settings: LLM_RPM, LLM_TPM (0 = no limit), LLM_CONCURRENCY (starting
+    concurrency), LLM_MAX_CONCURRENCY, LLM_MAX_RETRIES and
+    LLM_RETRY_BASE_DELAY (seconds).
+    """
+    return RateLimitedClient(
+        client,
+        requests_per_minute=int(os.getenv("LLM_RPM", DEFAULT_REQUESTS_PER_MINUTE)),
+        tokens_per_minute=int(os.getenv("LLM_TPM", DEFAULT_TOKENS_PER_MINUTE)),
+        concurrency=AdaptiveConcurrency(
+            initial=int(os.getenv("LLM_CONCURRENCY", DEFAULT_CONCURRENCY)),
+            maximum=int(os.getenv("LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+        ),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", DEFAULT_MAX_RETRIES)),
+        base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", DEFAULT_RETRY_BASE_DELAY))
+    )
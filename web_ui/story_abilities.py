@@ -0,0 +1,97 @@
+import json
+import os
+import random
+from functools import lru_cache
+from story_seed import stable_uniforms
+
+# The catalog shipped next to this file; ABILITIES_FILE in keys.env points at another one
+DEFAULT_ABILITIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "abilities.json")
+
+# (minimum experience, tier), highest first
+ABILITY_TIERS = [(100, 4), (60, 3), (30, 2), (0, 1)]
+
+def ability_tier(experience_level):
+    """1 (basic) to 4 (master) abilities are unlocked by experience"""
+    for minimum, tier in ABILITY_TIERS:
+        if experience_level >= minimum:
+            return tier
+    return 1
+
+class AbilityCatalog:
+    """Special abilities indexed by (theme, tier).
+
+    data is {"generic": {tier: [abilities]}, "themes": {theme key: {tier:
+    [abilities]}}}, as in abilities.json. A story's theme uses the first
+    theme key it contains ("Star Wars: Andor" uses "star wars"); the
+    generic abilities are open to every theme. For each theme key and tier
+    the abilities of that tier and below are built into one tuple up front,
+    so a lookup is a dictionary read and the theme match is cached.
+    """
+    def __init__(self, data):
+        self.theme_keys = list(data.get("themes", {}))
+        generic = data.get("generic", {})
+        tiers = [tier for _, tier in ABILITY_TIERS]
+        self._index = {}
+        for theme_key in [None] + self.theme_keys:
+            themed = data["themes"][theme_key] if theme_key else {}
+            for tier in tiers:
+                # Generic abilities first, then the theme's, lowest tier first
+                self._index[theme_key, tier] = tuple(
+                    ability for abilities in (generic, themed) for t in range(1, tier + 1)
+                    for ability in abilities.get(str(t), [])
+                )
+        self.theme_key = lru_cache(maxsize=256)(self._match_theme)
+
+    @classmethod
+    def load(cls, path=None):
+        """The catalog in path (default ABILITIES_FILE or abilities.json); empty if it cannot be read"""
+        path = path or os.getenv("ABILITIES_FILE", DEFAULT_ABILITIES_FILE)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(json.load(f))
+        except Exception as e:
+            print(f"Could not load abilities from {path}: {e}")
+            return cls({})
+
+    def _match_theme(self, theme):
+        theme = theme.lower()
+        for theme_key in self.theme_keys:
+            if theme_key in theme:
+                return theme_key
+        return None
+
+    def abilities(self, theme, tier):
+        """Every ability open to theme at tier, lowest tier first"""
+        return self._index[self.theme_key(theme), tier]
+
+    def select(self, theme, tier, existing=(), seed=None):
+        """One ability open to theme at tier whose name is not in existing, or None.
+
+        existing is a set of ability names (other collections are turned
+        into one). Every remaining ability is equally likely; with seed the
+        pick is reproducible, drawn from (seed, theme, tier, number of
+        abilities held).
+        """
+        pool = self.abilities(theme, tier)
+        if existing and not isinstance(existing, (set, frozenset)):
+            existing = set(existing)
+        owned = sum(1 for ability in pool if ability["name"] in existing) if existing else 0
+        if owned == len(pool):
+            return None
+        if seed is None:
+            draw = random.random()
+        else:
+            draw = stable_uniforms(seed, self.theme_key(theme), tier, len(existing))[0]
+        # Walk to the n-th ability not owned, without building a filtered list
+        remaining = min(int(draw * (len(pool) - owned)), len(pool) - owned - 1)
+        if not owned:
+            return dict(pool[remaining])
+        for ability in pool:
+            if ability["name"] in existing:
+                continue
+            if remaining == 0:
+                return dict(ability)
+            remaining -= 1
+        return None
+
+ABILITY_CATALOG = AbilityCatalog.load()
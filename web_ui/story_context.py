@@ -0,0 +1,121 @@
+import os
+import re
+import threading
+from rate_limiter import CHARS_PER_TOKEN
+from tracing import tracer
+
+# How long a prefix cached with the provider lives; a story tree is built well within this
+DEFAULT_CONTEXT_CACHE_TTL = 3600
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+def context_cache_enabled():
+    """True unless CONTEXT_CACHE is switched off in keys.env"""
+    return os.getenv("CONTEXT_CACHE", "on").lower() not in ("0", "off", "false", "no")
+
+def summarize(text, max_chars=300):
+    """The first sentences of text that fit in max_chars, whitespace collapsed"""
+    text = re.sub(r"\s+", " ", text or "").strip()
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    end = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "))
+    return cut[:end + 1] if end > 0 else cut.rsplit(" ", 1)[0] + "..."
+
+def compact_outline(text, max_tokens):
+    """Shorten an outline to about max_tokens.
+
+    Markdown and blank lines go first, then every line is cut to its first
+    sentence, then lines are shortened evenly; headings and the order of
+    the outline are kept.
+    """
+    lines = [re.sub(r"[*_#`]+", "", line).strip() for line in (text or "").splitlines()]
+    lines = [line for line in lines if line]
+    compact = "\n".join(lines)
+    if estimate_tokens(compact) <= max_tokens:
+        return compact
+    lines = [summarize(line, 160) for line in lines]
+    compact = "\n".join(lines)
+    if estimate_tokens(compact) <= max_tokens:
+        return compact
+    per_line = max(40, max_tokens * CHARS_PER_TOKEN // len(lines))
+    return "\n".join(summarize(line, per_line) for line in lines)[:max_tokens * CHARS_PER_TOKEN]
+
+class StoryContext:
+    """The part of a story's prompts that is the same for every node, built once.
+
+    Tree generation used to paste the whole story arc (and in test_arc the
+    stage details and output format) into every node prompt. A
+    StoryContext holds that text as a prefix sent as the first part of
+    every request, and each node adds only a short delta: its place in the
+    arc, a summary of where the story started and the choices that led
+    there.
+
+    full_prefix is the complete shared context. If the provider can cache
+    it (Gemini context caching, at least CONTEXT_CACHE_MIN_TOKENS), it is
+    uploaded once and calls send only the delta. Otherwise calls start
+    with the compact prefix, and per-node detail (e.g. the current stage of
+    the arc) is sent with the delta instead. The estimated prompt tokens
+    of each node are kept for report().
+    """
+    def __init__(self, client, prefix, full_prefix=None, model="gemini-2.0-flash"):
+        self.client = client
+        self.prefix = prefix
+        self.full_prefix = full_prefix or prefix
+        self.model = model
+        self.cached = self._cache_prefix()
+        self.prefix_tokens = estimate_tokens(self.full_prefix if self.cached else self.prefix)
+        self.node_tokens = {}
+        self._lock = threading.Lock()
+
+    def _cache_prefix(self):
+        min_tokens = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "4096"))
+        if not context_cache_enabled() or estimate_tokens(self.full_prefix) < min_tokens:
+            return False
+        cache_prefix = getattr(self.client.models, "cache_prefix", None)
+        if cache_prefix is None:
+            return False
+        try:
+            ttl = int(os.getenv("CONTEXT_CACHE_TTL", str(DEFAULT_CONTEXT_CACHE_TTL)))
+            return bool(cache_prefix(self.model, self.full_prefix, ttl))
+        except Exception as e:
+            print(f"Could not cache the shared prompt prefix, sending a compact one with each call: {e}")
+            return False
+
+    def contents(self, delta, node_id=None, detail=""):
+        """contents for generate_content: the shared prefix, then this node's delta
+
+        detail is context the full prefix already holds; it is only sent
+        when that prefix is not cached.
+        """
+        if detail and not self.cached:
+            delta = f"{detail}\n{delta}"
+        delta_tokens = estimate_tokens(delta)
+        with self._lock:
+            self.node_tokens[node_id or f"call_{len(self.node_tokens)}"] = delta_tokens
+        tracer.increment("context_delta_tokens", delta_tokens)
+        return [self.full_prefix if self.cached else self.prefix, delta]
+
+    def summary(self):
+        with self._lock:
+            deltas = list(self.node_tokens.values())
+        average = sum(deltas) / len(deltas) if deltas else 0
+        return {
+            "prefix_tokens": self.prefix_tokens,
+            "prefix_cached": self.cached,
+            "node_prompts": len(deltas),
+            "avg_delta_tokens": round(average),
+            "max_delta_tokens": max(deltas, default=0),
+            # What each node costs beyond what the provider already holds
+            "avg_uncached_tokens_per_node": round(average + (0 if self.cached else self.prefix_tokens))
+        }
+
+    def report(self):
+        stats = self.summary()
+        if not stats["node_prompts"]:
+            return
+        where = "cached with the provider" if stats["prefix_cached"] else "compact, sent with each call"
+        print(f"Prompt context: {stats['prefix_tokens']} token shared prefix ({where}); "
+              f"{stats['node_prompts']} node prompts averaging {stats['avg_delta_tokens']} tokens of their own "
+              f"(max {stats['max_delta_tokens']}), ~{stats['avg_uncached_tokens_per_node']} uncached input tokens per node")
@@ -0,0 +1,280 @@
+from functools import reduce
+from itertools import repeat
+from operator import or_
+from story_features import STORY_FEATURES, WORD, story_features
+from story_seed import stable_digest, stable_hash, stable_uniforms, story_seed, weighted_choice
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is optional; without it enrich_nodes goes through the nodes one at a time
+    np = None
+
+# Locations for scenes whose text names none, by the first keyword group found in the theme
+LOCATIONS_BY_THEME = [
+    (("star wars", "sci-fi", "space"), ["Starship Bridge", "Alien Planet", "Space Station", "Imperial Base", "Cantina"]),
+    (("fantasy", "medieval", "magic"), ["Ancient Castle", "Enchanted Forest", "Wizard's Tower", "Dragon's Lair", "Dwarven Mines"]),
+    (("cyberpunk", "future", "tech"), ["Neon District", "Corporate Tower", "Hacker's Den", "Black Market", "Virtual Reality"]),
+    (("horror", "scary"), ["Abandoned Mansion", "Foggy Cemetery", "Dark Basement", "Cursed Village", "Forgotten Asylum"]),
+    (("western", "cowboy"), ["Dusty Saloon", "Sheriff's Office", "Desert Canyon", "Train Station", "Gold Mine"]),
+    (("detective", "mystery", "noir"), ["Crime Scene", "Detective's Office", "Shady Alley", "Upscale Club", "Abandoned Warehouse"]),
+    (("superhero", "avengers", "hero"), ["City Rooftop", "Secret Hideout", "Villain's Lair", "Downtown Battlefield", "Research Lab"])
+]
+# Generic interesting locations if the theme doesn't match any category
+DEFAULT_LOCATIONS = ["Crystal Caves", "Ancient Ruins", "Hidden Valley", "Forgotten Sanctuary", "Misty Lake"]
+
+# Characters added to scenes with no one but the player: an enemy, an ally and a
+# neutral. Each joins if the story mentions its type, or for one residue of the
+# node's hash modulo the second value.
+CHARACTERS_BY_THEME = [
+    (("star wars", "sci-fi", "space"), 3, [
+        ("Imperial Officer", {"type": "enemy", "mood": "hostile", "description": "A stern officer in a gray uniform", "health": 80}),
+        ("Rebel Scout", {"type": "ally", "mood": "cautious", "description": "A dedicated fighter for the rebellion", "health": 70}),
+        ("Cantina Patron", {"type": "neutral", "mood": "indifferent", "description": "A mysterious individual nursing a drink", "health": 60})
+    ]),
+    (("fantasy", "medieval", "magic"), 3, [
+        ("Dark Sorcerer", {"type": "enemy", "mood": "menacing", "description": "A robed figure with glowing eyes", "health": 75}),
+        ("Elven Scout", {"type": "ally", "mood": "friendly", "description": "A graceful elf with keen eyes", "health": 65}),
+        ("Village Elder", {"type": "neutral", "mood": "wise", "description": "An aged local with vast knowledge", "health": 40})
+    ]),
+    (("cyberpunk",), 3, [
+        ("Corporate Enforcer", {"type": "enemy", "mood": "threatening", "description": "A heavily augmented security operative", "health": 90}),
+        ("Rogue Netrunner", {"type": "ally", "mood": "paranoid", "description": "A skilled hacker with chrome implants", "health": 60}),
+        ("Street Vendor", {"type": "neutral", "mood": "suspicious", "description": "A local selling various wares", "health": 50})
+    ])
+]
+# Modulo 4, so a quarter of the scenes of other themes get none of these...
+DEFAULT_CHARACTERS = (4, [
+    ("Mysterious Adversary", {"type": "enemy", "mood": "hostile", "description": "A shadowy figure with unclear motives.", "health": 70}),
+    ("Wandering Helper", {"type": "ally", "mood": "friendly", "description": "A kind stranger offering assistance.", "health": 60}),
+    ("Local Inhabitant", {"type": "neutral", "mood": "cautious", "description": "A native of this area, wary of outsiders.", "health": 50})
+])
+# ...and one of these instead, so there is still someone to talk to
+FALLBACK_CHARACTERS = [
+    ("Quiet Observer", {"type": "neutral", "mood": "observant", "description": "Someone is watching from a distance.", "health": 55}),
+    ("Local Guide", {"type": "neutral", "mood": "knowledgeable", "description": "Someone who seems to know this area well.", "health": 55})
+]
+
+# Keyword groups the scene state and outcomes are read from
+ENRICHMENT_GROUPS = ["location", "time", "weather", "ambient", "character", "risk", "exploring", "find"]
+_LABELS = [(group, tag) for group in ENRICHMENT_GROUPS for tag in STORY_FEATURES.groups[group]]
+_BITS = {label: bit for bit, label in enumerate(_LABELS)}
+_WORD_MASKS = {
+    word: sum(1 << _BITS[label] for label in labels if label in _BITS)
+    for word, labels in STORY_FEATURES.word_labels.items()
+}
+
+def theme_locations(theme):
+    theme = theme.lower()
+    for keywords, locations in LOCATIONS_BY_THEME:
+        if any(keyword in theme for keyword in keywords):
+            return locations
+    return DEFAULT_LOCATIONS
+
+def theme_characters(theme):
+    """(modulus, [(name, data)]) of the characters added to scenes of theme"""
+    theme = theme.lower()
+    for keywords, modulus, characters in CHARACTERS_BY_THEME:
+        if any(keyword in theme for keyword in keywords):
+            return modulus, characters
+    return DEFAULT_CHARACTERS
+
+def _needs_characters(node_data):
+    """Clean the node's characters; True if it has no one but (maybe) the player"""
+    if "characters" not in node_data or not isinstance(node_data["characters"], dict):
+        node_data["characters"] = {}
+    characters = {name: data for name, data in node_data["characters"].items() if isinstance(data, dict)}
+    node_data["characters"] = characters
+    return len(characters) <= 1 and (not characters or "player" in characters)
+
+def _add_characters(characters, chosen, fallback_pick=None):
+    for name, data in chosen:
+        characters[name] = dict(data)
+    if not characters and fallback_pick is not None:
+        name, data = FALLBACK_CHARACTERS[fallback_pick % len(FALLBACK_CHARACTERS)]
+        characters[name] = dict(data)
+
+def enrich_node(node_data, node_id, theme):
+    """Add scene state and characters to a story node.
+
+    Everything is read from the story's keywords (see story_features.py);
+    what the text does not settle is picked from (story seed, node id), so
+    the same node always gets the same scene.
+    """
+    features = story_features(node_data["story"])
+    seed = story_seed(theme)
+    node_hash = stable_hash(seed, node_id)
+
+    locations = theme_locations(theme)
+    node_data["scene_state"] = {
+        "location": features.first("location") or locations[node_hash % len(locations)],
+        "time_of_day": "night" if features.has("time", "night") else "day",
+        "weather": features.first("weather", "clear"),
+        "ambient": features.first("ambient", "calm")
+    }
+
+    if _needs_characters(node_data):
+        modulus, characters = theme_characters(theme)
+        hinted = features.tags("character")
+        chosen = [(name, data) for i, (name, data) in enumerate(characters)
+                  if data["type"] in hinted or node_hash % modulus == i]
+        fallback_pick = None if hinted else stable_hash(seed, node_id, "fallback")
+        _add_characters(node_data["characters"], chosen, fallback_pick)
+
+def _format_outcome(outcome, theme):
+    return {
+        "health_change": outcome["health_change"],
+        "experience_change": outcome["experience_change"],
+        "inventory_changes": [{"add": change["add"].format(theme=theme)} for change in outcome["inventory_changes"]]
+    }
+
+def ending_outcome(node_id, theme, outcomes):
+    """One of outcomes, picked from (story seed, node id); "{theme}" in item names is filled in"""
+    return _format_outcome(outcomes[stable_hash(story_seed(theme), node_id, "ending") % len(outcomes)], theme)
+
+def _found_items(table, theme, features):
+    items = list(table["default_items"])
+    for theme_key, themed_items in table["items_by_theme"].items():
+        if theme_key in theme.lower():
+            items = list(themed_items)
+            break
+    # Contextual item based on story text
+    if features.has("exploring", "exploring") and features.first("find"):
+        items.append(features.first("find"))
+    return items
+
+def intermediate_outcome(node_id, theme, story_text, table):
+    """A small outcome for a node on the way to an ending.
+
+    table gives the (values, weights) of the experience gained and of the
+    health change in dangerous, restful and other scenes, and optionally
+    the chance of finding an item ("item_chance", "items_by_theme",
+    "default_items"). The draws come from (story seed, node id).
+    """
+    features = story_features(story_text)
+    draws = stable_uniforms(story_seed(theme), node_id, "outcome")
+    risk = features.first("risk", "neutral")
+    outcome = {
+        "health_change": weighted_choice(*table[risk], draws[1]),
+        "experience_change": weighted_choice(*table["experience"], draws[0]),
+        "inventory_changes": []
+    }
+    if draws[2] < table.get("item_chance", 0):
+        items = _found_items(table, theme, features)
+        if items:
+            outcome["inventory_changes"].append({"add": items[min(int(draws[3] * len(items)), len(items) - 1)]})
+    return outcome
+
+def feature_mask(text):
+    """Bit mask of the ENRICHMENT_GROUPS tags found in text (bits in _LABELS order)"""
+    if STORY_FEATURES.phrase_groups.intersection(ENRICHMENT_GROUPS):
+        return sum(1 << _BITS[label] for label in story_features(text).found if label in _BITS)
+    return reduce(or_, map(_WORD_MASKS.get, WORD.findall(text.lower()), repeat(0)), 0)
+
+def _weighted_choices(values, weights, draws):
+    cumulative = np.cumsum(np.array(weights, dtype=float))
+    picks = np.minimum(np.searchsorted(cumulative, draws * cumulative[-1], side="right"), len(values) - 1)
+    return np.array(values)[picks]
+
+def enrich_nodes(nodes, depth, theme, ending_outcomes, intermediate_table):
+    """Fill in what every node of a tree still misses: the ending flag at
+    max depth, scene state and characters, and outcome.
+
+    Gives the same result as enrich_node, ending_outcome and
+    intermediate_outcome node by node, but with NumPy each step runs over
+    all nodes at once: keyword tags become bit masks, and picks and
+    weighted draws are array operations on the nodes' hashes. Without
+    NumPy the nodes are done one at a time.
+    """
+    # Outcomes follow the ending flag a node was built with; the safeguard below only marks it
+    endings = {node_id for node_id, node_data in nodes.items() if node_data.get("is_end", False)}
+    for node_id, node_data in nodes.items():
+        # Make sure nodes at max depth are marked as end nodes (this acts as a safeguard)
+        if len(node_id.split('_')) - 1 >= depth and not node_data.get("is_end", False):
+            print(f"Safeguard: Marking node {node_id} at depth {len(node_id.split('_')) - 1} as ending.")
+            node_data["is_end"] = True
+
+    if np is None:
+        for node_id, node_data in nodes.items():
+            if "scene_state" not in node_data:
+                enrich_node(node_data, node_id, theme)
+            if not node_data.get("outcome"):
+                if node_id in endings:
+                    node_data["outcome"] = ending_outcome(node_id, theme, ending_outcomes)
+                else:
+                    node_data["outcome"] = intermediate_outcome(node_id, theme, node_data["story"], intermediate_table)
+        return
+
+    seed = story_seed(theme)
+    ids = [node_id for node_id, node_data in nodes.items()
+           if "scene_state" not in node_data or not node_data.get("outcome")]
+    if not ids:
+        return
+    masks = np.array([feature_mask(nodes[node_id]["story"]) for node_id in ids], dtype=np.uint64)
+    bits = {label: (masks >> np.uint64(bit)) & np.uint64(1) == 1 for label, bit in _BITS.items()}
+
+    def first(group, names):
+        """Index into names of the first declared tag of group in each node, -1 if none"""
+        picks = np.full(len(ids), -1)
+        for i, tag in reversed(list(enumerate(STORY_FEATURES.groups[group]))):
+            picks[bits[(group, tag)]] = names.index(tag)
+        return picks
+
+    # Scene state and characters
+    state_rows = np.array([i for i, node_id in enumerate(ids) if "scene_state" not in nodes[node_id]], dtype=int)
+    if len(state_rows):
+        hashes = np.array([stable_hash(seed, ids[i]) for i in state_rows], dtype=np.uint64)
+        locations = list(STORY_FEATURES.groups["location"]) + theme_locations(theme)
+        location = first("location", locations)[state_rows]
+        themed = location < 0
+        location[themed] = len(STORY_FEATURES.groups["location"]) + (hashes[themed] % np.uint64(len(theme_locations(theme)))).astype(int)
+        weathers = list(STORY_FEATURES.groups["weather"]) + ["clear"]
+        weather = first("weather", weathers)[state_rows]
+        ambients = list(STORY_FEATURES.groups["ambient"]) + ["calm"]
+        ambient = first("ambient", ambients)[state_rows]
+        night = bits[("time", "night")][state_rows]
+
+        modulus, characters = theme_characters(theme)
+        hinted = np.column_stack([bits[("character", data["type"])][state_rows] for _, data in characters])
+        chosen = hinted | ((hashes % np.uint64(modulus)).astype(int)[:, None] == np.arange(len(characters)))
+        any_hint = np.any(np.column_stack([bits[("character", tag)] for tag in STORY_FEATURES.groups["character"]]), axis=1)[state_rows]
+
+        for row, i in enumerate(state_rows.tolist()):
+            node_id = ids[i]
+            node_data = nodes[node_id]
+            node_data["scene_state"] = {
+                "location": locations[location[row]],
+                "time_of_day": "night" if night[row] else "day",
+                "weather": weathers[weather[row]],
+                "ambient": ambients[ambient[row]]
+            }
+            if _needs_characters(node_data):
+                picked = [characters[j] for j in np.flatnonzero(chosen[row]).tolist()]
+                fallback_pick = None if any_hint[row] else stable_hash(seed, node_id, "fallback")
+                _add_characters(node_data["characters"], picked, fallback_pick)
+
+    # Outcomes
+    outcome_rows = [i for i, node_id in enumerate(ids) if not nodes[node_id].get("outcome")]
+    ending_rows = [i for i in outcome_rows if ids[i] in endings]
+    middle_rows = np.array([i for i in outcome_rows if ids[i] not in endings], dtype=int)
+    if ending_rows:
+        picks = np.array([stable_hash(seed, ids[i], "ending") for i in ending_rows], dtype=np.uint64) % np.uint64(len(ending_outcomes))
+        for i, pick in zip(ending_rows, picks.tolist()):
+            nodes[ids[i]]["outcome"] = _format_outcome(ending_outcomes[pick], theme)
+    if len(middle_rows):
+        digests = b"".join(stable_digest(seed, ids[i], "outcome") for i in middle_rows)
+        draws = np.frombuffer(digests, dtype=">u8").reshape(-1, 4) / 2.0 ** 64
+        experience = _weighted_choices(*intermediate_table["experience"], draws[:, 0])
+        danger = bits[("risk", "danger")][middle_rows]
+        rest = bits[("risk", "rest")][middle_rows] & ~danger
+        health = _weighted_choices(*intermediate_table["neutral"], draws[:, 1])
+        health[danger] = _weighted_choices(*intermediate_table["danger"], draws[danger, 1])
+        health[rest] = _weighted_choices(*intermediate_table["rest"], draws[rest, 1])
+        finds = draws[:, 2] < intermediate_table.get("item_chance", 0)
+        for row, i in enumerate(middle_rows.tolist()):
+            outcome = {"health_change": health[row].item(), "experience_change": experience[row].item(), "inventory_changes": []}
+            if finds[row]:
+                items = _found_items(intermediate_table, theme, story_features(nodes[ids[i]]["story"]))
+                if items:
+                    outcome["inventory_changes"].append({"add": items[min(int(draws[row, 3] * len(items)), len(items) - 1)]})
+            nodes[ids[i]]["outcome"] = outcome
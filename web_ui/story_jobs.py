@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Stories generated at the same time; each one already runs many LLM calls in parallel
+DEFAULT_JOB_WORKERS = int(os.getenv("STORY_JOB_WORKERS", "2"))
+
+# Finished jobs stay available to /jobs/<id> for this long
+JOB_TTL_SECONDS = 3600
+
+class StoryJob:
+    """One story generation running in the background"""
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"  # queued, running, done or failed
+        self.stage = None
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def update(self, stage, done, total):
+        """Progress callback for the generator: progress(stage, done, total)"""
+        self.stage = stage
+        self.done = done
+        self.total = total
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "error": self.error
+        }
+
+class StoryJobQueue:
+    """Runs story generation on a thread pool instead of inside a web request.
+
+    submit() returns straight away with a job the client can poll. A job
+    for the same key as one that is still queued or running is not started
+    again: the request joins the job already in flight.
+    """
+    def __init__(self, workers=DEFAULT_JOB_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="story-job")
+        self.jobs = {}
+        self.in_flight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, work):
+        """Run work(job) in the background and return the job.
+
+        work may report progress through job.update; its return value
+        becomes job.result.
+        """
+        with self._lock:
+            self._prune()
+            job = self.in_flight.get(key)
+            if job:
+                return job
+            job = StoryJob(key)
+            self.jobs[job.id] = job
+            self.in_flight[key] = job
+        self.executor.submit(self._run, job, work)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job, work):
+        job.status = "running"
+        try:
+            job.result = work(job)
+            job.status = "done"
+        except Exception as e:
+            print(f"Story job {job.id} failed: {e}")
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                if self.in_flight.get(job.key) is job:
+                    del self.in_flight[job.key]
+
+    def _prune(self):
+        cutoff = time.time() - JOB_TTL_SECONDS
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.finished < cutoff]:
+            del self.jobs[job_id]
+
+    def shutdown(self, wait=False):
+        """Stop taking jobs; with wait, finish the ones already submitted first"""
+        self.executor.shutdown(wait=wait)
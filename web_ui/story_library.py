@@ -0,0 +1,127 @@
+import hashlib
+import os
+import re
+import socket
+import threading
+import time
+
+# Generated story trees, one JSON file per (theme, depth, choices, arc version)
+STORY_LIBRARY_DIR = "story_library"
+
+# The holder of a lock touches it this often; a lock not touched for
+# LOCK_STALE_SECONDS is assumed to belong to a crashed process
+LOCK_HEARTBEAT_SECONDS = 10
+LOCK_STALE_SECONDS = 60
+LOCK_POLL_SECONDS = 0.5
+
+def normalize_theme(theme):
+    """Themes that differ only in case or spacing share library entries"""
+    return " ".join(theme.lower().split())
+
+def story_path(theme, depth, choices_per_node, arc_version, library_dir=STORY_LIBRARY_DIR):
+    """Library file for a story with these settings"""
+    normalized = normalize_theme(theme)
+    slug = re.sub(r"[^a-z0-9]+", "_", normalized).strip("_")[:40] or "story"
+    # The hash keeps themes apart that reduce to the same slug
+    digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(library_dir, f"{slug}_{digest}_d{depth}_c{choices_per_node}_v{arc_version}.json")
+
+def has_story(theme, depth, choices_per_node, arc_version, library_dir=STORY_LIBRARY_DIR):
+    path = story_path(theme, depth, choices_per_node, arc_version, library_dir)
+    return os.path.exists(path) and os.path.getsize(path) > 0
+
+class StoryLock:
+    """Cross-process lock on one library entry, using an exclusively created lock file
+
+    The lock file holds the owner's host and PID, and the owner refreshes its
+    mtime while it holds the lock. A lock whose owner is no longer running on
+    this host, or that has not been refreshed for LOCK_STALE_SECONDS, is
+    taken over, so a crashed generation only holds up the next game briefly.
+    """
+    def __init__(self, path):
+        self.lock_path = path + ".lock"
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def __enter__(self):
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, f"{socket.gethostname()} {os.getpid()}".encode("utf-8"))
+                os.close(fd)
+                break
+            except FileExistsError:
+                try:
+                    if self._is_stale():
+                        print(f"Removing stale lock {self.lock_path}")
+                        os.remove(self.lock_path)
+                        continue
+                except OSError:
+                    # The other process released the lock in the meantime
+                    continue
+                time.sleep(LOCK_POLL_SECONDS)
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+        return self
+
+    def _is_stale(self):
+        if time.time() - os.path.getmtime(self.lock_path) > LOCK_STALE_SECONDS:
+            return True
+        with open(self.lock_path, 'r') as f:
+            owner = f.read().split()
+        if len(owner) != 2 or owner[0] != socket.gethostname() or not owner[1].isdigit() or os.name != "posix":
+            # Another host (shared library folder) or a lock still being written: go by the heartbeat
+            return False
+        try:
+            os.kill(int(owner[1]), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def _beat(self):
+        while not self._stop.wait(LOCK_HEARTBEAT_SECONDS):
+            try:
+                os.utime(self.lock_path)
+            except OSError as e:
+                print(f"Could not refresh lock {self.lock_path}: {e}")
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        try:
+            os.remove(self.lock_path)
+        except OSError:
+            pass
+
+def get_or_create_story(theme, depth, choices_per_node, arc_version, generate, regenerate=False,
+                        library_dir=STORY_LIBRARY_DIR):
+    """Return the library file for these settings, generating the story only if it is missing.
+
+    generate(path) must write the story tree to path. It runs under a lock,
+    so concurrent games asking for the same story wait for one generation
+    instead of each paying for their own. The finished file is moved into
+    place atomically, so readers never see a half-written story.
+    Pass regenerate=True to replace an existing story with a new one.
+    """
+    path = story_path(theme, depth, choices_per_node, arc_version, library_dir)
+    if not regenerate and has_story(theme, depth, choices_per_node, arc_version, library_dir):
+        print(f"Using saved story from {path}")
+        return path
+
+    os.makedirs(library_dir, exist_ok=True)
+    with StoryLock(path):
+        # Another game may have generated it while we waited for the lock
+        if not regenerate and has_story(theme, depth, choices_per_node, arc_version, library_dir):
+            print(f"Using saved story from {path}")
+            return path
+
+        tmp_path = path[:-len(".json")] + ".tmp.json"
+        generate(tmp_path)
+        os.replace(tmp_path, path)
+        print(f"Story added to library: {path}")
+    return path
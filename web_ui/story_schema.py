@@ -0,0 +1,208 @@
+import contextlib
+import json
+import os
+from json_stream import JsonRepairError, parse_json
+from tracing import tracer
+
+# Schemas use the Gemini response_schema format (OpenAPI subset), so the same
+# dict is sent to the model and used to validate what comes back
+STRING = {"type": "STRING"}
+INTEGER = {"type": "INTEGER"}
+NUMBER = {"type": "NUMBER"}
+BOOLEAN = {"type": "BOOLEAN"}
+
+def object_schema(properties, required=None):
+    """Schema for an object; every property is required unless listed otherwise"""
+    return {"type": "OBJECT", "properties": properties,
+            "required": list(properties) if required is None else required}
+
+def array_schema(items, min_items=None, max_items=None):
+    schema = {"type": "ARRAY", "items": items}
+    if min_items is not None:
+        schema["min_items"] = min_items
+    if max_items is not None:
+        schema["max_items"] = max_items
+    return schema
+
+def structured_output_enabled():
+    """True unless STRUCTURED_OUTPUT is switched off in keys.env"""
+    return os.getenv("STRUCTURED_OUTPUT", "on").lower() not in ("0", "off", "false", "no")
+
+def structured_config(schema):
+    """generate_content kwargs asking the model for JSON matching schema"""
+    if not structured_output_enabled():
+        return {}
+    return {"config": {"response_mime_type": "application/json", "response_schema": schema}}
+
+def validate(data, schema, path=""):
+    """Return the paths of everything in data that does not match schema, e.g. ["choices[2].text"].
+
+    An empty list means data is valid. Strings must not be blank.
+    """
+    kind = schema["type"]
+    if kind == "OBJECT":
+        if not isinstance(data, dict):
+            return [path or "(root)"]
+        problems = []
+        properties = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in data:
+                problems.append(f"{path}.{key}" if path else key)
+        for key, value in data.items():
+            if key in properties:
+                problems.extend(validate(value, properties[key], f"{path}.{key}" if path else key))
+        return problems
+    if kind == "ARRAY":
+        if not isinstance(data, list):
+            return [path]
+        if len(data) < schema.get("min_items", 0) or len(data) > schema.get("max_items", len(data)):
+            return [path]
+        problems = []
+        for i, item in enumerate(data):
+            problems.extend(validate(item, schema["items"], f"{path}[{i}]"))
+        return problems
+    if kind == "STRING":
+        valid = isinstance(data, str) and data.strip() != ""
+    elif kind == "BOOLEAN":
+        valid = isinstance(data, bool)
+    elif kind == "INTEGER":
+        valid = isinstance(data, (int, float)) and not isinstance(data, bool) and float(data).is_integer()
+    else:
+        valid = isinstance(data, (int, float)) and not isinstance(data, bool)
+    return [] if valid else [path]
+
+def trim_to_schema(data, schema):
+    """Drop extra items from the top-level arrays of data that are longer than schema allows"""
+    if isinstance(data, dict):
+        for key, prop in schema.get("properties", {}).items():
+            if prop["type"] == "ARRAY" and isinstance(data.get(key), list) and "max_items" in prop:
+                data[key] = data[key][:prop["max_items"]]
+    return data
+
+def prompt_contents(prompt):
+    """contents for generate_content from a prompt string or a list of parts (e.g. shared prefix and delta)"""
+    return list(prompt) if isinstance(prompt, (list, tuple)) else [prompt]
+
+def reject_reply(client, prompt, schema, model="gemini-2.0-flash"):
+    """Drop the reply to this request from the client's response cache (see CachedClient.evict)"""
+    evict = getattr(client.models, "evict", None)
+    if evict is not None:
+        evict(contents=prompt_contents(prompt), model=model, **structured_config(schema))
+
+def fresh_replies(client):
+    """Context in which this thread's requests go to the model, not the client's response cache"""
+    refreshing = getattr(client, "refreshing", None)
+    return refreshing(this_thread=True) if refreshing else contextlib.nullcontext()
+
+def request_structured(client, prompt, schema, model="gemini-2.0-flash"):
+    """Request JSON matching schema and parse it without validating; None if unparseable
+
+    An unparseable reply is evicted from the response cache.
+    """
+    response = client.models.generate_content(contents=prompt_contents(prompt), model=model, **structured_config(schema))
+    if not response.text:
+        print("Error: Empty response from API")
+        return None
+    with tracer.span("json_repair"):
+        try:
+            return trim_to_schema(parse_json(response.text), schema)
+        except JsonRepairError as e:
+            print(f"Could not parse structured response: {e}")
+            reject_reply(client, prompt, schema, model)
+            return None
+
+def _reask(client, prompt, schema, model, data, problems):
+    """Ask again for only the top-level fields of data that are broken and merge them in.
+
+    A list with some valid items keeps them and only asks for the missing ones.
+    """
+    properties = schema["properties"]
+    fields = []
+    for problem in problems:
+        field = problem.split(".")[0].split("[")[0]
+        if field in properties and field not in fields:
+            fields.append(field)
+
+    kept = {key: value for key, value in data.items() if key in properties and key not in fields}
+    patch_properties = {}
+    wanted = {}
+    notes = []
+    for field in fields:
+        prop = properties[field]
+        if prop["type"] == "ARRAY" and isinstance(data.get(field), list):
+            good_items = [item for item in data[field] if not validate(item, prop["items"])]
+            needed = prop.get("min_items", 0) - len(good_items)
+            if good_items and needed > 0:
+                kept[field] = good_items
+                wanted[field] = needed
+                patch_properties[field] = array_schema(prop["items"], needed, needed)
+                notes.append(f'For "{field}", return only {needed} new item(s), different from the ones already received.')
+                continue
+        patch_properties[field] = prop
+    patch_schema = object_schema(patch_properties)
+
+    reask_prompt = prompt_contents(prompt) + [f"""
+    Your previous reply was incomplete. These parts were missing or invalid: {", ".join(problems[:20])}.
+    Already received (do not repeat it):
+    {json.dumps(kept, indent=2)}
+
+    Return ONLY a JSON object with the field(s) {", ".join(fields)}. {" ".join(notes)}
+    """]
+    tracer.increment("reasks")
+    tracer.increment("reask_fields", len(fields))
+    with tracer.span("reask", fields=fields), fresh_replies(client):
+        patch = request_structured(client, reask_prompt, patch_schema, model)
+    if not isinstance(patch, dict):
+        return data
+    if validate(patch, patch_schema):
+        reject_reply(client, reask_prompt, patch_schema, model)
+
+    merged = dict(data)
+    for field in fields:
+        if field not in patch:
+            continue
+        if field in wanted and isinstance(patch[field], list):
+            merged[field] = kept[field] + patch[field][:wanted[field]]
+        else:
+            merged[field] = patch[field]
+    return merged
+
+def generate_structured(client, prompt, schema, model="gemini-2.0-flash", reasks=None):
+    """Request JSON matching schema and validate it.
+
+    prompt is a string or a list of parts, such as a shared prefix and a
+    node's own context (see story_context.py).
+
+    The model is asked for schema-constrained output (STRUCTURED_OUTPUT).
+    If only some fields come back broken, up to reasks follow-up requests
+    fetch just those fields instead of the whole object again (default
+    STRUCTURED_REASKS, 1); an unparseable reply is requested again in
+    full. Returns the valid dict, or None if it could not be completed.
+    A reply that fails validation is evicted from the response cache, so
+    a later run does not get it back.
+    """
+    if reasks is None:
+        # Read here rather than at import so keys.env has been loaded
+        reasks = int(os.getenv("STRUCTURED_REASKS", "1"))
+    data = request_structured(client, prompt, schema, model)
+    full_reply = True  # data is the reply to prompt itself, not merged from a re-ask
+    for attempt in range(reasks + 1):
+        problems = validate(data, schema)
+        if not problems:
+            return data
+        if full_reply:
+            reject_reply(client, prompt, schema, model)
+        if attempt == reasks:
+            break
+        print(f"Structured reply failed validation ({', '.join(problems[:5])}), asking again")
+        if isinstance(data, dict):
+            data = _reask(client, prompt, schema, model, data, problems)
+            full_reply = False
+        else:
+            tracer.increment("reasks")
+            # The same request again: it must reach the model, not the cached reply just rejected
+            with fresh_replies(client):
+                data = request_structured(client, prompt, schema, model)
+            full_reply = True
+    print(f"Structured reply still invalid: {', '.join(problems[:5])}")
+    return None
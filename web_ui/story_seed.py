@@ -0,0 +1,40 @@
+import hashlib
+import os
+from bisect import bisect_right
+from itertools import accumulate
+
+def stable_digest(*parts):
+    """sha256 of parts; stable_hash and stable_uniforms are read from it"""
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).digest()
+
+def stable_hash(*parts):
+    """A 64-bit hash of parts that is the same in every process.
+
+    Python's hash() of a string is salted per process, so it gave the same
+    node a different location or ending on every run and in every web
+    worker.
+    """
+    return int.from_bytes(stable_digest(*parts)[:8], "big")
+
+def story_seed(theme):
+    """The seed of the stories generated for theme.
+
+    Set STORY_SEED in keys.env for a different (but again reproducible)
+    set of scene states and outcomes.
+    """
+    return stable_hash("story", theme.strip().lower(), os.getenv("STORY_SEED", ""))
+
+def stable_uniforms(*parts):
+    """Four numbers in [0, 1) drawn from parts, the same in every process.
+
+    Used as the random draws of one node (e.g. stable_uniforms(seed,
+    node_id, "outcome")); a whole tree's draws can be read from the
+    concatenated digests at once.
+    """
+    digest = stable_digest(*parts)
+    return [int.from_bytes(digest[i:i + 8], "big") / 2.0 ** 64 for i in range(0, 32, 8)]
+
+def weighted_choice(values, weights, draw):
+    """The value a draw in [0, 1) lands on when values are weighted by weights"""
+    cumulative = list(accumulate(weights))
+    return values[min(bisect_right(cumulative, draw * cumulative[-1]), len(values) - 1)]
@@ -0,0 +1,377 @@
+"""
+SQLite store for generated stories, story arcs and player saves.
+
+One database file can be shared by every game process: it runs in WAL
+mode, so many sessions read at once while a story is being imported.
+Nodes are stored with their parent and depth, and edges are indexed by
+their source node, so a node's children are one indexed query instead of
+a scan over graph["edges"].
+
+Import existing story and arc JSON files with:
+
+    python story_store.py import                 # *.json in the usual folders
+    python story_store.py import my_story.json   # specific files
+    python story_store.py search "star wars"
+"""
+import collections
+import glob
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+DEFAULT_STORE_PATH = "story_store.sqlite"
+
+# Folders scanned by "python story_store.py import" when no files are given
+DEFAULT_IMPORT_DIRS = (".", "visuals", "story_library", "predetermined_stories", "arcs")
+
+# Decoded stories each StoryStore keeps for load_story, most recently used last
+DEFAULT_DECODED_STORIES = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stories (
+    id INTEGER PRIMARY KEY,
+    theme TEXT NOT NULL,
+    theme_key TEXT NOT NULL,
+    depth INTEGER,
+    choices_per_node INTEGER,
+    arc_version TEXT,
+    source_path TEXT UNIQUE,
+    source_mtime REAL,
+    story_state TEXT NOT NULL,
+    flat_graph INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    story_id INTEGER NOT NULL REFERENCES stories(id) ON DELETE CASCADE,
+    node_id TEXT NOT NULL,
+    parent_id TEXT,
+    depth INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    is_end INTEGER NOT NULL DEFAULT 0,
+    story TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (story_id, node_id)
+);
+CREATE TABLE IF NOT EXISTS edges (
+    story_id INTEGER NOT NULL REFERENCES stories(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    from_id TEXT NOT NULL,
+    to_id TEXT NOT NULL,
+    action TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (story_id, position)
+);
+CREATE TABLE IF NOT EXISTS arcs (
+    id INTEGER PRIMARY KEY,
+    theme TEXT NOT NULL,
+    theme_key TEXT NOT NULL,
+    source_path TEXT UNIQUE,
+    arc TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS player_saves (
+    story_id INTEGER NOT NULL REFERENCES stories(id) ON DELETE CASCADE,
+    player_name TEXT NOT NULL,
+    current_node TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (story_id, player_name)
+);
+CREATE INDEX IF NOT EXISTS idx_edges_from ON edges (story_id, from_id);
+CREATE INDEX IF NOT EXISTS idx_nodes_parent ON nodes (story_id, parent_id);
+CREATE INDEX IF NOT EXISTS idx_nodes_depth ON nodes (story_id, depth);
+CREATE INDEX IF NOT EXISTS idx_stories_theme ON stories (theme_key, depth, choices_per_node, arc_version);
+CREATE INDEX IF NOT EXISTS idx_arcs_theme ON arcs (theme_key);
+"""
+
+def normalize_theme(theme):
+    """Themes that differ only in case or spacing are the same theme"""
+    return " ".join(str(theme).lower().split())
+
+def node_depths(node_ids, parents):
+    """Distance of every node from its root, following the parent links"""
+    depths = {}
+    for node_id in node_ids:
+        path = []
+        current = node_id
+        # Walk up until a node of known depth (or a root); the set guards against cycles
+        seen = set()
+        while current not in depths and current in parents and current not in seen:
+            seen.add(current)
+            path.append(current)
+            current = parents[current]
+        depth = depths.get(current, 0)
+        if current not in depths:
+            depths[current] = 0
+        for ancestor in reversed(path):
+            depth += 1
+            depths[ancestor] = depth
+    return depths
+
+class StoryStore:
+    """Stories, arcs and player saves in one SQLite database.
+
+    Each thread gets its own connection, so one StoryStore can be shared
+    by all request threads of a web server. load_story decodes a story
+    once and hands the same dicts to later calls until it is re-imported.
+    """
+    def __init__(self, path=DEFAULT_STORE_PATH, max_decoded=DEFAULT_DECODED_STORIES):
+        self.path = path
+        self._local = threading.local()
+        self._decoded = collections.OrderedDict()  # story id -> ((created_at, source_mtime), story)
+        self._decoded_lock = threading.Lock()
+        self.max_decoded = max_decoded
+        with self._transaction() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        # sqlite3 connections commit on success and roll back on error when used as a context manager
+        return self._connection()
+
+    # --- Stories ---
+
+    def import_story(self, story_data, theme=None, depth=None, choices_per_node=None, arc_version=None,
+                     source_path=None, source_mtime=None):
+        """Store a story in the JSON schema and return its id.
+
+        A story imported earlier from the same source_path is replaced.
+        """
+        story_state = story_data.get("story_state", {})
+        graph = story_data.get("graph", {})
+        flat = "nodes" not in graph or "edges" not in graph
+        nodes = graph if flat else graph["nodes"]
+        edges = [] if flat else graph["edges"]
+        theme = theme or story_state.get("theme") or "unknown"
+        depth = depth if depth is not None else story_state.get("max_depth")
+
+        # The parent of a node is the source of the first edge into it
+        parents = {}
+        for edge in edges:
+            parents.setdefault(edge["to"], edge["from"])
+        if flat:
+            for node_id, node_data in nodes.items():
+                for child_id in node_data.get("children", []):
+                    parents.setdefault(child_id, node_id)
+
+        depths = node_depths(nodes, parents)
+
+        with self._transaction() as conn:
+            if source_path:
+                conn.execute("DELETE FROM stories WHERE source_path = ?", (source_path,))
+            story_id = conn.execute(
+                "INSERT INTO stories (theme, theme_key, depth, choices_per_node, arc_version, source_path, "
+                "source_mtime, story_state, flat_graph, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (theme, normalize_theme(theme), depth, choices_per_node, arc_version, source_path,
+                 source_mtime, json.dumps(story_state), int(flat), time.time())
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO nodes (story_id, node_id, parent_id, depth, position, is_end, story, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((story_id, node_id, parents.get(node_id), depths[node_id], position,
+                  int(bool(node_data.get("is_end", False))), node_data.get("story"), json.dumps(node_data))
+                 for position, (node_id, node_data) in enumerate(nodes.items()))
+            )
+            conn.executemany(
+                "INSERT INTO edges (story_id, position, from_id, to_id, action, data) VALUES (?, ?, ?, ?, ?, ?)",
+                ((story_id, position, edge["from"], edge["to"], edge.get("action"), json.dumps(edge))
+                 for position, edge in enumerate(edges))
+            )
+        return story_id
+
+    def import_story_file(self, path, theme=None, depth=None, choices_per_node=None, arc_version=None):
+        """Import a story JSON file unless the stored copy is already up to date; returns the story id"""
+        source_path = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+        row = self._connection().execute(
+            "SELECT id, source_mtime FROM stories WHERE source_path = ?", (source_path,)
+        ).fetchone()
+        if row and row[1] is not None and row[1] >= mtime:
+            return row[0]
+        with open(path, 'r') as f:
+            story_data = json.load(f)
+        return self.import_story(story_data, theme, depth, choices_per_node, arc_version, source_path, mtime)
+
+    def find_stories(self, theme=None, depth=None, choices_per_node=None, arc_version=None):
+        """Stored stories matching the given settings, newest first, as dicts"""
+        query = "SELECT id, theme, depth, choices_per_node, arc_version, source_path, created_at FROM stories WHERE 1 = 1"
+        params = []
+        for column, value in (("theme_key", normalize_theme(theme) if theme else None), ("depth", depth),
+                              ("choices_per_node", choices_per_node), ("arc_version", arc_version)):
+            if value is not None:
+                query += f" AND {column} = ?"
+                params.append(value)
+        rows = self._connection().execute(query + " ORDER BY created_at DESC", params).fetchall()
+        keys = ("id", "theme", "depth", "choices_per_node", "arc_version", "source_path", "created_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def search_themes(self, text):
+        """Stories whose theme contains text"""
+        rows = self._connection().execute(
+            "SELECT id, theme, depth, choices_per_node FROM stories WHERE theme_key LIKE ? ORDER BY theme_key",
+            (f"%{normalize_theme(text)}%",)
+        ).fetchall()
+        return [dict(zip(("id", "theme", "depth", "choices_per_node"), row)) for row in rows]
+
+    def get_node(self, story_id, node_id):
+        row = self._connection().execute(
+            "SELECT data FROM nodes WHERE story_id = ? AND node_id = ?", (story_id, node_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def children(self, story_id, node_id):
+        """Outgoing edges of a node, in story order"""
+        rows = self._connection().execute(
+            "SELECT data FROM edges WHERE story_id = ? AND from_id = ? ORDER BY position", (story_id, node_id)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def nodes_at_depth(self, story_id, depth):
+        """(node_id, node_data) pairs at one depth of the tree"""
+        rows = self._connection().execute(
+            "SELECT node_id, data FROM nodes WHERE story_id = ? AND depth = ? ORDER BY position", (story_id, depth)
+        ).fetchall()
+        return [(node_id, json.loads(data)) for node_id, data in rows]
+
+    def load_story(self, story_id):
+        """The whole story in the JSON schema, or None if there is no such story.
+
+        Every node row is decoded on the first call only; until the story is
+        imported again, later calls return the same dicts, so treat them as
+        read-only.
+        """
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT story_state, flat_graph, created_at, source_mtime FROM stories WHERE id = ?", (story_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        version = (row[2], row[3])
+        with self._decoded_lock:
+            cached = self._decoded.get(story_id)
+            if cached and cached[0] == version:
+                self._decoded.move_to_end(story_id)
+                return cached[1]
+
+        nodes = {node_id: json.loads(data) for node_id, data in conn.execute(
+            "SELECT node_id, data FROM nodes WHERE story_id = ? ORDER BY position", (story_id,))}
+        if row[1]:
+            story = {"story_state": json.loads(row[0]), "graph": nodes}
+        else:
+            edges = [json.loads(data) for data, in conn.execute(
+                "SELECT data FROM edges WHERE story_id = ? ORDER BY position", (story_id,))]
+            story = {"story_state": json.loads(row[0]), "graph": {"nodes": nodes, "edges": edges}}
+        with self._decoded_lock:
+            self._decoded[story_id] = (version, story)
+            self._decoded.move_to_end(story_id)
+            while len(self._decoded) > self.max_decoded:
+                self._decoded.popitem(last=False)
+        return story
+
+    def delete_story(self, story_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM stories WHERE id = ?", (story_id,))
+        with self._decoded_lock:
+            self._decoded.pop(story_id, None)
+
+    # --- Arcs ---
+
+    def import_arc(self, theme, arc, source_path=None):
+        """Store a story arc (dict or text) and return its id"""
+        with self._transaction() as conn:
+            if source_path:
+                conn.execute("DELETE FROM arcs WHERE source_path = ?", (source_path,))
+            return conn.execute(
+                "INSERT INTO arcs (theme, theme_key, source_path, arc, created_at) VALUES (?, ?, ?, ?, ?)",
+                (theme, normalize_theme(theme), source_path, json.dumps(arc), time.time())
+            ).lastrowid
+
+    def find_arc(self, theme):
+        """Most recently stored arc for theme, or None"""
+        row = self._connection().execute(
+            "SELECT arc FROM arcs WHERE theme_key = ? ORDER BY created_at DESC LIMIT 1", (normalize_theme(theme),)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # --- Player saves ---
+
+    def save_player(self, story_id, player_name, current_node, data):
+        """Insert or replace the save of one player in one story"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO player_saves (story_id, player_name, current_node, data, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (story_id, player_name, current_node, json.dumps(data), time.time())
+            )
+
+    def load_player(self, story_id, player_name):
+        """(current_node, data) of a player's save, or None"""
+        row = self._connection().execute(
+            "SELECT current_node, data FROM player_saves WHERE story_id = ? AND player_name = ?",
+            (story_id, player_name)
+        ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+def create_story_store():
+    """Store at STORY_STORE from keys.env (default story_store.sqlite), or None if STORY_STORE=off"""
+    path = os.getenv("STORY_STORE", DEFAULT_STORE_PATH)
+    if path.lower() in ("0", "off", "false", "no"):
+        return None
+    try:
+        return StoryStore(path)
+    except sqlite3.Error as e:
+        print(f"Could not open story store {path}: {e}")
+        return None
+
+def import_json_file(store, path):
+    """Import one story or arc JSON file; returns a short description of what was stored"""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if isinstance(data, dict) and "graph" in data:
+        story_id = store.import_story_file(path)
+        return f"story {story_id}"
+    if isinstance(data, dict) and "arc" in data:
+        theme = data.get("theme") or os.path.basename(path).rsplit("_arc", 1)[0].replace("_", " ")
+        return f"arc {store.import_arc(theme, data, os.path.abspath(path))}"
+    return None
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("import", "search"):
+        print("Usage: python story_store.py import [files...] | search <theme>")
+        sys.exit(1)
+    store = StoryStore(os.getenv("STORY_STORE", DEFAULT_STORE_PATH))
+
+    if sys.argv[1] == "search":
+        for story in store.search_themes(" ".join(sys.argv[2:])):
+            print(f"{story['id']}: {story['theme']} (depth {story['depth']}, {story['choices_per_node']} choices)")
+        return
+
+    paths = sys.argv[2:] or [path for folder in DEFAULT_IMPORT_DIRS for path in sorted(glob.glob(os.path.join(folder, "*.json")))]
+    for path in paths:
+        try:
+            result = import_json_file(store, path)
+            if result:
+                print(f"Imported {path} as {result}")
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+
+# Buffer size for story files; large enough that each write() call hands the OS big chunks
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+class StreamedObject:
+    """A JSON object whose (key, value) pairs are produced while the file is written.
+
+    Wrap a generator in it to save a tree without first building the whole
+    dict in memory. Each value is serialized on its own, so only one node
+    is held as JSON text at a time.
+    """
+    def __init__(self, items):
+        self.items = items
+
+class StreamedArray:
+    """A JSON array whose items are produced while the file is written"""
+    def __init__(self, items):
+        self.items = items
+
+def _dump_value(value, indent, level):
+    if indent is None:
+        return json.dumps(value, separators=(",", ":"))
+    # Re-indent nested output so it lines up with the streamed structure around it
+    return json.dumps(value, indent=indent).replace("\n", "\n" + " " * (indent * level))
+
+def _write_value(f, value, indent, level):
+    """Write value to f, streaming StreamedObject/StreamedArray item by item"""
+    if isinstance(value, (StreamedObject, StreamedArray)):
+        is_object = isinstance(value, StreamedObject)
+        separator = ":" if indent is None else ": "
+        open_char, close_char = ("{", "}") if is_object else ("[", "]")
+        inner = "" if indent is None else "\n" + " " * (indent * (level + 1))
+        outer = "" if indent is None else "\n" + " " * (indent * level)
+
+        f.write(open_char)
+        first = True
+        for item in value.items:
+            f.write(inner if first else "," + inner)
+            first = False
+            if is_object:
+                key, item = item
+                f.write(json.dumps(str(key)) + separator)
+            _write_value(f, item, indent, level + 1)
+        if not first:
+            f.write(outer)
+        f.write(close_char)
+    else:
+        f.write(_dump_value(value, indent, level))
+
+def write_json_atomic(path, value, indent=None):
+    """Stream value to path as JSON and move it into place atomically.
+
+    value may contain StreamedObject/StreamedArray anywhere; a top-level dict
+    is streamed key by key. Output is compact unless indent is given. The
+    file is written under a temporary name in the same directory and
+    renamed once complete, so readers and crashes never see a partial file.
+    Returns the size of the file in bytes.
+    """
+    if isinstance(value, dict):
+        value = StreamedObject(value.items())
+
+    # Unique per writer, so concurrent saves of the same file do not share a temp file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+            _write_value(f, value, indent, 0)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(path)
+
+def write_story_file(path, story_state, nodes, edges=None, indent=None):
+    """Save a story tree in the usual {"story_state", "graph": {"nodes", "edges"}} layout.
+
+    nodes is an iterable of (node_id, node_data) pairs (e.g. a dict's
+    .items() or a generator) and edges an iterable of edge dicts; both are
+    written one entry at a time. Pass edges=None for saves whose "graph"
+    is just the node dict. Returns the size of the file in bytes.
+    """
+    if edges is None:
+        graph = StreamedObject(nodes)
+    else:
+        graph = StreamedObject([("nodes", StreamedObject(nodes)), ("edges", StreamedArray(edges))])
+    return write_json_atomic(path, StreamedObject([("story_state", story_state), ("graph", graph)]), indent)
@@ -0,0 +1,184 @@
+import collections
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+# Individual spans kept for the JSON export; stage totals and counters are
+# always complete, older spans are dropped once this many are stored
+DEFAULT_MAX_SPANS = 20000
+
+class Tracer:
+    """Collects timed spans and counters for the story generation pipeline.
+
+    with tracer.span("enrich", node_id=...) times one stage of one node.
+    Spans nest per thread, so a "network" span inside "fetch_node" records
+    the node span as its parent. Every stage also keeps a running count,
+    total and maximum duration, which is what the exports report.
+
+    tracer.increment("llm_api_calls") bumps a counter (calls, retries,
+    fallbacks, tokens, bytes written, ...).
+
+    The shared tracer totals the whole process. To trace one story build
+    on its own, give it a Tracer of its own: inside
+    with tracer.collecting(build_tracer), everything the thread records is
+    also added to build_tracer, and tracer.bind(func) carries that onto the
+    worker threads func runs on.
+    """
+    def __init__(self, max_spans=DEFAULT_MAX_SPANS):
+        self.spans = collections.deque(maxlen=max_spans)
+        self.stages = {}
+        self.counters = {}
+        self.started = time.time()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        with self._lock:
+            self._next_id += 1
+            span_id = self._next_id
+        parent_id = stack[-1] if stack else None
+        stack.append(span_id)
+        start = time.perf_counter()
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            stack.pop()
+            self._add(span_id, parent_id, name, started_at, time.perf_counter() - start, attributes)
+
+    def record(self, name, duration, **attributes):
+        """Record a span timed by the caller, for code that cannot be wrapped in span()"""
+        stack = getattr(self._local, "stack", None)
+        with self._lock:
+            self._next_id += 1
+            span_id = self._next_id
+        self._add(span_id, stack[-1] if stack else None, name, time.time() - duration, duration, attributes)
+
+    def _add(self, span_id, parent_id, name, started_at, duration, attributes):
+        collector = getattr(self._local, "collector", None)
+        if collector is not None:
+            collector._add(span_id, parent_id, name, started_at, duration, attributes)
+        with self._lock:
+            stage = self.stages.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            stage["count"] += 1
+            stage["total"] += duration
+            stage["max"] = max(stage["max"], duration)
+            self.spans.append({
+                "id": span_id,
+                "parent": parent_id,
+                "name": name,
+                "start": round(started_at - self.started, 6),
+                "duration": round(duration, 6),
+                "thread": threading.current_thread().name,
+                **attributes
+            })
+
+    def increment(self, name, amount=1):
+        collector = getattr(self._local, "collector", None)
+        if collector is not None:
+            collector.increment(name, amount)
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextlib.contextmanager
+    def collecting(self, collector):
+        """Also record this thread's spans and counters into collector (another Tracer)"""
+        previous = getattr(self._local, "collector", None)
+        self._local.collector = collector
+        try:
+            yield collector
+        finally:
+            self._local.collector = previous
+
+    def bind(self, func):
+        """func, recording into this thread's current collector on whichever thread calls it"""
+        collector = getattr(self._local, "collector", None)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.collecting(collector):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def summary(self):
+        """Stage totals (slowest first) and counters"""
+        with self._lock:
+            stages = {
+                name: {"count": stage["count"], "total": round(stage["total"], 6),
+                       "mean": round(stage["total"] / stage["count"], 6), "max": round(stage["max"], 6)}
+                for name, stage in sorted(self.stages.items(), key=lambda item: -item[1]["total"])
+            }
+            return {"stages": stages, "counters": dict(self.counters)}
+
+    def export_json(self, path, labels=None):
+        """Write the summary, counters and recorded spans to path as JSON"""
+        data = {"labels": labels or {}, "started": self.started, **self.summary()}
+        with self._lock:
+            data["spans"] = list(self.spans)
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+    def prometheus_text(self, labels=None):
+        """Stage timings and counters in the Prometheus text exposition format"""
+        summary = self.summary()
+        base = "".join(f',{key}="{value}"' for key, value in (labels or {}).items())
+        lines = [
+            "# HELP story_stage_seconds Time spent in each story generation stage",
+            "# TYPE story_stage_seconds summary"
+        ]
+        for name, stage in summary["stages"].items():
+            lines.append(f'story_stage_seconds_sum{{stage="{name}"{base}}} {stage["total"]}')
+            lines.append(f'story_stage_seconds_count{{stage="{name}"{base}}} {stage["count"]}')
+        lines.append("# HELP story_stage_seconds_max Slowest single span of each stage")
+        lines.append("# TYPE story_stage_seconds_max gauge")
+        for name, stage in summary["stages"].items():
+            lines.append(f'story_stage_seconds_max{{stage="{name}"{base}}} {stage["max"]}')
+        counter_labels = f"{{{base[1:]}}}" if base else ""
+        for name, value in sorted(summary["counters"].items()):
+            lines.append(f"# TYPE story_{name}_total counter")
+            lines.append(f"story_{name}_total{counter_labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, path, labels=None):
+        with open(path, 'w') as f:
+            f.write(self.prometheus_text(labels))
+
+    def print_summary(self):
+        summary = self.summary()
+        print("Generation time by stage:")
+        for name, stage in summary["stages"].items():
+            print(f"  {name}: {stage['total']:.3f}s over {stage['count']} spans (max {stage['max']:.3f}s)")
+        for name, value in sorted(summary["counters"].items()):
+            print(f"  {name}: {value}")
+
+# Shared by every module of one process; totals every build it has run
+tracer = Tracer()
+
+def traced(name):
+    """Decorator that records every call of a function as a span called name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def trace_export_enabled():
+    """True if STORY_TRACE is switched on in keys.env"""
+    return os.getenv("STORY_TRACE", "off").lower() in ("1", "on", "true", "yes")
+
+def export_trace(basename, labels=None, source=None):
+    """Write basename.trace.json and basename.prom from source (default the shared tracer)"""
+    source = source or tracer
+    source.export_json(f"{basename}.trace.json", labels)
+    source.export_prometheus(f"{basename}.prom", labels)
+    print(f"Trace written to {basename}.trace.json and {basename}.prom")